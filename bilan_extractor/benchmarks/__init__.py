@@ -0,0 +1,6 @@
+"""
+Benchmarks module for the bilan_extractor application.
+
+Runs fully offline: the documents are generated (synthetic_pdf) and the
+Ollama API is replaced by a local stub server (stub_ollama).
+"""
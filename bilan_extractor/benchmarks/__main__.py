@@ -0,0 +1,6 @@
+"""
+Entry point of the benchmarks: python -m bilan_extractor.benchmarks
+"""
+from .runner import main
+
+main()
@@ -0,0 +1,652 @@
+"""
+Module running the end-to-end benchmarks.
+
+A corpus of synthetic balance sheets is generated and processed against the
+stub Ollama server in each mode, every run in fresh processes started exactly
+as a user would start them:
+    single  the single-file CLI, once per document, one after the other
+    batch   the batch mode over the whole corpus
+    serve   the resident server, with every document submitted at once
+    prompt  the extraction requests alone, sent one after the other with the
+            document first (the former prompt layout) then with the shared
+            system prompt first, each against a fresh stub server
+    format  the extraction requests alone, answered in the verbose format then
+            in the compact format constrained by a JSON schema
+For each mode the report gives the throughput (documents per second of wall
+time), the p50/p95 latency of a document, the peak resident memory of the
+process tree and the time spent in each pipeline stage (see utils.metrics).
+The latency of a document is the duration of its process in single mode, the
+sum of its stage durations in batch mode and the time between its submission
+and its result in server mode. The report also gives the import time of the
+entry point, which every CLI invocation pays. The caches are disabled so that
+every run converts and extracts every document. For the prompt layouts it gives
+the time to first token and the number of prompt tokens the server evaluated;
+for the output formats, the tokens generated per document, the request latency
+and whether both formats give the same extracted variables.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+from .stub_ollama import StubOllamaServer, StubSettings
+from .synthetic_pdf import generate_corpus
+from ..utils.metrics import STAGES
+
+# Root of the project, added to the PYTHONPATH of the benchmarked processes
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+# Modes run by default
+MODES = ("single", "batch", "serve", "prompt", "format")
+
+# Layouts of the extraction prompt compared by the prompt mode
+PROMPT_LAYOUTS = ("document_first", "system_prefix")
+
+# Formats of the LLM answer compared by the format mode
+OUTPUT_FORMATS = ("verbose", "compact")
+
+# Seconds between two samples of the memory of a process tree
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+@dataclass
+class ScenarioResult:
+    """
+    Data class holding the measurements of one mode.
+    """
+    mode: str
+    documents: int
+    succeeded: int = 0
+    wall_seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+    peak_rss_bytes: Optional[int] = None
+    records: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def docs_per_second(self) -> float:
+        """Documents processed per second of wall time."""
+        return self.succeeded / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def stage_breakdown(self) -> Dict[str, Dict[str, float]]:
+        """
+        Sum the stage durations of the document records.
+
+        Returns:
+            For each stage, in pipeline order, the total and mean duration and its share of the total
+        """
+        totals: Dict[str, float] = {}
+        for record in self.records:
+            for name, seconds in record.get("stages", {}).items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        overall = sum(totals.values()) or 1.0
+        count = len(self.records) or 1
+        return {name: {"total_seconds": round(seconds, 4), "mean_seconds": round(seconds / count, 4),
+                       "share": round(seconds / overall, 4)}
+                for name, seconds in sorted(totals.items(), key=lambda item: (
+                    STAGES.index(item[0]) if item[0] in STAGES else len(STAGES), item[0]))}
+
+    def llm_totals(self) -> Dict[str, Any]:
+        """Sum the Ollama token counts of the document records."""
+        totals: Dict[str, Any] = {"calls": 0}
+        for record in self.records:
+            totals["calls"] += record.get("llm_calls", 0)
+            for key, value in record.get("llm", {}).items():
+                totals[key] = totals.get(key, 0) + value
+        if totals.get("eval_count") and totals.get("eval_duration"):
+            totals["tokens_per_second"] = round(totals["eval_count"] / (totals["eval_duration"] / 1e9), 2)
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary representation."""
+        return {
+            "mode": self.mode,
+            "documents": self.documents,
+            "succeeded": self.succeeded,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "docs_per_second": round(self.docs_per_second, 3),
+            "latency_p50_seconds": _round(percentile(self.latencies, 0.50)),
+            "latency_p95_seconds": _round(percentile(self.latencies, 0.95)),
+            "peak_rss_mb": round(self.peak_rss_bytes / 2 ** 20, 1) if self.peak_rss_bytes else None,
+            "stages": self.stage_breakdown(),
+            "llm": self.llm_totals(),
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Compute a percentile with the nearest-rank method.
+
+    Args:
+        values: The measured values
+        q: The quantile, between 0 and 1
+
+    Returns:
+        The smallest value greater than or equal to a fraction q of the values, None without values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(q * len(ordered))))
+    return ordered[rank - 1]
+
+
+class RSSSampler:
+    """
+    Background sampling of the resident memory of a process and its descendants (Linux only).
+    """
+
+    def __init__(self, pid: int, interval: float = RSS_SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self) -> "RSSSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self._stop.wait(self.interval)
+
+
+def tree_rss(pid: int) -> int:
+    """
+    Get the resident memory of a process and its descendants.
+
+    Args:
+        pid: The root process
+
+    Returns:
+        The sum of the resident set sizes in bytes, 0 if /proc is not available
+    """
+    page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    children: Dict[int, List[int]] = {}
+    rss: Dict[int, int] = {}
+    try:
+        entries = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                fields = f.read().rsplit(b")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        # Fields after the command name: state, ppid, ... rss is the 22nd
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page_size
+
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, []))
+    return total
+
+
+def run_process(command: List[str], env: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Run a benchmarked process to completion.
+
+    Args:
+        command: The command line
+        env: The environment of the process
+
+    Returns:
+        The wall time in seconds, the exit code and the peak resident memory of the process tree in bytes
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, cwd=str(PROJECT_ROOT),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with RSSSampler(process.pid) as sampler:
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "seconds": time.perf_counter() - start,
+        "returncode": process.returncode,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": max(sampler.peak, usage.ru_maxrss * 1024),
+    }
+
+
+def measure_import_time(module: str, env: Dict[str, str], repeat: int = 5) -> float:
+    """
+    Measure the time to import a module in a fresh interpreter.
+
+    Args:
+        module: The module to import
+        env: The environment of the interpreter
+        repeat: Number of measurements
+
+    Returns:
+        The best time in seconds
+    """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], env=env, cwd=str(PROJECT_ROOT),
+                                capture_output=True, text=True, check=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return min(times)
+
+
+def _read_records(metrics_path: Path) -> List[Dict[str, Any]]:
+    """Read the document records of a --metrics JSON dump."""
+    try:
+        return json.loads(metrics_path.read_text(encoding="utf-8")).get("recent_documents", [])
+    except (OSError, ValueError):
+        return []
+
+
+def bench_single(paths: List[Path], env: Dict[str, str], workdir: Path, stream: bool) -> ScenarioResult:
+    """
+    Run the single-file CLI once per document, sequentially.
+    """
+    result = ScenarioResult(mode="single", documents=len(paths))
+    for index, path in enumerate(paths):
+        metrics_path = workdir / f"single_metrics_{index:04d}.json"
+        command = [sys.executable, "-m", "bilan_extractor.main", str(path), "--no-cache",
+                   "--output", str(workdir / "single" / f"{path.stem}.json"), "--metrics", str(metrics_path)]
+        if not stream:
+            command.append("--no-stream")
+        run = run_process(command, env)
+        result.wall_seconds += run["seconds"]
+        result.peak_rss_bytes = max(result.peak_rss_bytes or 0, run["peak_rss_bytes"])
+        if run["returncode"] == 0:
+            result.succeeded += 1
+            result.latencies.append(run["seconds"])
+        result.records.extend(_read_records(metrics_path))
+    return result
+
+
+def bench_batch(corpus_dir: Path, documents: int, env: Dict[str, str], workdir: Path, stream: bool,
+                concurrency: int, workers: Optional[int]) -> ScenarioResult:
+    """
+    Run the batch mode over the corpus.
+    """
+    result = ScenarioResult(mode="batch", documents=documents)
+    report_path, metrics_path = workdir / "batch_report.json", workdir / "batch_metrics.json"
+    command = [sys.executable, "-m", "bilan_extractor.main", "batch", str(corpus_dir), "--no-cache",
+               "--output-dir", str(workdir / "batch"), "--report", str(report_path),
+               "--metrics", str(metrics_path), "--llm-concurrency", str(concurrency)]
+    if workers:
+        command += ["--workers", str(workers)]
+    if not stream:
+        command.append("--no-stream")
+    run = run_process(command, env)
+    result.wall_seconds, result.peak_rss_bytes = run["seconds"], run["peak_rss_bytes"]
+    result.records = _read_records(metrics_path)
+    try:
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return result
+    for document in report.get("documents", []):
+        if document.get("status") == "ok":
+            result.succeeded += 1
+            if document.get("metrics"):
+                result.latencies.append(document["metrics"]["total_seconds"])
+    return result
+
+
+def _free_port() -> int:
+    """Find a free TCP port on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _http_json(url: str, payload: Optional[Dict[str, Any]] = None, timeout: float = 600) -> Dict[str, Any]:
+    """Send a GET request, or a POST request with a JSON body, and decode the JSON response."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def bench_serve(paths: List[Path], env: Dict[str, str], concurrency: int,
+                startup_timeout: float = 120.0) -> ScenarioResult:
+    """
+    Start the server, submit every document at once and wait for the results.
+    """
+    result = ScenarioResult(mode="serve", documents=len(paths))
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "-m", "bilan_extractor.main", "serve", "--port", str(port),
+               "--workers", str(concurrency), "--no-cache"]
+    process = subprocess.Popen(command, env=env, cwd=str(PROJECT_ROOT),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with RSSSampler(process.pid) as sampler:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                try:
+                    _http_json(base_url + "/health", timeout=1)
+                    break
+                except OSError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("The extraction server did not start")
+                    time.sleep(0.1)
+
+            job_ids = [_http_json(base_url + "/jobs", {"filepath": str(path)})["job_id"] for path in paths]
+            jobs = [_http_json(f"{base_url}/jobs/{job_id}?wait=600") for job_id in job_ids]
+            metrics = _http_json(base_url + "/metrics?format=json")
+        result.peak_rss_bytes = sampler.peak
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    finished = [job for job in jobs if job["status"] == "done"]
+    result.succeeded = len(finished)
+    result.latencies = [job["finished_at"] - job["submitted_at"] for job in finished]
+    if jobs:
+        result.wall_seconds = (max(job["finished_at"] or 0 for job in jobs)
+                               - min(job["submitted_at"] for job in jobs))
+    result.records = metrics.get("recent_documents", [])
+    return result
+
+
+def bench_prompt_layout(paths: List[Path], stub_settings: StubSettings) -> Dict[str, Any]:
+    """
+    Send the extraction request of each document with both prompt layouts and compare them.
+
+    Args:
+        paths: The documents, converted in this process
+        stub_settings: Latency model of the stub servers
+
+    Returns:
+        For each layout, the time to first token (p50, p95, mean) and the prompt tokens
+        evaluated by the server, with the speed-up of the shared system prompt
+    """
+    import ollama
+    from ..services.docling_wrapper import DoclingWrapper
+    from ..services.ollama_client import build_extraction_prompt, build_messages
+
+    prompts = [build_extraction_prompt(DoclingWrapper.parse_to_markdown(str(path), use_cache=False))
+               for path in paths]
+    report: Dict[str, Any] = {}
+    for layout in PROMPT_LAYOUTS:
+        # A fresh server, so that both layouts start from an empty prompt cache
+        server = StubOllamaServer(settings=replace(stub_settings)).start()
+        try:
+            client = ollama.Client(host=server.url)
+            ttfts, prompt_tokens = [], 0
+            for system_prompt, user_prompt in prompts:
+                if layout == "document_first":
+                    messages = [{"role": "user", "content": f"{user_prompt}\n\n{system_prompt}"}]
+                else:
+                    messages = build_messages(user_prompt, system_prompt)
+                start, first_chunk_at, chunk = time.perf_counter(), None, None
+                for chunk in client.chat(model="gemma3", messages=messages, stream=True):
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                ttfts.append(first_chunk_at - start)
+                prompt_tokens += chunk["prompt_eval_count"] or 0
+        finally:
+            server.stop()
+        report[layout] = {
+            "documents": len(prompts),
+            "ttft_p50_seconds": _round(percentile(ttfts, 0.50)),
+            "ttft_p95_seconds": _round(percentile(ttfts, 0.95)),
+            "ttft_mean_seconds": _round(sum(ttfts) / len(ttfts)) if ttfts else None,
+            "prompt_eval_tokens": prompt_tokens,
+        }
+    before, after = report["document_first"]["ttft_mean_seconds"], report["system_prefix"]["ttft_mean_seconds"]
+    report["ttft_speedup"] = round(before / after, 2) if before and after else None
+    return report
+
+
+def bench_output_format(paths: List[Path], stub_settings: StubSettings) -> Dict[str, Any]:
+    """
+    Send the extraction request of each document with both output formats and compare them.
+
+    Args:
+        paths: The documents, converted in this process
+        stub_settings: Latency model of the stub servers
+
+    Returns:
+        For each format, the tokens generated per document and the request latency
+        (p50, mean), with the reduction of the generated tokens and whether both formats
+        give the same extracted variables
+    """
+    import ollama
+    from ..core.parser import expand_compact_output, parse_llm_output
+    from ..models.registry import get_registry
+    from ..models.variables import FinancialVariables
+    from ..services.docling_wrapper import DoclingWrapper
+    from ..services.ollama_client import build_extraction_prompt, build_messages, build_output_schema
+
+    documents = [DoclingWrapper.parse_to_markdown(str(path), use_cache=False) for path in paths]
+    report: Dict[str, Any] = {}
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    for output_format in OUTPUT_FORMATS:
+        schema = build_output_schema() if output_format == "compact" else None
+        server = StubOllamaServer(settings=replace(stub_settings)).start()
+        try:
+            client = ollama.Client(host=server.url)
+            latencies, eval_tokens, results[output_format] = [], 0, []
+            for markdown in documents:
+                system_prompt, user_prompt = build_extraction_prompt(markdown, output_format=output_format)
+                start = time.perf_counter()
+                response = client.chat(model="gemma3", messages=build_messages(user_prompt, system_prompt),
+                                       format=schema, stream=False)
+                latencies.append(time.perf_counter() - start)
+                eval_tokens += response["eval_count"] or 0
+                data = expand_compact_output(parse_llm_output(response["message"]["content"]), get_registry())
+                results[output_format].append(FinancialVariables.from_dict(data).to_dict())
+        finally:
+            server.stop()
+        report[output_format] = {
+            "documents": len(documents),
+            "eval_tokens_per_document": _round(eval_tokens / len(documents)) if documents else None,
+            "latency_p50_seconds": _round(percentile(latencies, 0.50)),
+            "latency_mean_seconds": _round(sum(latencies) / len(latencies)) if latencies else None,
+        }
+    before, after = report["verbose"]["eval_tokens_per_document"], report["compact"]["eval_tokens_per_document"]
+    report["eval_token_reduction"] = round(1 - after / before, 3) if before and after else None
+    report["identical_results"] = results["verbose"] == results["compact"]
+    return report
+
+
+def run_benchmarks(documents: int = 20, pages: int = 4, variables: int = 40, modes=MODES,
+                   concurrency: int = 4, workers: Optional[int] = None, stream: bool = True,
+                   stub_settings: Optional[StubSettings] = None, workdir: Optional[str] = None,
+                   seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a corpus and benchmark each mode against the stub Ollama server.
+
+    Args:
+        documents: Number of documents of the corpus
+        pages: Number of pages per document
+        variables: Number of account rows per document
+        modes: The modes to run (see MODES)
+        concurrency: LLM requests in flight per server in batch mode, worker threads in server mode
+        workers: Number of conversion processes in batch mode (defaults to the number of CPUs)
+        stream: Whether the LLM responses are streamed
+        stub_settings: Latency model of the stub server
+        workdir: Directory for the corpus and the outputs (a temporary directory, deleted afterwards, by default)
+        seed: Seed of the corpus
+
+    Returns:
+        The report, ready to be serialized to JSON
+    """
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+    work_path = Path(workdir or tempfile.mkdtemp(prefix="bilan-bench-"))
+    work_path.mkdir(parents=True, exist_ok=True)
+    stub_settings = stub_settings or StubSettings()
+    server = StubOllamaServer(settings=stub_settings).start()
+    try:
+        corpus_dir = work_path / "corpus"
+        paths = generate_corpus(str(corpus_dir), documents, pages=pages, variables=variables, seed=seed)
+
+        env = dict(os.environ)
+        env.pop("OLLAMA_HOSTS", None)
+        env.update({
+            "OLLAMA_HOST": server.url,
+            "BILAN_CACHE_DIR": str(work_path / "cache"),
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(PROJECT_ROOT), env.get("PYTHONPATH")])),
+        })
+
+        report: Dict[str, Any] = {
+            "config": {
+                "documents": documents, "pages": pages, "variables": variables, "concurrency": concurrency,
+                "workers": workers, "stream": stream, "cpus": os.cpu_count(), "python": sys.version.split()[0],
+                "stub": {"overhead": stub_settings.overhead,
+                         "prompt_tokens_per_second": stub_settings.prompt_tokens_per_second,
+                         "tokens_per_second": stub_settings.tokens_per_second,
+                         "parallel": stub_settings.parallel, "prefix_cache": stub_settings.prefix_cache},
+            },
+            "import_seconds": {module: round(measure_import_time(module, env), 4)
+                               for module in ("bilan_extractor.main", "bilan_extractor.models.variables")},
+            "scenarios": [],
+        }
+        for mode in modes:
+            if mode == "prompt":
+                report["prompt_layout"] = bench_prompt_layout(paths, stub_settings)
+                continue
+            if mode == "format":
+                report["output_format"] = bench_output_format(paths, stub_settings)
+                continue
+            if mode == "single":
+                scenario = bench_single(paths, env, work_path, stream)
+            elif mode == "batch":
+                scenario = bench_batch(corpus_dir, len(paths), env, work_path, stream, concurrency, workers)
+            else:
+                scenario = bench_serve(paths, env, concurrency)
+            report["scenarios"].append(scenario.to_dict())
+        return report
+    finally:
+        server.stop()
+        if workdir is None:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Render a report as a human-readable summary.
+
+    Args:
+        report: The report returned by run_benchmarks
+
+    Returns:
+        The summary, one line per mode followed by the stage breakdowns
+    """
+    config = report["config"]
+    lines = [f"{config['documents']} documents x {config['pages']} pages x {config['variables']} variables, "
+             f"concurrency {config['concurrency']}, {config['cpus']} CPUs",
+             "Import time: " + ", ".join(f"{module} {seconds * 1000:.0f} ms"
+                                         for module, seconds in report["import_seconds"].items()),
+             "",
+             f"{'mode':<8} {'ok':>5} {'docs/s':>8} {'p50 s':>8} {'p95 s':>8} {'RSS MB':>8} {'tok/s':>8}"]
+
+    def cell(value: Any, digits: int) -> str:
+        return f"{value:.{digits}f}" if value is not None else "-"
+
+    for scenario in report["scenarios"]:
+        lines.append(f"{scenario['mode']:<8} {scenario['succeeded']:>2}/{scenario['documents']:<2} "
+                     f"{scenario['docs_per_second']:>8.2f} {cell(scenario['latency_p50_seconds'], 3):>8} "
+                     f"{cell(scenario['latency_p95_seconds'], 3):>8} {cell(scenario['peak_rss_mb'], 1):>8} "
+                     f"{cell(scenario['llm'].get('tokens_per_second'), 1):>8}")
+    for scenario in report["scenarios"]:
+        lines.append("")
+        lines.append(f"Stages ({scenario['mode']}): " + ", ".join(
+            f"{name} {stage['mean_seconds'] * 1000:.1f} ms ({stage['share']:.0%})"
+            for name, stage in scenario["stages"].items()))
+    layouts = report.get("prompt_layout")
+    if layouts:
+        lines.append("")
+        for layout in PROMPT_LAYOUTS:
+            lines.append(f"Prompt layout {layout}: time to first token p50 "
+                         f"{cell(layouts[layout]['ttft_p50_seconds'], 3)} s, mean "
+                         f"{cell(layouts[layout]['ttft_mean_seconds'], 3)} s, "
+                         f"{layouts[layout]['prompt_eval_tokens']} prompt tokens evaluated")
+        lines.append(f"Shared system prompt: time to first token x{cell(layouts['ttft_speedup'], 2)} faster")
+    formats = report.get("output_format")
+    if formats:
+        lines.append("")
+        for output_format in OUTPUT_FORMATS:
+            lines.append(f"Output format {output_format}: {cell(formats[output_format]['eval_tokens_per_document'], 1)} "
+                         f"tokens generated per document, latency p50 "
+                         f"{cell(formats[output_format]['latency_p50_seconds'], 3)} s, mean "
+                         f"{cell(formats[output_format]['latency_mean_seconds'], 3)} s")
+        reduction = formats["eval_token_reduction"]
+        lines.append(f"Compact format: {f'{reduction:.0%}' if reduction is not None else '-'} fewer tokens generated, "
+                     f"{'same' if formats['identical_results'] else 'DIFFERENT'} extracted variables")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run the benchmarks from the command line.
+    """
+    parser = argparse.ArgumentParser(prog="bilan_extractor.benchmarks",
+                                     description="Benchmark the extraction pipeline offline on synthetic documents.")
+    parser.add_argument("--documents", type=int, default=20, help="Number of documents of the corpus")
+    parser.add_argument("--pages", type=int, default=4, help="Number of pages per document")
+    parser.add_argument("--variables", type=int, default=40, help="Number of account rows per document")
+    parser.add_argument("--modes", default=",".join(MODES),
+                        help="Comma-separated modes to run (single, batch, serve, prompt, format)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="LLM requests in flight in batch mode, worker threads in server mode")
+    parser.add_argument("--workers", type=int, default=None, help="Number of conversion processes in batch mode")
+    parser.add_argument("--no-stream", action="store_true", help="Wait for complete LLM responses")
+    parser.add_argument("--overhead", type=float, default=0.05, help="Fixed latency of an LLM request in seconds")
+    parser.add_argument("--prompt-tps", type=float, default=2000.0, help="Prompt evaluation speed in tokens/second")
+    parser.add_argument("--tps", type=float, default=200.0, help="Generation speed in tokens/second")
+    parser.add_argument("--parallel", type=int, default=4, help="Requests processed at once by the stub server")
+    parser.add_argument("--no-prefix-cache", action="store_true",
+                        help="Make the stub server evaluate every prompt in full")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus")
+    parser.add_argument("--workdir", default=None, help="Directory kept with the corpus and the outputs")
+    parser.add_argument("--output", default=None, help="Path to save the JSON report")
+    args = parser.parse_args(argv)
+
+    stub_settings = StubSettings(overhead=args.overhead, prompt_tokens_per_second=args.prompt_tps,
+                                 tokens_per_second=args.tps, parallel=args.parallel,
+                                 prefix_cache=not args.no_prefix_cache)
+    report = run_benchmarks(
+        documents=args.documents,
+        pages=args.pages,
+        variables=args.variables,
+        modes=[mode.strip() for mode in args.modes.split(",") if mode.strip()],
+        concurrency=args.concurrency,
+        workers=args.workers,
+        stream=not args.no_stream,
+        stub_settings=stub_settings,
+        workdir=args.workdir,
+        seed=args.seed
+    )
+    if args.output:
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(format_report(report))
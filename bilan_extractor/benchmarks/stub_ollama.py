@@ -0,0 +1,330 @@
+"""
+Module providing a local HTTP server mimicking the Ollama chat API.
+
+The server answers POST /api/chat, streamed (NDJSON chunks of one token) or
+not, with a canned JSON object holding every configured variable mentioned in
+the prompt (consistent with the identities of the configuration), followed by
+some prose as models often add; a request with a JSON schema as format gets the
+compact answer alone. The latency follows a simple model: a fixed overhead, the
+prompt evaluated at a given speed, then the tokens generated at another; a
+semaphore limits the number of requests processed at once, as
+OLLAMA_NUM_PARALLEL does. Like Ollama's KV cache, the server remembers the last
+prompts (one per parallel slot) and only evaluates the part of a prompt after
+its longest common prefix with one of them. A client closing a stream frees its
+slot, like a cancelled generation. The response metadata (token counts and
+durations) has the same fields as Ollama's. GET /api/version and GET /api/tags
+are answered for health probes.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional, Tuple
+
+from ..core.parser import COMPACT_COLUMNS
+from ..models.registry import get_registry
+
+# Average number of characters per token used to count the prompt tokens
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class StubSettings:
+    """
+    Data class holding the latency model and the responses of the stub server.
+    """
+    overhead: float = 0.05
+    prompt_tokens_per_second: float = 2000.0
+    tokens_per_second: float = 200.0
+    parallel: int = 4
+    trailing_tokens: int = 40
+    response: Optional[Dict[str, Any]] = None
+    year: int = 2023
+    seed: int = 0
+    prefix_cache: bool = True
+
+
+def canned_response(prompt: str, year: int = 2023, seed: int = 0, compact: bool = False) -> Dict[str, Any]:
+    """
+    Build the JSON object answered to an extraction prompt.
+
+    Args:
+        prompt: The prompt sent by the client
+        year: Year of the extracted values
+        seed: Seed of the amounts
+        compact: Whether to answer in the compact format, as requested by a JSON schema
+
+    Returns:
+        The variables of the configuration whose name appears in the prompt, in turn with a
+        net value, gross, depreciation and net values, or a value of unspecified type, for
+        the year and for the previous year labelled "N-1" (the same values in both formats,
+        satisfying the identities of the configuration)
+    """
+    rng = random.Random(seed)
+    registry = get_registry()
+    specs = [spec for spec in registry.variables if spec.name in prompt]
+    names = [spec.name for spec in specs]
+    years = (year, "N-1")
+    amounts = {column: {name: rng.randint(1_000, 5_000_000) for name in names} for column in years}
+    for column in years:
+        for check in registry.checks:
+            if all(name in amounts[column] for name in [check.total] + check.parts):
+                amounts[column][check.total] = sum(amounts[column][part] for part in check.parts)
+
+    response = {}
+    for position, spec in enumerate(specs):
+        name = spec.name
+        values = []
+        for column in years:
+            net = amounts[column][name]
+            if position % 3 == 1:
+                depreciation = rng.randint(1_000, 500_000)
+                values += [(net + depreciation, "brut", column), (depreciation, "amortissement", column),
+                           (net, "net", column)]
+            else:
+                values.append((net, "net" if position % 3 == 0 else "unspecified", column))
+        if compact:
+            response[registry.output_key(spec)] = _compact_rows(values)
+        else:
+            response[name] = {"name": name, "values": [{"value": value, "value_type": value_type, "year": column}
+                                                       for value, value_type, column in values]}
+    return response
+
+
+def _compact_rows(values: List[Tuple[float, str, Any]]) -> List[List[Any]]:
+    """Write (value, value type, year) values as rows of the compact format."""
+    rows: List[List[Any]] = []
+    typed: Dict[Any, List[Any]] = {}
+    for value, value_type, column in values:
+        if value_type == "unspecified":
+            rows.append([value, column])
+            continue
+        if column not in typed:
+            typed[column] = [None, None, None, column]
+            rows.append(typed[column])
+        typed[column][COMPACT_COLUMNS.index(value_type)] = value
+    return rows
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a text into pseudo-tokens of CHARS_PER_TOKEN characters."""
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler implementing the subset of the Ollama API used by the clients.
+    """
+    server_version = "StubOllama"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        """Keep the benchmark output quiet."""
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        """Send a JSON response."""
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        """Handle the version and model list endpoints."""
+        if self.path.startswith("/api/version"):
+            self._send_json(200, {"version": "0.0.0-stub"})
+        elif self.path.startswith("/api/tags"):
+            self._send_json(200, {"models": [{"name": "gemma3:latest", "model": "gemma3:latest"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        """Handle chat requests."""
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if not self.path.startswith("/api/chat"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        settings: StubSettings = self.server.settings
+        messages = request.get("messages", [])
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        # The prompt as rendered by a chat template, the roles included
+        rendered = "".join(f"<{message.get('role')}>{message.get('content', '')}" for message in messages)
+        # A JSON schema as format asks for the compact answer, written on one line like a constrained generation
+        compact = isinstance(request.get("format"), dict)
+        response = settings.response if settings.response is not None else canned_response(
+            prompt, settings.year, settings.seed, compact=compact)
+        content = json.dumps(response, ensure_ascii=False, indent=None if compact else 2)
+        tokens = tokenize(content)
+        if not compact:
+            # A constrained generation stops at the end of the object, a free one goes on with prose
+            tokens += tokenize("\n\nCes valeurs sont extraites du bilan fourni. " * 4)[:settings.trailing_tokens]
+        cached_chars = self.server.reuse_prefix(rendered) if settings.prefix_cache else 0
+        prompt_tokens = max(1, (len(rendered) - cached_chars) // CHARS_PER_TOKEN)
+        model = request.get("model") or "gemma3"
+
+        with self.server.slots:
+            start = time.perf_counter()
+            time.sleep(settings.overhead + prompt_tokens / settings.prompt_tokens_per_second)
+            prompt_done = time.perf_counter()
+            metadata = {
+                "load_duration": int(settings.overhead * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int((prompt_done - start - settings.overhead) * 1e9),
+                "eval_count": len(tokens),
+            }
+
+            if not request.get("stream", True):
+                time.sleep(len(tokens) / settings.tokens_per_second)
+                end = time.perf_counter()
+                metadata.update(eval_duration=int((end - prompt_done) * 1e9), total_duration=int((end - start) * 1e9))
+                self._send_json(200, {"model": model, "message": {"role": "assistant", "content": "".join(tokens)},
+                                      "done": True, "done_reason": "stop", **metadata})
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    time.sleep(1 / settings.tokens_per_second)
+                    self._write_chunk({"model": model, "message": {"role": "assistant", "content": token},
+                                       "done": False})
+                end = time.perf_counter()
+                metadata.update(eval_duration=int((end - prompt_done) * 1e9), total_duration=int((end - start) * 1e9))
+                self._write_chunk({"model": model, "message": {"role": "assistant", "content": ""},
+                                   "done": True, "done_reason": "stop", **metadata})
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading: the generation is cancelled and the slot freed
+                self.close_connection = True
+
+    def _write_chunk(self, payload: Dict[str, Any]) -> None:
+        """Send one NDJSON line as an HTTP chunk."""
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """
+    Stub Ollama server, run in a background thread by the benchmarks.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, settings: Optional[StubSettings] = None):
+        """
+        Initialize the server.
+
+        Args:
+            host: Address to listen on
+            port: Port to listen on (0 picks a free port)
+            settings: Latency model and responses (defaults to StubSettings())
+        """
+        self.settings = settings or StubSettings()
+        self.slots = threading.Semaphore(max(1, self.settings.parallel))
+        self._cached_prompts = deque(maxlen=max(1, self.settings.parallel))
+        self._cache_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        super().__init__((host, port), StubOllamaHandler)
+
+    def reuse_prefix(self, prompt: str) -> int:
+        """
+        Find the part of a prompt already evaluated by a previous request, and remember the prompt.
+
+        Args:
+            prompt: The rendered prompt
+
+        Returns:
+            The length of its longest common prefix with the remembered prompts
+        """
+        with self._cache_lock:
+            cached = max((len(os.path.commonprefix([prompt, previous])) for previous in self._cached_prompts),
+                         default=0)
+            self._cached_prompts.append(prompt)
+        return cached
+
+    def handle_error(self, request, client_address) -> None:
+        """Ignore the connections reset by the client, like a cancelled request, and report other errors."""
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        """The URL to set as OLLAMA_HOST."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        """
+        Serve requests in a background thread.
+
+        Returns:
+            The server itself
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run the stub server from the command line.
+    """
+    parser = argparse.ArgumentParser(prog="bilan_extractor.benchmarks.stub_ollama",
+                                     description="Run a local server mimicking the Ollama chat API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=11434, help="Port to listen on")
+    parser.add_argument("--overhead", type=float, default=0.05, help="Fixed latency of a request in seconds")
+    parser.add_argument("--prompt-tps", type=float, default=2000.0, help="Prompt evaluation speed in tokens/second")
+    parser.add_argument("--tps", type=float, default=200.0, help="Generation speed in tokens/second")
+    parser.add_argument("--parallel", type=int, default=4, help="Number of requests processed at once")
+    parser.add_argument("--no-prefix-cache", action="store_true",
+                        help="Evaluate every prompt in full instead of reusing the common prefix of previous prompts")
+    parser.add_argument("--response", default=None, help="JSON file answered to every request instead of the "
+                                                         "canned variables")
+    args = parser.parse_args(argv)
+
+    response = None
+    if args.response:
+        with open(args.response, "r", encoding="utf-8") as f:
+            response = json.load(f)
+    settings = StubSettings(overhead=args.overhead, prompt_tokens_per_second=args.prompt_tps,
+                            tokens_per_second=args.tps, parallel=args.parallel, response=response,
+                            prefix_cache=not args.no_prefix_cache)
+    server = StubOllamaServer(args.host, args.port, settings)
+    print(f"Stub Ollama server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
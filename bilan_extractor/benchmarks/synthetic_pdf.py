@@ -0,0 +1,243 @@
+"""
+Module for generating synthetic French balance sheets as PDF files.
+
+The documents look like test.pdf: a header naming the company and the closing
+date, then balance sheet and income statement tables with one row per account
+(label, account code for detailed accounts, gross, depreciation, net value of
+the year and of the previous year). The configured variables come first, so
+that the extraction has something to find, followed by filler accounts up to
+the requested number of rows. The PDF is written directly (standard Helvetica
+fonts, one text object per cell), without any third-party library, and the
+output only depends on the seed.
+"""
+import argparse
+import random
+import zlib
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from ..models.registry import get_registry
+
+# A4 page size in points
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+# Right edges of the amount columns, in points
+AMOUNT_COLUMNS = (360, 430, 500, 565)
+
+# Titles of the successive pages
+PAGE_TITLES = ("BILAN ACTIF", "BILAN PASSIF", "COMPTE DE RÉSULTAT", "DÉTAIL DES IMMOBILISATIONS ET AMORTISSEMENTS")
+
+# Filler accounts of the plan comptable général, used after the configured variables
+FILLER_ACCOUNTS = (
+    ("201", "Frais d'établissement"),
+    ("205", "Concessions, brevets et droits similaires"),
+    ("207", "Fonds commercial"),
+    ("211", "Terrains"),
+    ("213", "Constructions"),
+    ("215", "Installations techniques, matériel et outillage"),
+    ("218", "Autres immobilisations corporelles"),
+    ("231", "Immobilisations corporelles en cours"),
+    ("261", "Titres de participation"),
+    ("275", "Dépôts et cautionnements versés"),
+    ("31", "Matières premières et approvisionnements"),
+    ("355", "Produits finis"),
+    ("37", "Stocks de marchandises"),
+    ("409", "Fournisseurs débiteurs"),
+    ("411", "Clients et comptes rattachés"),
+    ("445", "État, taxes sur le chiffre d'affaires"),
+    ("467", "Autres comptes débiteurs ou créditeurs"),
+    ("486", "Charges constatées d'avance"),
+    ("512", "Disponibilités"),
+    ("101", "Capital social ou individuel"),
+    ("106", "Réserves"),
+    ("110", "Report à nouveau"),
+    ("131", "Subventions d'équipement"),
+    ("151", "Provisions pour risques"),
+    ("164", "Emprunts auprès des établissements de crédit"),
+    ("401", "Fournisseurs et comptes rattachés"),
+    ("421", "Personnel, rémunérations dues"),
+    ("431", "Sécurité sociale"),
+    ("444", "État, impôts sur les bénéfices"),
+    ("487", "Produits constatés d'avance"),
+    ("601", "Achats stockés, matières premières"),
+    ("607", "Achats de marchandises"),
+    ("613", "Locations"),
+    ("622", "Rémunérations d'intermédiaires et honoraires"),
+    ("641", "Rémunérations du personnel"),
+    ("645", "Charges de sécurité sociale"),
+    ("681", "Dotations aux amortissements et provisions"),
+    ("701", "Ventes de produits finis"),
+    ("706", "Prestations de services"),
+    ("707", "Ventes de marchandises"),
+)
+
+# Widths of the Helvetica glyphs in thousandths of the font size, for right-aligned amounts
+_GLYPH_WIDTHS = {" ": 278, ",": 278, ".": 278, "-": 333}
+
+
+def _text_width(text: str, size: float) -> float:
+    """Approximate width of a text in Helvetica."""
+    return sum(_GLYPH_WIDTHS.get(c, 556) for c in text) * size / 1000
+
+
+def _pdf_string(text: str) -> bytes:
+    """Encode a text as a PDF literal string in WinAnsiEncoding."""
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def format_amount(value: int) -> str:
+    """Format an amount the French way, with spaces between groups of thousands."""
+    return f"{value:,}".replace(",", " ")
+
+
+def build_rows(variables: int, rng: random.Random) -> List[Tuple[str, List[int]]]:
+    """
+    Build the account rows of a document.
+
+    Args:
+        variables: Number of rows
+        rng: Random generator giving the amounts
+
+    Returns:
+        (label, [gross, depreciation, net, previous net]) pairs, the configured variables first
+    """
+    labels = []
+    for spec in get_registry().variables:
+        # The first alias written as words, as in a real document ("total actif" rather than "actiftotal")
+        label = next((alias for alias in spec.aliases if " " in alias), spec.name.replace("_", " "))
+        label = label[:1].upper() + label[1:]
+        labels.append(label if not spec.code or label.startswith(spec.code) else f"{spec.code} {label}")
+    for index in range(max(0, variables - len(labels))):
+        code, label = FILLER_ACCOUNTS[index % len(FILLER_ACCOUNTS)]
+        labels.append(f"{code}{index // len(FILLER_ACCOUNTS) + 1:04d} {label}")
+
+    rows = []
+    for label in labels[:variables]:
+        gross = rng.randint(1_000, 5_000_000)
+        depreciation = int(gross * rng.uniform(0, 0.8))
+        net = gross - depreciation
+        rows.append((label, [gross, depreciation, net, int(net * rng.uniform(0.8, 1.2))]))
+    return rows
+
+
+def _page_content(title: str, company: str, year: int, rows: List[Tuple[str, List[int]]], first: bool) -> bytes:
+    """Build the content stream of one page."""
+    line_height = min(12.0, 680.0 / max(1, len(rows)))
+    size = max(4.0, min(8.0, line_height * 0.8))
+    ops: List[bytes] = []
+
+    def text(x: float, y: float, value: str, font: str = "F1", font_size: float = size) -> None:
+        ops.append(b"BT /%s %.1f Tf %.2f %.2f Td %s Tj ET" % (font.encode(), font_size, x, y, _pdf_string(value)))
+
+    y = PAGE_HEIGHT - 50
+    if first:
+        text(40, y, company, "F2", 12)
+        text(40, y - 16, f"Exercice clos le 31/12/{year} - Montants exprimés en euros", "F1", 9)
+    y -= 40
+    text(40, y, title, "F2", 11)
+    y -= 20
+    headers = ("Brut", "Amort.", f"Net 31/12/{year}", f"Net 31/12/{year - 1}")
+    for right, header in zip(AMOUNT_COLUMNS, headers):
+        text(right - _text_width(header, size), y, header, "F2")
+    y -= line_height * 1.5
+
+    for label, amounts in rows:
+        text(40, y, label)
+        for right, amount in zip(AMOUNT_COLUMNS, amounts):
+            value = format_amount(amount)
+            text(right - _text_width(value, size), y, value)
+        y -= line_height
+    return b"\n".join(ops)
+
+
+def generate_pdf(path: str, pages: int = 4, variables: int = 40, seed: int = 0, year: int = 2023) -> None:
+    """
+    Write a synthetic balance sheet.
+
+    Args:
+        path: Path of the PDF file to write
+        pages: Number of pages
+        variables: Number of account rows, spread over the pages
+        seed: Seed of the amounts and of the company name
+        year: Year of the closing date
+    """
+    rng = random.Random(seed)
+    pages = max(1, pages)
+    rows = build_rows(variables, rng)
+    per_page = -(-len(rows) // pages) if rows else 0
+    company = f"SAS EXEMPLE {seed:04d}"
+
+    # 1: catalog, 2: page tree, 3-4: fonts, then a page object and its content stream per page
+    objects: List[bytes] = [b"", b"",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+                            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>"]
+    kids = []
+    for page in range(pages):
+        content = zlib.compress(_page_content(PAGE_TITLES[page % len(PAGE_TITLES)], company, year,
+                                              rows[page * per_page:(page + 1) * per_page], page == 0))
+        page_number, content_number = len(objects) + 1, len(objects) + 2
+        kids.append(b"%d 0 R" % page_number)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R "
+                       b"/F2 4 0 R >> >> /Contents %d 0 R >>" % (PAGE_WIDTH, PAGE_HEIGHT, content_number))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(content), content))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    Path(path).write_bytes(bytes(output))
+
+
+def generate_corpus(directory: str, documents: int, pages: int = 4, variables: int = 40,
+                    seed: int = 0) -> List[Path]:
+    """
+    Write a corpus of synthetic balance sheets.
+
+    Args:
+        directory: Directory where the PDF files are written
+        documents: Number of documents
+        pages: Number of pages per document
+        variables: Number of account rows per document
+        seed: Seed of the first document, incremented for each following document
+
+    Returns:
+        The paths of the generated files
+    """
+    output_dir = Path(directory)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(documents):
+        path = output_dir / f"bilan_{index:04d}.pdf"
+        generate_pdf(str(path), pages=pages, variables=variables, seed=seed + index)
+        paths.append(path)
+    return paths
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Generate a corpus from the command line.
+    """
+    parser = argparse.ArgumentParser(prog="bilan_extractor.benchmarks.synthetic_pdf",
+                                     description="Generate synthetic balance sheets.")
+    parser.add_argument("directory", help="Directory where the PDF files are written")
+    parser.add_argument("--documents", type=int, default=10, help="Number of documents")
+    parser.add_argument("--pages", type=int, default=4, help="Number of pages per document")
+    parser.add_argument("--variables", type=int, default=40, help="Number of account rows per document")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the amounts")
+    args = parser.parse_args(argv)
+
+    paths = generate_corpus(args.directory, args.documents, pages=args.pages, variables=args.variables,
+                            seed=args.seed)
+    print(f"{len(paths)} documents written to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
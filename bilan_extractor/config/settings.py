@@ -1,5 +1,8 @@
 """
 Module for application configuration settings.
+
+Importing this module has no side effect: the directories used by the
+application are created by ensure_directories(), called by the entry points.
 """
 import os
 from pathlib import Path
@@ -10,31 +13,101 @@ from typing import Dict, Any
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / "data"
 OUTPUT_DIR = BASE_DIR / "output"
-
-# Create directories if they don't exist
-DATA_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
+LOGS_DIR = BASE_DIR / "logs"
 
 # Ollama settings
 OLLAMA_SETTINGS = {
     "default_model": os.environ.get("OLLAMA_MODEL", "gemma3"),
     "host": os.environ.get("OLLAMA_HOST", "http://localhost:11434"),
+    # Comma-separated list of Ollama servers sharing the requests (defaults to OLLAMA_HOST)
+    "hosts": [host.strip() for host in os.environ.get("OLLAMA_HOSTS", "").split(",") if host.strip()]
+    or [os.environ.get("OLLAMA_HOST", "http://localhost:11434")],
+    # Seconds between two health probes of the servers when there are several
+    "health_check_interval": float(os.environ.get("OLLAMA_HEALTH_CHECK_INTERVAL", "10")),
+    # Stream the responses and stop the generation once the JSON object is closed
+    "stream": os.environ.get("OLLAMA_STREAM", "1").lower() in ("1", "true", "yes"),
+    # Timeout of a request in seconds, including the generation
+    "timeout": float(os.environ.get("OLLAMA_TIMEOUT", "300")),
+    # Retries of a request failing with a transient error (connection, timeout, 429/5xx)
+    "max_retries": int(os.environ.get("OLLAMA_MAX_RETRIES", "3")),
+    # Delay before the first retry in seconds, doubled at each attempt
+    "retry_backoff": float(os.environ.get("OLLAMA_RETRY_BACKOFF", "1.0")),
+    # Maximum number of concurrent requests per server of the asynchronous client (match OLLAMA_NUM_PARALLEL)
+    "max_in_flight": int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", "4")),
+    # How long the server keeps the model, and the KV cache of the shared system prompt, loaded after a request
+    "keep_alive": os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+    # Context size of the model in tokens, 0 for the server's default
+    "num_ctx": int(os.environ.get("OLLAMA_NUM_CTX", "0")),
+    # Maximum number of generated tokens, 0 for no limit
+    "num_predict": int(os.environ.get("OLLAMA_NUM_PREDICT", "0")),
 }
 
 # Docling settings
 DOCLING_SETTINGS = {
     "disable_ssl_verification": os.environ.get("DISABLE_SSL_VERIFICATION", "").lower() in ("1", "true", "yes"),
+    # Processes converting the page ranges of a document in parallel (0 for the number of CPUs, 1 disables it)
+    "page_workers": int(os.environ.get("CONVERSION_PAGE_WORKERS", "0")),
+    # Maximum number of pages converted by one process at a time
+    "pages_per_chunk": int(os.environ.get("CONVERSION_PAGES_PER_CHUNK", "8")),
+    # Documents with fewer pages are converted in a single process
+    "min_pages_to_split": int(os.environ.get("CONVERSION_MIN_PAGES_TO_SPLIT", "8")),
+    # Only convert with docling the pages whose text layer looks like a financial statement
+    "page_triage": os.environ.get("PAGE_TRIAGE", "1").lower() in ("1", "true", "yes"),
+    # Minimum triage score of a converted page
+    "triage_min_score": float(os.environ.get("PAGE_TRIAGE_MIN_SCORE", "3")),
+    # Pages converted before and after each selected page
+    "triage_margin": int(os.environ.get("PAGE_TRIAGE_MARGIN", "1")),
+    # Documents with fewer pages are always converted entirely
+    "triage_min_pages": int(os.environ.get("PAGE_TRIAGE_MIN_PAGES", "4")),
+    # Documents with at least this many pages are converted page by page into a spill file
+    # read through mmap instead of being held in memory (0 disables it)
+    "spill_min_pages": int(os.environ.get("CONVERSION_SPILL_MIN_PAGES", "100")),
+    # Directory of the spill files (defaults to the system temporary directory)
+    "spill_dir": os.environ.get("CONVERSION_SPILL_DIR") or None,
+}
+
+# Prompt settings
+PROMPT_SETTINGS = {
+    # Token budget of the document in the extraction prompt, 0 to always send the whole document
+    "max_document_tokens": int(os.environ.get("PROMPT_MAX_DOCUMENT_TOKENS", "6000")),
+    # Format of the LLM answer: "compact" rows constrained by a JSON schema, or the "verbose" objects
+    "output_format": os.environ.get("PROMPT_OUTPUT_FORMAT", "compact").lower(),
+}
+
+# Extraction settings
+EXTRACTION_SETTINGS = {
+    # Read the variables found in Markdown tables without calling the LLM
+    "rule_based": os.environ.get("RULE_BASED_EXTRACTION", "1").lower() in ("1", "true", "yes"),
+    # Check the accounting consistency of the extracted values and ask the LLM again for the failing variables
+    "consistency_checks": os.environ.get("CONSISTENCY_CHECKS", "1").lower() in ("1", "true", "yes"),
+    # Largest difference accepted per rounded amount by the checks
+    "consistency_tolerance": float(os.environ.get("CONSISTENCY_TOLERANCE", "1")),
+    # Token budget of the document in the prompt asking the failing variables again
+    "recheck_max_tokens": int(os.environ.get("CONSISTENCY_RECHECK_TOKENS", "1500")),
+}
+
+# Cache settings
+CACHE_SETTINGS = {
+    "dir": os.environ.get("BILAN_CACHE_DIR", str(BASE_DIR / "cache")),
+    "markdown_max_bytes": int(os.environ.get("MARKDOWN_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+    "llm_max_bytes": int(os.environ.get("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    "llm_ttl_seconds": float(os.environ.get("LLM_CACHE_TTL_DAYS", "30")) * 24 * 3600,
 }
 
 # Logging settings
 LOGGING_SETTINGS = {
     "level": "INFO",
-    "log_file": str(BASE_DIR / "logs" / "bilan_extractor.log"),
+    "log_file": str(LOGS_DIR / "bilan_extractor.log"),
     "console_output": True,
 }
 
-# Create logs directory if it doesn't exist
-(BASE_DIR / "logs").mkdir(exist_ok=True)
+
+def ensure_directories() -> None:
+    """
+    Create the data, output and logs directories if they don't exist.
+    """
+    for directory in (DATA_DIR, OUTPUT_DIR, LOGS_DIR):
+        directory.mkdir(exist_ok=True)
 
 
 def get_config() -> Dict[str, Any]:
@@ -50,5 +123,8 @@ def get_config() -> Dict[str, Any]:
         "output_dir": str(OUTPUT_DIR),
         "ollama": OLLAMA_SETTINGS,
         "docling": DOCLING_SETTINGS,
+        "prompt": PROMPT_SETTINGS,
+        "extraction": EXTRACTION_SETTINGS,
+        "cache": CACHE_SETTINGS,
         "logging": LOGGING_SETTINGS,
     }
\ No newline at end of file
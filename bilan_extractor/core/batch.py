@@ -0,0 +1,604 @@
+"""
+Module for processing many financial statement files in a single run.
+
+PDF to Markdown conversion is CPU-bound and runs in a process pool, while LLM
+extraction is bound by the Ollama server. The documents go through a pipeline
+of three stages run on an event loop, each with its own number of workers:
+    convert   conversion in the process pool
+    extract   LLM extraction, through an AsyncOllamaClient, whose semaphore keeps
+              the server's parallel slots busy without overrunning them, or
+              through a synchronous client in a thread pool
+    write     output files, result sink and journal
+The stages are connected by bounded queues: a document is converted while the
+previous ones are extracted, and the conversion waits when too many converted
+documents are waiting for the LLM, so that their Markdown does not pile up in
+memory. Long documents are converted into spill files (see utils.spill): only
+the path of the file moves through the queues, and the file is removed once the
+document is extracted, or at the end of a run that was interrupted. The report
+gives the utilisation of each stage (the share of its workers' time spent
+processing documents) and the time it was blocked by the next one, to tune the
+number of workers of each stage. A failure on one document is recorded in the
+report and never interrupts the rest of the batch. Each result can also be
+written to a result sink (see result_sinks) as soon as it is ready, and the
+progress recorded in a job journal (see journal) so that a run restarted after
+a crash only processes the remaining documents. When the configuration of the
+variables changed since a document was extracted, the run is a delta run for
+that document: only the variables added or modified are extracted, from the
+cached Markdown, and merged into the result recorded in the journal.
+"""
+import asyncio
+import contextvars
+import functools
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Optional, Set, Tuple, Union
+
+from .journal import EXTRACTED, JobJournal, outdated_variables
+from .processing import extract_from_markdown, extract_from_markdown_async, merge_results
+from .result_sinks import ResultSink
+from ..models.registry import get_registry
+from ..services.docling_wrapper import DoclingWrapper
+from ..utils.cache import file_sha256
+from ..utils.metrics import DocumentMetrics, get_metrics, resume_document, stage, track_document
+from ..utils.spill import MarkdownSpill
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# File extensions considered as input documents when scanning a directory
+PDF_EXTENSIONS = (".pdf",)
+
+# Stages of the batch pipeline, in order
+PIPELINE_STAGES = ("convert", "extract", "write")
+
+
+@dataclass
+class DocumentResult:
+    """
+    Data class representing the outcome of the processing of one document.
+    """
+    filepath: str
+    status: str = "ok"
+    content_hash: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    stage: Optional[str] = None
+    convert_seconds: float = 0.0
+    extract_seconds: float = 0.0
+    output_file: Optional[str] = None
+    metrics: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary representation (without the extracted values)."""
+        return {
+            "filepath": self.filepath,
+            "status": self.status,
+            "content_hash": self.content_hash,
+            "error": self.error,
+            "stage": self.stage,
+            "convert_seconds": round(self.convert_seconds, 3),
+            "extract_seconds": round(self.extract_seconds, 3),
+            "output_file": self.output_file,
+            "metrics": self.metrics,
+        }
+
+
+@dataclass
+class StageStats:
+    """
+    Data class holding the measurements of a stage of the batch pipeline.
+    """
+    name: str
+    workers: int
+    documents: int = 0
+    busy_seconds: float = 0.0
+    # Time spent waiting for room in the queue of the next stage
+    blocked_seconds: float = 0.0
+    # Largest number of documents waiting in the queue of the stage
+    max_queue: int = 0
+
+    def utilisation(self, elapsed_seconds: float) -> float:
+        """Share of the time of the workers spent processing documents."""
+        if elapsed_seconds <= 0:
+            return 0.0
+        return min(1.0, self.busy_seconds / (self.workers * elapsed_seconds))
+
+    def to_dict(self, elapsed_seconds: float) -> Dict[str, Any]:
+        """Convert to dictionary representation."""
+        return {
+            "workers": self.workers,
+            "documents": self.documents,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "utilisation": round(self.utilisation(elapsed_seconds), 3),
+            "max_queue": self.max_queue,
+        }
+
+
+@dataclass
+class _PipelineJob:
+    """
+    A document moving through the stages of the batch pipeline.
+    """
+    path: Path
+    doc: DocumentResult
+    metrics: DocumentMetrics
+    markdown_text: Optional[Union[str, MarkdownSpill]] = None
+    # Result recorded by the journal, completed with the variables of names (None extracts every variable)
+    previous: Optional[Dict[str, Any]] = None
+    names: Optional[List[str]] = None
+
+
+@dataclass
+class BatchReport:
+    """
+    Data class representing the outcome of a batch run.
+    """
+    documents: List[DocumentResult] = field(default_factory=list)
+    elapsed_seconds: float = 0.0
+    stages: List[StageStats] = field(default_factory=list)
+
+    @property
+    def succeeded(self) -> int:
+        """Number of documents processed successfully."""
+        return sum(1 for doc in self.documents if doc.status == "ok")
+
+    @property
+    def failed(self) -> int:
+        """Number of documents that could not be processed."""
+        return sum(1 for doc in self.documents if doc.status == "failed")
+
+    @property
+    def skipped(self) -> int:
+        """Number of documents already extracted by a previous run of the journal."""
+        return sum(1 for doc in self.documents if doc.status == "skipped")
+
+    @property
+    def docs_per_minute(self) -> float:
+        """Throughput of the run, counting successful documents only."""
+        if self.elapsed_seconds <= 0:
+            return 0.0
+        return self.succeeded * 60.0 / self.elapsed_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary representation."""
+        return {
+            "total": len(self.documents),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "docs_per_minute": round(self.docs_per_minute, 2),
+            "stages": {stats.name: stats.to_dict(self.elapsed_seconds) for stats in self.stages},
+            "documents": [doc.to_dict() for doc in self.documents],
+        }
+
+
+def collect_inputs(source: str) -> List[Path]:
+    """
+    Resolve the input of a batch run into a list of files.
+
+    Args:
+        source: A directory (scanned recursively for PDF files), a glob pattern,
+            or a manifest file listing one path per line (blank lines and lines
+            starting with '#' are ignored, relative paths are resolved against
+            the manifest's directory)
+
+    Returns:
+        The sorted list of files to process, without duplicates
+
+    Raises:
+        FileNotFoundError: If the source matches no file
+    """
+    path = Path(source)
+    if path.is_dir():
+        files = [p for p in path.rglob("*") if p.is_file() and p.suffix.lower() in PDF_EXTENSIONS]
+    elif path.is_file() and path.suffix.lower() not in PDF_EXTENSIONS:
+        files = []
+        for line in path.read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = Path(line)
+            if not entry.is_absolute():
+                entry = path.parent / entry
+            files.append(entry)
+    elif path.is_file():
+        files = [path]
+    else:
+        files = [Path(p) for p in glob.glob(source, recursive=True) if Path(p).is_file()]
+
+    if not files:
+        raise FileNotFoundError(f"No input file found for: {source}")
+
+    unique_files = {}
+    for file in files:
+        unique_files.setdefault(str(file.resolve()), file)
+    return sorted(unique_files.values())
+
+
+def _convert_document(filepath: str, use_cache: bool, refresh_cache: bool, page_workers: int = 1,
+                      content_hash: Optional[str] = None
+                      ) -> Tuple[Union[str, MarkdownSpill], str, float, DocumentMetrics]:
+    """
+    Convert one document to Markdown. Runs in a worker process.
+
+    Args:
+        filepath: Path to the PDF file
+        use_cache: Whether to use the on-disk conversion cache
+        refresh_cache: Whether to ignore cached conversions
+        page_workers: Number of processes converting the page ranges of the document
+        content_hash: SHA-256 of the PDF, when already known
+
+    Returns:
+        A tuple with the Markdown content (a spill file for long documents), the SHA-256
+        of the PDF, the conversion time in seconds and the measurements of the conversion
+        stages, to be merged in the parent process
+    """
+    start = time.perf_counter()
+    content_hash = content_hash or file_sha256(filepath)
+    with track_document(filepath, collect=False) as metrics:
+        markdown_text = DoclingWrapper.parse_document(filepath, use_cache=use_cache, refresh_cache=refresh_cache,
+                                                      page_workers=page_workers)
+    return markdown_text, content_hash, time.perf_counter() - start, metrics
+
+
+def _close_spill(future: Future) -> None:
+    """Remove the spill file of a conversion whose result was abandoned, once it is done."""
+    if not future.cancelled() and future.exception() is None:
+        markdown_text = future.result()[0]
+        if isinstance(markdown_text, MarkdownSpill):
+            markdown_text.close()
+
+
+def _extract_document(markdown_text: Union[str, MarkdownSpill], ollama_client, model: Optional[str], year: Optional[int],
+                      value_type: Optional[str], max_document_tokens: Optional[int], stream: Optional[bool],
+                      on_variable: Optional[Callable[[str, Any], None]],
+                      names: Optional[List[str]] = None) -> Tuple[Dict[str, Any], float]:
+    """
+    Extract the financial variables of one converted document. Runs in a worker thread.
+
+    Returns:
+        A tuple with the extracted variables and the extraction time in seconds
+    """
+    start = time.perf_counter()
+    result = extract_from_markdown(markdown_text, ollama_client, model=model, year=year, value_type=value_type,
+                                   max_document_tokens=max_document_tokens, stream=stream,
+                                   on_variable=on_variable, names=names)
+    return result, time.perf_counter() - start
+
+
+def _output_path_for(filepath: Path, output_dir: Path, used_names: Dict[str, int]) -> Path:
+    """Build a unique output JSON path for a document, even when file names collide."""
+    name = filepath.stem
+    count = used_names.get(name, 0)
+    used_names[name] = count + 1
+    if count:
+        name = f"{name}_{count}"
+    return output_dir / f"{name}.json"
+
+
+def run_batch(filepaths: List[Path], ollama_client, model: Optional[str] = None,
+              year: Optional[int] = None, value_type: Optional[str] = None,
+              output_dir: Optional[str] = None, convert_workers: Optional[int] = None,
+              llm_concurrency: int = 2, use_cache: bool = True,
+              refresh_cache: bool = False, max_document_tokens: Optional[int] = None,
+              stream: Optional[bool] = None,
+              on_variable: Optional[Callable[[str, str, Any], None]] = None,
+              sink: Optional[ResultSink] = None, journal: Optional[JobJournal] = None,
+              llm_workers: Optional[int] = None, queue_size: Optional[int] = None) -> BatchReport:
+    """
+    Process a list of financial statement files concurrently.
+
+    Args:
+        filepaths: The files to process
+        ollama_client: The AsyncOllamaClient or OllamaClient used to query the LLM
+        model: The LLM model to use (defaults to the client's default_model)
+        year: The specific year to extract values for (optional)
+        value_type: The type of value to extract (brut, net, amortissement) (optional)
+        output_dir: Optional directory where one JSON file per document is written
+        convert_workers: Number of conversion processes, the workers of the convert stage
+            (defaults to the number of CPUs)
+        llm_concurrency: Maximum number of concurrent LLM requests of a synchronous client
+            (an AsyncOllamaClient applies its own max_in_flight limit)
+        use_cache: Whether to use the on-disk conversion cache
+        refresh_cache: Whether to ignore cached conversions (the cache is still updated)
+        max_document_tokens: Token budget of each document in the prompt (defaults to the prompt settings)
+        stream: Whether to stream the LLM responses (defaults to the Ollama settings)
+        on_variable: Optional callback called with (filepath, name, data) for each variable as soon
+            as it is extracted, before the document is complete
+        sink: Optional result sink receiving each result as soon as the document is extracted
+            (flushed at the end of the run, closed by the caller)
+        journal: Optional job journal: the documents it records as extracted, or as failed too
+            many times, are skipped, and the state of the others is recorded as they progress;
+            a document extracted with an older configuration of the variables is only extracted
+            for the variables added or modified since
+        llm_workers: Number of documents extracted at once, the workers of the extract stage
+            (defaults to the requests in flight of an AsyncOllamaClient over all its servers,
+            or to llm_concurrency)
+        queue_size: Number of documents waiting between two stages before the previous
+            stage waits (defaults to llm_workers)
+
+    Returns:
+        A BatchReport with the result or the error of every document
+    """
+    output_paths: Dict[Path, Path] = {}
+    if output_dir:
+        out_dir = Path(output_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        used_names: Dict[str, int] = {}
+        for path in filepaths:
+            output_paths[path] = _output_path_for(path, out_dir, used_names)
+
+    return asyncio.run(_run_batch(
+        filepaths, ollama_client, output_paths, model=model, year=year, value_type=value_type,
+        convert_workers=convert_workers, llm_concurrency=llm_concurrency, use_cache=use_cache,
+        refresh_cache=refresh_cache, max_document_tokens=max_document_tokens, stream=stream,
+        on_variable=on_variable, sink=sink, journal=journal, llm_workers=llm_workers, queue_size=queue_size
+    ))
+
+
+async def _run_batch(filepaths: List[Path], ollama_client, output_paths: Dict[Path, Path],
+                     model: Optional[str], year: Optional[int], value_type: Optional[str],
+                     convert_workers: Optional[int], llm_concurrency: int, use_cache: bool,
+                     refresh_cache: bool, max_document_tokens: Optional[int], stream: Optional[bool],
+                     on_variable: Optional[Callable[[str, str, Any], None]],
+                     sink: Optional[ResultSink] = None, journal: Optional[JobJournal] = None,
+                     llm_workers: Optional[int] = None, queue_size: Optional[int] = None) -> BatchReport:
+    """
+    Process the documents in a pipeline of three stages connected by bounded queues:
+    the convert stage converts the documents in the process pool, the extract stage
+    queries the LLM and the write stage writes the results and records them in the
+    journal. A stage waits while the queue of the next one is full, so that the
+    converted Markdown waiting for the LLM stays bounded.
+    """
+    loop = asyncio.get_running_loop()
+    report = BatchReport()
+    results: Dict[Path, DocumentResult] = {}
+    # An AsyncOllamaClient bounds its own requests in flight, a synchronous client runs in the thread pool
+    is_async_client = asyncio.iscoroutinefunction(ollama_client.extract_financial_variables)
+    # Documents are converted in parallel first; the CPUs left over split the pages of each document
+    cpus = os.cpu_count() or 1
+    convert_count = max(1, min(convert_workers or cpus, len(filepaths)))
+    page_workers = max(1, cpus // convert_count)
+    if llm_workers is None:
+        # As many documents in the extract stage as requests the client can have in flight
+        llm_workers = ollama_client.max_in_flight * len(ollama_client.hosts) if is_async_client else llm_concurrency
+    llm_workers = max(1, llm_workers)
+    queue_size = max(1, queue_size if queue_size is not None else llm_workers)
+    pipeline = {name: StageStats(name, workers)
+                for name, workers in zip(PIPELINE_STAGES, (convert_count, llm_workers, 1))}
+    # Fingerprints of the variables, recorded in the journal with each result
+    fingerprints = get_registry().fingerprints
+
+    pending: asyncio.Queue = asyncio.Queue()
+    for path in filepaths:
+        pending.put_nowait(path)
+    pipeline["convert"].max_queue = pending.qsize()
+    to_extract: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    to_write: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    # Spill files of the converted documents not extracted yet, removed at the latest when the run ends
+    spills: Set[MarkdownSpill] = set()
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=convert_count) as convert_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+
+        async def forward(queue: asyncio.Queue, job: Optional[_PipelineJob], stats: StageStats,
+                          consumer: Optional[StageStats] = None) -> None:
+            """Hand a job to the next stage, waiting while its queue is full."""
+            put_start = time.perf_counter()
+            await queue.put(job)
+            stats.blocked_seconds += time.perf_counter() - put_start
+            if consumer is not None:
+                consumer.max_queue = max(consumer.max_queue, queue.qsize())
+
+        async def convert_worker() -> None:
+            stats = pipeline["convert"]
+            while not pending.empty():
+                path = pending.get_nowait()
+                work_start = time.perf_counter()
+                job = await convert(path)
+                stats.busy_seconds += time.perf_counter() - work_start
+                stats.documents += 1
+                if job is None:
+                    continue
+                if job.doc.status == "failed":
+                    await forward(to_write, job, stats, pipeline["write"])
+                else:
+                    await forward(to_extract, job, stats, pipeline["extract"])
+
+        async def extract_worker() -> None:
+            stats = pipeline["extract"]
+            while True:
+                job = await to_extract.get()
+                if job is None:
+                    return
+                work_start = time.perf_counter()
+                with resume_document(job.metrics):
+                    await extract(job)
+                stats.busy_seconds += time.perf_counter() - work_start
+                stats.documents += 1
+                await forward(to_write, job, stats, pipeline["write"])
+
+        async def write_worker() -> None:
+            stats = pipeline["write"]
+            while True:
+                job = await to_write.get()
+                if job is None:
+                    return
+                work_start = time.perf_counter()
+                with resume_document(job.metrics):
+                    try:
+                        write(job)
+                    except Exception as e:
+                        # Recorded like the other failures, so that the run goes on
+                        job.doc.status, job.doc.stage, job.doc.error = "failed", "write", str(e)
+                        logger.error(f"Could not record the result of {job.path}: {e}")
+                stats.busy_seconds += time.perf_counter() - work_start
+                stats.documents += 1
+
+        async def convert(path: Path) -> Optional[_PipelineJob]:
+            """Convert a document, or return None if the journal says it must be skipped."""
+            doc = results[path] = DocumentResult(filepath=str(path))
+            if journal is not None:
+                try:
+                    doc.content_hash = await loop.run_in_executor(None, file_sha256, str(path))
+                except OSError as e:
+                    doc.status, doc.stage, doc.error = "failed", "load", str(e)
+                    logger.error(f"Could not read {path}: {e}")
+                    return None
+                record = journal.get(doc.content_hash)
+                changed, removed = outdated_variables(record, fingerprints) if record is not None else ([], [])
+                delta = record is not None and record.state == EXTRACTED and bool(changed or removed)
+                if journal.is_done(record) and not delta:
+                    if record.state == EXTRACTED:
+                        doc.status, doc.result = "skipped", record.result
+                        logger.info(f"Skipped {path}: already extracted")
+                    else:
+                        doc.status, doc.stage = "failed", record.stage
+                        doc.error = f"{record.error} (given up after {record.attempts} attempts)"
+                        logger.warning(f"Skipped {path}: failed {record.attempts} times")
+                    return None
+                journal.start(doc.content_hash, str(path))
+
+            job = _PipelineJob(path, doc, DocumentMetrics(document=str(path)))
+            if journal is not None and (changed or removed):
+                # The result recorded by an earlier run only misses the variables changed since
+                job.previous, job.names = record.result, changed
+                logger.info(f"Delta run for {path}: {len(changed)} variables added or modified, "
+                            f"{len(removed)} removed since its extraction")
+                if not changed:
+                    return job
+            future = convert_pool.submit(_convert_document, str(path), use_cache, refresh_cache, page_workers,
+                                         doc.content_hash)
+            try:
+                job.markdown_text, doc.content_hash, doc.convert_seconds, conversion = await asyncio.wrap_future(
+                    future)
+            except asyncio.CancelledError:
+                # The conversion may still be running in its process: remove its spill file once it is done
+                future.add_done_callback(_close_spill)
+                raise
+            except Exception as e:
+                doc.status, doc.stage, doc.error = "failed", "convert", str(e)
+                logger.error(f"Conversion failed for {path}: {e}")
+                return job
+            if isinstance(job.markdown_text, MarkdownSpill):
+                spills.add(job.markdown_text)
+            if journal is not None:
+                journal.mark_converted(doc.content_hash)
+            logger.info(f"Converted {path} in {doc.convert_seconds:.1f}s")
+            job.metrics.backend, job.metrics.markdown_chars = conversion.backend, conversion.markdown_chars
+            for name, seconds in conversion.stages.items():
+                job.metrics.add_stage(name, seconds)
+            return job
+
+        async def extract(job: _PipelineJob) -> None:
+            path, doc = job.path, job.doc
+            markdown_text, job.markdown_text = job.markdown_text, None
+            if job.names is not None and not job.names:
+                # Only variables removed from the configuration: nothing to ask the LLM
+                doc.result = merge_results(job.previous, {}, [])
+                return
+            document_callback = functools.partial(on_variable, str(path)) if on_variable is not None else None
+            try:
+                if is_async_client:
+                    extract_start = time.perf_counter()
+                    doc.result = await extract_from_markdown_async(
+                        markdown_text, ollama_client, model=model, year=year, value_type=value_type,
+                        max_document_tokens=max_document_tokens, stream=stream, on_variable=document_callback,
+                        names=job.names)
+                    doc.extract_seconds = time.perf_counter() - extract_start
+                else:
+                    # The context carries the metrics record of the document into the worker thread
+                    doc.result, doc.extract_seconds = await loop.run_in_executor(
+                        llm_pool, contextvars.copy_context().run, _extract_document, markdown_text, ollama_client,
+                        model, year, value_type, max_document_tokens, stream, document_callback, job.names)
+                if job.previous is not None:
+                    doc.result = merge_results(job.previous, doc.result, job.names)
+            except Exception as e:
+                doc.status, doc.stage, doc.error = "failed", "extract", str(e)
+                logger.error(f"Extraction failed for {path}: {e}")
+            finally:
+                if isinstance(markdown_text, MarkdownSpill):
+                    markdown_text.close()
+                    spills.discard(markdown_text)
+
+        def write(job: _PipelineJob) -> None:
+            if job.doc.status == "ok":
+                store(job.path, job.doc)
+            job.metrics.status = job.doc.status
+            job.doc.metrics = job.metrics.to_dict()
+            get_metrics().record(job.metrics)
+            if journal is not None:
+                if job.doc.status == "ok":
+                    # A result the journal records as extracted must never be lost in a sink buffer
+                    if sink is not None:
+                        sink.flush()
+                    journal.mark_extracted(job.doc.content_hash, job.doc.result, fingerprints)
+                else:
+                    journal.mark_failed(job.doc.content_hash, job.doc.stage, job.doc.error)
+
+        def store(path: Path, doc: DocumentResult) -> None:
+            output_path = output_paths.get(path)
+            if output_path is not None:
+                try:
+                    with stage("serialise"):
+                        output_path.write_text(json.dumps(doc.result, indent=2, ensure_ascii=False),
+                                               encoding="utf-8")
+                    doc.output_file = str(output_path)
+                except OSError as e:
+                    doc.status, doc.stage, doc.error = "failed", "write", str(e)
+                    logger.error(f"Could not write results for {path}: {e}")
+                    return
+            if sink is not None:
+                try:
+                    with stage("serialise"):
+                        sink.write(doc.content_hash, str(path), doc.result)
+                except Exception as e:
+                    doc.status, doc.stage, doc.error = "failed", "write", str(e)
+                    logger.error(f"Could not store results for {path}: {e}")
+                    return
+            logger.info(f"Extracted {path} in {doc.extract_seconds:.1f}s")
+
+        async def shut_down() -> None:
+            """Stop each stage once the previous one is done."""
+            await asyncio.gather(*converters)
+            for _ in extractors:
+                await to_extract.put(None)
+            await asyncio.gather(*extractors)
+            await to_write.put(None)
+            await writer
+
+        converters = [loop.create_task(convert_worker()) for _ in range(convert_count)]
+        extractors = [loop.create_task(extract_worker()) for _ in range(llm_workers)]
+        writer = loop.create_task(write_worker())
+        tasks = converters + extractors + [writer, loop.create_task(shut_down())]
+        try:
+            # A stage failing stops the run instead of leaving the others waiting on its queue
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            # Only left running if a stage failed or the run was cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for spill in spills:
+                spill.close()
+            if is_async_client:
+                # The connections are bound to this event loop
+                await ollama_client.aclose()
+            if sink is not None:
+                sink.flush()
+
+    report.elapsed_seconds = time.perf_counter() - start
+    report.documents = [results[path] for path in filepaths if path in results]
+    report.stages = list(pipeline.values())
+    return report
@@ -0,0 +1,389 @@
+"""
+Module checking the accounting consistency of extracted variables.
+
+The Markdown tables of a document are read into numeric grids: one NumPy array
+of amounts per table (NaN for the empty cells), aligned with the row labels and
+with the classified amount columns (gross, depreciation or net, and year). The
+extracted values are laid out the same way, one row per variable and one
+column per kind of amount and year, and each identity is checked on whole
+arrays at once:
+    net        gross - depreciation = net, for every variable and year
+    sum        the total of an identity of the configuration equals the sum of
+               its parts, e.g. total assets = total liabilities
+    subtotal   in each table, a total row equals the sum of the rows above it
+    table      an extracted value is found in the table row of its variable
+A check involving a missing amount is skipped. Only the variables failing a
+check of the extracted values are asked again to the LLM (see core.processing);
+a failed subtotal check describes a table of the document, which a new answer
+cannot fix, and is only reported.
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from .parser import parse_amount
+from .table_extractor import Column, classify_columns, detect_fiscal_year, iter_markdown_tables, match_row
+from ..models.registry import VariableRegistry, VariableSpec, normalize_text
+from ..models.variables import ValueType
+from ..utils.spill import MarkdownSpill, markdown_lines
+
+# Rows holding the total of the rows above them (normalized labels)
+_TOTAL_PATTERN = re.compile(r"^(?:sous )?total\b")
+
+# Rows detailing a part of the row above ("dont ..."), left out of the sums
+_DETAIL_PATTERN = re.compile(r"^dont\b")
+
+# Checks of the extracted values, whose variables can be asked again
+EXTRACTION_CHECKS = ("net", "sum", "table")
+
+# Kinds of amounts compared by the checks, an unspecified amount being compared as a net amount
+BRUT, AMORTISSEMENT, NET = 0, 1, 2
+_KIND_NAMES = ("brut", "amortissement", "net")
+_KIND_OF_TYPE = {ValueType.BRUT: BRUT, ValueType.AMORTISSEMENT: AMORTISSEMENT,
+                 ValueType.NET: NET, ValueType.UNSPECIFIED: NET}
+
+
+@dataclass
+class TableGrid:
+    """
+    Data class holding the amounts of a Markdown table as a numeric grid.
+    """
+    labels: List[str]
+    specs: List[Optional[VariableSpec]]
+    columns: List[Column]
+    values: np.ndarray
+    totals: np.ndarray
+    details: np.ndarray
+    page: Optional[int] = None
+
+
+@dataclass
+class ValueGrid:
+    """
+    Data class holding extracted values as an array of amounts by variable, kind of amount and year.
+    """
+    names: List[str]
+    years: List[Optional[int]]
+    values: np.ndarray
+
+    @classmethod
+    def from_result(cls, result: Dict[str, Any]) -> "ValueGrid":
+        """
+        Lay out extracted values.
+
+        Args:
+            result: The variables in the format of FinancialVariables.to_dict
+
+        Returns:
+            The grid, of shape (variables, 3, years): the first value of each variable,
+            kind and year, the net amount falling back to the unspecified one
+        """
+        names = [name for name, variable in result.items() if isinstance(variable, dict) and variable.get("values")]
+        years = sorted({value.get("year") for name in names for value in result[name]["values"]},
+                       key=lambda year: (year is None, not isinstance(year, int),
+                                         year if isinstance(year, int) else str(year)))
+        year_index = {year: position for position, year in enumerate(years)}
+        type_index = {value_type.value: position for position, value_type in enumerate(ValueType)}
+
+        amounts = np.full((len(names), len(type_index), len(years)), np.nan)
+        for row, name in enumerate(names):
+            for value in result[name]["values"]:
+                cell = (row, type_index[value.get("value_type") or "unspecified"], year_index[value.get("year")])
+                if np.isnan(amounts[cell]) and value.get("value") is not None:
+                    amounts[cell] = float(value["value"])
+
+        net = amounts[:, type_index[ValueType.NET.value]]
+        net = np.where(np.isnan(net), amounts[:, type_index[ValueType.UNSPECIFIED.value]], net)
+        values = np.stack([amounts[:, type_index[ValueType.BRUT.value]],
+                           amounts[:, type_index[ValueType.AMORTISSEMENT.value]], net], axis=1)
+        return cls(names=names, years=years, values=values)
+
+
+@dataclass
+class Inconsistency:
+    """
+    Data class describing a failed accounting check.
+    """
+    check: str
+    names: List[str]
+    year: Optional[int]
+    expected: float
+    found: float
+    detail: str
+    hint: str
+
+    def describe(self) -> str:
+        """Describe the inconsistency, for the logs."""
+        year = f" ({self.year})" if self.year else ""
+        return (f"{self.check} check failed{year}: {self.detail}, found {_format_amount(self.found)} "
+                f"instead of {_format_amount(self.expected)}")
+
+
+def _format_amount(amount: float) -> str:
+    """Format an amount without useless decimals."""
+    return f"{amount:.2f}".rstrip("0").rstrip(".")
+
+
+def _format_year(year: Optional[int]) -> str:
+    """Format the year of a value for the hints."""
+    return f" en {year}" if year else ""
+
+
+def build_grids(markdown_text: Union[str, MarkdownSpill], registry: VariableRegistry) -> List[TableGrid]:
+    """
+    Read the tables of a document into numeric grids.
+
+    Args:
+        markdown_text: The document in Markdown format, or its spill file
+        registry: The registry of the configured variables (see get_registry)
+
+    Returns:
+        The grids of the tables having amount columns, in document order
+    """
+    fiscal_year = detect_fiscal_year(markdown_text)
+    grids = []
+    for table in iter_markdown_tables(markdown_lines(markdown_text)):
+        columns = classify_columns(table.header, fiscal_year)
+        if not columns or not table.rows:
+            continue
+        value_indices = {column.index for column in columns}
+
+        labels, specs, rows = [], [], []
+        for cells in table.rows:
+            labels.append(" ".join(cell for index, cell in enumerate(cells) if cell and index not in value_indices))
+            specs.append(match_row(cells, registry, None, value_indices))
+            amounts = [parse_amount(cells[column.index]) if column.index < len(cells) else None
+                       for column in columns]
+            rows.append([np.nan if amount is None else amount for amount in amounts])
+
+        normalized = [normalize_text(label) for label in labels]
+        grids.append(TableGrid(
+            labels=labels,
+            specs=specs,
+            columns=columns,
+            values=np.array(rows, dtype=float),
+            totals=np.array([bool(_TOTAL_PATTERN.match(label)) for label in normalized], dtype=bool),
+            details=np.array([bool(_DETAIL_PATTERN.match(label)) for label in normalized], dtype=bool),
+            page=table.page,
+        ))
+    return grids
+
+
+def check_net_amounts(values: ValueGrid, tolerance: float = 1.0) -> List[Inconsistency]:
+    """
+    Check that gross - depreciation = net for every variable and year.
+
+    Args:
+        values: The extracted values
+        tolerance: Largest difference accepted per rounded amount
+
+    Returns:
+        The failed checks
+    """
+    expected = values.values[:, BRUT] - values.values[:, AMORTISSEMENT]
+    found = values.values[:, NET]
+    # NaN differences, where an amount is missing, are never above the tolerance
+    failed = np.abs(found - expected) > 2 * tolerance
+
+    inconsistencies = []
+    for row, column in zip(*np.nonzero(failed)):
+        name, year = values.names[row], values.years[column]
+        inconsistencies.append(Inconsistency(
+            check="net", names=[name], year=year, expected=float(expected[row, column]),
+            found=float(found[row, column]), detail=f"{name}: gross - depreciation != net",
+            hint=f"{name}{_format_year(year)} : brut - amortissements = {_format_amount(expected[row, column])} "
+                 f"mais net = {_format_amount(found[row, column])}"))
+    return inconsistencies
+
+
+def check_sums(values: ValueGrid, registry: VariableRegistry, tolerance: float = 1.0) -> List[Inconsistency]:
+    """
+    Check the identities of the configuration (a total equal to the sum of its parts) on the net amounts.
+
+    Args:
+        values: The extracted values
+        registry: The registry holding the identities (see VariableRegistry.checks)
+        tolerance: Largest difference accepted per rounded amount
+
+    Returns:
+        The failed checks
+    """
+    if not registry.checks or not values.names:
+        return []
+    index = {name: row for row, name in enumerate(values.names)}
+    # One row of weights per identity: +1 for the total, -1 for each part
+    weights = np.zeros((len(registry.checks), len(values.names)))
+    applicable = np.zeros(len(registry.checks), dtype=bool)
+    for position, check in enumerate(registry.checks):
+        if all(name in index for name in [check.total] + check.parts):
+            applicable[position] = True
+            weights[position, index[check.total]] = 1.0
+            for part in check.parts:
+                weights[position, index[part]] -= 1.0
+
+    net = values.values[:, NET]
+    residuals = weights @ np.nan_to_num(net)
+    missing = (weights != 0) @ np.isnan(net) > 0
+    allowed = tolerance * np.array([len(check.parts) for check in registry.checks])[:, None]
+    failed = applicable[:, None] & ~missing & (np.abs(residuals) > allowed)
+
+    inconsistencies = []
+    for position, column in zip(*np.nonzero(failed)):
+        check, year = registry.checks[position], values.years[column]
+        found = float(net[index[check.total], column])
+        expected = found - float(residuals[position, column])
+        parts = " + ".join(check.parts)
+        inconsistencies.append(Inconsistency(
+            check="sum", names=[check.total] + check.parts, year=year, expected=expected, found=found,
+            detail=f"{check.name}: {check.total} != {parts}",
+            hint=f"{check.total}{_format_year(year)} = {_format_amount(found)} mais {parts} = "
+                 f"{_format_amount(expected)}" + (f" ({check.description})" if check.description else "")))
+    return inconsistencies
+
+
+def check_subtotals(grid: TableGrid, tolerance: float = 1.0) -> List[Inconsistency]:
+    """
+    Check that each total row of a table equals the sum of the rows above it, in every column.
+    A total can add up the rows since the start of the table or since any total row above it,
+    so that nested subtotals and grand totals are accepted.
+
+    Args:
+        grid: The table
+        tolerance: Largest difference accepted per rounded amount
+
+    Returns:
+        The failed checks
+    """
+    total_rows = np.flatnonzero(grid.totals)
+    if not len(total_rows):
+        return []
+    plain = (~grid.totals & ~grid.details)[:, None]
+    present = plain & ~np.isnan(grid.values)
+    columns = grid.values.shape[1]
+    # Sums and numbers of the amounts of the plain rows above each row
+    cumulative = np.vstack([np.zeros(columns), np.cumsum(np.where(present, grid.values, 0.0), axis=0)])
+    counts = np.vstack([np.zeros(columns, dtype=int), np.cumsum(present, axis=0)])
+
+    starts = np.concatenate([[0], total_rows + 1])
+    sums = cumulative[total_rows][:, None, :] - cumulative[starts][None, :, :]
+    amounts = counts[total_rows][:, None, :] - counts[starts][None, :, :]
+    valid = (starts[None, :] <= total_rows[:, None])[:, :, None] & (amounts > 0)
+    found = grid.values[total_rows]
+    matches = valid & (np.abs(sums - found[:, None, :]) <= tolerance * np.maximum(amounts, 1))
+    failed = ~np.isnan(found) & valid.any(axis=1) & ~matches.any(axis=1)
+
+    # The failure is reported against the sum of rows closest to the total
+    distances = np.where(valid, np.abs(sums - found[:, None, :]), np.inf)
+    closest = distances.argmin(axis=1)
+    inconsistencies = []
+    for position, column in zip(*np.nonzero(failed)):
+        row, start = total_rows[position], starts[closest[position, column]]
+        expected = float(sums[position, closest[position, column], column])
+        names = []
+        for spec in grid.specs[start:row + 1]:
+            if spec is not None and spec.name not in names:
+                names.append(spec.name)
+        year = grid.columns[column].year
+        kind = _KIND_NAMES[_KIND_OF_TYPE[grid.columns[column].value_type]]
+        page = f" (page {grid.page})" if grid.page is not None else ""
+        inconsistencies.append(Inconsistency(
+            check="subtotal", names=names, year=year, expected=expected, found=float(found[position, column]),
+            detail=f"table row '{grid.labels[row]}'{page}, {kind} column",
+            hint=f"{grid.labels[row]}{page}{_format_year(year)} = {_format_amount(found[position, column])} "
+                 f"mais la somme des lignes au-dessus = {_format_amount(expected)}"))
+    return inconsistencies
+
+
+def check_tables(values: ValueGrid, grids: List[TableGrid], tolerance: float = 1.0) -> List[Inconsistency]:
+    """
+    Check that each extracted value is found in a table row of its variable, when the
+    tables have a column of the same kind and year.
+
+    Args:
+        values: The extracted values
+        grids: The tables of the document (see build_grids)
+        tolerance: Largest difference accepted per rounded amount
+
+    Returns:
+        The failed checks
+    """
+    index = {name: row for row, name in enumerate(values.names)}
+    year_index = {year: position for position, year in enumerate(values.years)}
+    rows, kinds, years, amounts = [], [], [], []
+    for grid in grids:
+        matched = [(row, index[spec.name]) for row, spec in enumerate(grid.specs)
+                   if spec is not None and spec.name in index]
+        columns = [(position, _KIND_OF_TYPE[column.value_type], year_index[column.year])
+                   for position, column in enumerate(grid.columns) if column.year in year_index]
+        if not matched or not columns:
+            continue
+        grid_rows, variables = np.array(matched).T
+        positions, column_kinds, column_years = np.array(columns).T
+        amounts.append(grid.values[np.ix_(grid_rows, positions)].ravel())
+        rows.append(np.repeat(variables, len(columns)))
+        kinds.append(np.tile(column_kinds, len(matched)))
+        years.append(np.tile(column_years, len(matched)))
+    if not amounts:
+        return []
+
+    rows, kinds, years, amounts = (np.concatenate(parts) for parts in (rows, kinds, years, amounts))
+    extracted = values.values[rows, kinds, years]
+    present = ~np.isnan(extracted) & ~np.isnan(amounts)
+    # A figure often appears in several tables: the value only has to match one of them
+    checked = np.zeros(values.values.shape, dtype=bool)
+    matched_cells = np.zeros(values.values.shape, dtype=bool)
+    np.logical_or.at(checked, (rows, kinds, years), present)
+    np.logical_or.at(matched_cells, (rows, kinds, years), present & (np.abs(extracted - amounts) <= tolerance))
+
+    inconsistencies = []
+    for row, kind, column in zip(*np.nonzero(checked & ~matched_cells)):
+        name, year = values.names[row], values.years[column]
+        expected = float(amounts[present & (rows == row) & (kinds == kind) & (years == column)][0])
+        found = float(values.values[row, kind, column])
+        inconsistencies.append(Inconsistency(
+            check="table", names=[name], year=year, expected=expected, found=found,
+            detail=f"{name}: {_KIND_NAMES[kind]} value not found in its table row",
+            hint=f"{name}{_format_year(year)} : {_KIND_NAMES[kind]} = {_format_amount(found)} mais "
+                 f"{_format_amount(expected)} dans le tableau"))
+    return inconsistencies
+
+
+def check_consistency(result: Dict[str, Any], registry: VariableRegistry,
+                      grids: Optional[List[TableGrid]] = None, tolerance: float = 1.0) -> List[Inconsistency]:
+    """
+    Run every accounting check on extracted variables.
+
+    Args:
+        result: The variables in the format of FinancialVariables.to_dict
+        registry: The registry of the configured variables (see get_registry)
+        grids: The tables of the document (see build_grids), for the subtotal and table checks
+        tolerance: Largest difference accepted per rounded amount
+
+    Returns:
+        The failed checks
+    """
+    values = ValueGrid.from_result(result)
+    inconsistencies = check_net_amounts(values, tolerance) + check_sums(values, registry, tolerance)
+    for grid in grids or []:
+        inconsistencies += check_subtotals(grid, tolerance)
+    if grids:
+        inconsistencies += check_tables(values, grids, tolerance)
+    return inconsistencies
+
+
+def suspect_names(inconsistencies: List[Inconsistency], registry: VariableRegistry) -> List[str]:
+    """
+    Get the configured variables involved in failed checks of the extracted values.
+
+    Args:
+        inconsistencies: The failed checks
+        registry: The registry of the configured variables (see get_registry)
+
+    Returns:
+        The names of the variables, in configuration order
+    """
+    names = {name for inconsistency in inconsistencies if inconsistency.check in EXTRACTION_CHECKS
+             for name in inconsistency.names}
+    return [spec.name for spec in registry.variables if spec.name in names]
@@ -0,0 +1,230 @@
+"""
+Module for recording the progress of batch runs in a crash-safe journal.
+
+The journal is a SQLite database (WAL mode, one transaction per state change)
+holding the state of each document, identified by the SHA-256 of its content:
+    pending     the processing started
+    converted   the Markdown is ready (and in the conversion cache)
+    extracted   the variables are extracted and written
+    failed      the processing failed, with the stage and the error
+A restarted run skips the extracted documents and retries the others until
+they have been attempted max_attempts times. A document that was being
+processed when the run died stays pending or converted and counts as an
+attempt, so that a file crashing the converter is eventually given up. The
+states are kept per job key (model, year and value type), so that a run with
+other extraction parameters starts afresh.
+
+The result of an extracted document is recorded with the fingerprints of the
+variables it was extracted with (see VariableRegistry.fingerprints). Once the
+configuration changes, outdated_variables() tells which variables were added or
+modified since, so that a delta run only asks for those and merges them into
+the recorded result. Starting a document that was extracted begins a new job,
+with its own attempts.
+"""
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..utils.cache import make_cache_key
+
+# States of a document
+PENDING = "pending"
+CONVERTED = "converted"
+EXTRACTED = "extracted"
+FAILED = "failed"
+
+_JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_key TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    document TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    stage TEXT,
+    error TEXT,
+    result TEXT,
+    variables TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_key, content_hash)
+);
+"""
+
+# Columns added since the first version of the journal, created when an older journal is opened
+_ADDED_COLUMNS = {"variables": "TEXT"}
+
+
+def make_job_key(model: Optional[str], year: Optional[int], value_type: Optional[str]) -> str:
+    """
+    Build the key of the extraction parameters of a run.
+
+    Args:
+        model: The LLM model
+        year: The year to extract values for
+        value_type: The type of value to extract
+
+    Returns:
+        The key
+    """
+    return make_cache_key("batch-job", model, year, value_type)
+
+
+@dataclass
+class JobRecord:
+    """
+    Data class representing the state of a document in the journal.
+    """
+    content_hash: str
+    document: str
+    state: str
+    attempts: int = 0
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    updated_at: float = 0.0
+    # Fingerprints of the variables the result was extracted with (None if recorded before they were tracked)
+    variables: Optional[Dict[str, str]] = None
+
+
+def outdated_variables(record: JobRecord, fingerprints: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """
+    Compare the variables a recorded result was extracted with to the current configuration.
+
+    Args:
+        record: The record of the document
+        fingerprints: The fingerprints of the configured variables (see VariableRegistry.fingerprints)
+
+    Returns:
+        A tuple with the names of the variables added or modified since, in configuration order,
+        and the names of the variables removed from the configuration since. Both are empty for a
+        result recorded before the fingerprints were tracked, which is considered current.
+    """
+    if record.result is None or record.variables is None:
+        return [], []
+    changed = [name for name, fingerprint in fingerprints.items() if record.variables.get(name) != fingerprint]
+    removed = [name for name in record.variables if name not in fingerprints]
+    return changed, removed
+
+
+class JobJournal:
+    """
+    Journal of the documents of batch runs.
+    """
+
+    def __init__(self, path: str, job_key: str = "", max_attempts: int = 3):
+        """
+        Open or create the journal.
+
+        Args:
+            path: Path of the journal database
+            job_key: Key of the extraction parameters (see make_job_key)
+            max_attempts: Number of attempts after which a failed document is no longer retried
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.job_key = job_key
+        self.max_attempts = max(1, max_attempts)
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_JOURNAL_SCHEMA)
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        for name, definition in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    def get(self, content_hash: str) -> Optional[JobRecord]:
+        """
+        Get the state of a document.
+
+        Args:
+            content_hash: SHA-256 of the document content
+
+        Returns:
+            The record of the document, or None if it was never processed
+        """
+        row = self._connection.execute(
+            "SELECT content_hash, document, state, attempts, stage, error, result, updated_at, variables "
+            "FROM jobs WHERE job_key = ? AND content_hash = ?", (self.job_key, content_hash)).fetchone()
+        if row is None:
+            return None
+        record = JobRecord(*row)
+        record.result = json.loads(record.result) if record.result else None
+        record.variables = json.loads(record.variables) if record.variables else None
+        return record
+
+    def is_done(self, record: Optional[JobRecord]) -> bool:
+        """
+        Check whether a document must be skipped: it is extracted or has used all its attempts.
+
+        Args:
+            record: The record of the document (see get)
+
+        Returns:
+            True if the document must not be processed again
+        """
+        if record is None:
+            return False
+        return record.state == EXTRACTED or record.attempts >= self.max_attempts
+
+    def start(self, content_hash: str, document: str) -> None:
+        """
+        Record a new attempt at processing a document. The attempts of a document that
+        was extracted start again, e.g. when a delta run completes its result.
+
+        Args:
+            content_hash: SHA-256 of the document content
+            document: Path of the document
+        """
+        self._connection.execute(
+            "INSERT INTO jobs (job_key, content_hash, document, state, attempts, updated_at) "
+            "VALUES (?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT (job_key, content_hash) DO UPDATE SET document = excluded.document, "
+            "state = excluded.state, attempts = CASE WHEN state = 'extracted' THEN 1 ELSE attempts + 1 END, "
+            "stage = NULL, error = NULL, "
+            "updated_at = excluded.updated_at",
+            (self.job_key, content_hash, document, PENDING, time.time()))
+
+    def mark_converted(self, content_hash: str) -> None:
+        """Record that a document is converted."""
+        self._update(content_hash, state=CONVERTED)
+
+    def mark_extracted(self, content_hash: str, result: Dict[str, Any],
+                       variables: Optional[Dict[str, str]] = None) -> None:
+        """Record that a document is extracted, with its result and the fingerprints of its variables."""
+        self._update(content_hash, state=EXTRACTED, result=json.dumps(result, ensure_ascii=False),
+                     variables=json.dumps(variables) if variables is not None else None)
+
+    def mark_failed(self, content_hash: str, stage: str, error: str) -> None:
+        """Record that the processing of a document failed at a stage."""
+        self._update(content_hash, state=FAILED, stage=stage, error=error)
+
+    def _update(self, content_hash: str, **fields: Any) -> None:
+        """Update the fields of a document."""
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connection.execute(f"UPDATE jobs SET {assignments} WHERE job_key = ? AND content_hash = ?",
+                                 (*fields.values(), self.job_key, content_hash))
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Count the documents of the job key in each state.
+
+        Returns:
+            The number of documents per state
+        """
+        return dict(self._connection.execute(
+            "SELECT state, COUNT(*) FROM jobs WHERE job_key = ? GROUP BY state", (self.job_key,)).fetchall())
+
+    def close(self) -> None:
+        """Close the database."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self) -> "JobJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,158 @@
+"""
+Module for picking the pages of a PDF worth a docling conversion.
+
+docling's layout and table models are by far the most expensive part of the
+pipeline, while most pages of an annual report are narrative text without any
+figure to extract. Before the conversion, the text layer of each page (read
+with PyPDF2) is scored for balance sheet markers: statement headings and
+totals ("Bilan actif", "Total passif"...), aliases and account codes of the
+configured variables, and the share of lines holding amounts. Only the pages
+reaching a minimum score, plus a margin of neighbouring pages, are converted.
+Pages without a text layer (scans) cannot be scored and are always kept, and
+when no page reaches the score the whole document is converted. Every
+decision is logged so that misses can be audited.
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+from ..models.registry import AliasMatcher, VariableRegistry, normalize_text
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# Headings and totals of financial statements, normalized
+STATEMENT_MARKERS = (
+    "bilan actif", "bilan passif", "actif immobilise", "actif circulant", "total actif",
+    "total passif", "total general", "capitaux propres", "compte de resultat",
+    "resultat de l exercice", "chiffre d affaires net", "produits d exploitation", "charges d exploitation",
+    "amortissements et provisions", "amortissements et depreciations", "dotations aux amortissements",
+    "immobilisations corporelles", "immobilisations incorporelles", "immobilisations financieres",
+    "dettes fournisseurs", "exercice n", "exercice n 1",
+)
+
+# Amounts as printed in French statements: grouped thousands or long digit runs
+AMOUNT_PATTERN = re.compile(r"(?<![\d/])(?:\d{1,3}(?:[ \u00a0\u202f.]\d{3})+|\d{5,})(?:,\d+)?(?![\d/])")
+
+# Weights of the page score
+MARKER_WEIGHT = 1.0
+ALIAS_WEIGHT = 1.0
+CODE_WEIGHT = 2.0
+NUMERIC_WEIGHT = 4.0
+
+# Matcher of the statement markers, built on first use
+_marker_matcher: Optional[AliasMatcher] = None
+
+
+@dataclass
+class PageScore:
+    """
+    Data class holding the triage score of a page and what it is made of.
+    """
+    page: int
+    score: float = 0.0
+    has_text: bool = True
+    markers: List[str] = field(default_factory=list)
+    variables: List[str] = field(default_factory=list)
+    numeric_density: float = 0.0
+
+    def describe(self) -> str:
+        """One-line description of the score, for the logs."""
+        if not self.has_text:
+            return f"page {self.page}: no text layer"
+        return (f"page {self.page}: score {self.score:.1f} (markers {', '.join(self.markers) or '-'}; "
+                f"variables {', '.join(self.variables) or '-'}; amounts on {self.numeric_density:.0%} of lines)")
+
+
+def _get_marker_matcher() -> AliasMatcher:
+    """Get the matcher of the statement markers."""
+    global _marker_matcher
+    if _marker_matcher is None:
+        _marker_matcher = AliasMatcher((marker, marker) for marker in STATEMENT_MARKERS)
+    return _marker_matcher
+
+
+def score_page(page: int, text: str, registry: VariableRegistry) -> PageScore:
+    """
+    Score the text layer of a page.
+
+    Args:
+        page: The page number, 1-based
+        text: The text extracted from the page
+        registry: The registry of the variables to extract
+
+    Returns:
+        The score of the page with its components
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return PageScore(page=page, has_text=False)
+
+    words = normalize_text(text).split()
+    markers = sorted({marker for _, _, marker in _get_marker_matcher().find(words)})
+    aliases, codes = set(), set()
+    for match in registry.find(text):
+        (codes if match.kind == "code" else aliases).add(match.name)
+    density = sum(1 for line in lines if AMOUNT_PATTERN.search(line)) / len(lines)
+
+    score = (MARKER_WEIGHT * len(markers) + ALIAS_WEIGHT * len(aliases) + CODE_WEIGHT * len(codes)
+             + NUMERIC_WEIGHT * density)
+    return PageScore(page=page, score=score, markers=markers, variables=sorted(aliases | codes),
+                     numeric_density=density)
+
+
+def select_pages(page_texts: Iterable[str], registry: VariableRegistry, min_score: float = 3.0,
+                 margin: int = 1, document: str = "") -> List[int]:
+    """
+    Select the pages to convert from their text layer.
+
+    Args:
+        page_texts: The text of each page, in page order (consumed once, one page at a time)
+        registry: The registry of the variables to extract
+        min_score: Minimum score of a selected page
+        margin: Number of pages kept before and after each selected page
+        document: Name of the document, for the logs
+
+    Returns:
+        The selected page numbers, 1-based and sorted
+    """
+    scores = [score_page(page, text, registry) for page, text in enumerate(page_texts, start=1)]
+    page_count = len(scores)
+    hits = [score.page for score in scores if score.has_text and score.score >= min_score]
+    if not hits:
+        logger.warning(f"Page triage of {document}: no page reached the score {min_score}, converting all "
+                       f"{page_count} pages")
+        return list(range(1, page_count + 1))
+
+    selected = {score.page for score in scores if not score.has_text}
+    for page in hits:
+        selected.update(range(max(1, page - margin), min(page_count, page + margin) + 1))
+    pages = sorted(selected)
+
+    logger.info(f"Page triage of {document}: converting {len(pages)}/{page_count} pages "
+                f"({_format_pages(pages)})")
+    for score in scores:
+        decision = "kept" if score.page in selected else "skipped"
+        logger.debug(f"Page triage of {document}: {decision} {score.describe()}")
+    # The best skipped pages are the likeliest misses
+    near_misses = sorted((score for score in scores if score.page not in selected and score.score > 0),
+                         key=lambda score: -score.score)[:3]
+    if near_misses:
+        logger.info(f"Page triage of {document}: best skipped pages: "
+                    + "; ".join(score.describe() for score in near_misses))
+    return pages
+
+
+def _format_pages(pages: List[int]) -> str:
+    """Format page numbers as ranges, e.g. "3-5, 9"."""
+    parts = []
+    start = previous = None
+    for page in pages + [None]:
+        if previous is not None and page == previous + 1:
+            previous = page
+            continue
+        if start is not None:
+            parts.append(f"{start}-{previous}" if previous != start else str(start))
+        start = previous = page
+    return ", ".join(parts)
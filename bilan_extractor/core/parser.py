@@ -4,23 +4,118 @@ Module for parsing and processing LLM output.
 This module provides functions to parse and validate the output from the LLM.
 It includes robust error handling to deal with various types of LLM responses,
 including empty strings, non-JSON text, and JSON embedded in other text.
+
+Amounts are normalised with parse_amount, which reads French notation. LLM
+answers are parsed in a single pass: every candidate object is decoded with
+json.JSONDecoder.raw_decode, and a candidate that is not valid JSON is repaired
+(trailing commas, single quotes, Python literals, comments, amounts with
+thousands separators, unclosed brackets) before being decoded again. The first
+object decoded is the answer, as for the streamed answers (see stream_parser).
+
+Answers in the compact output format, where each variable maps to rows of
+[brut, amortissement, net, year], or [value, year] for a value whose type is not
+stated, are expanded back into the structured format (name, code and typed
+values) by expand_compact_output.
 """
 import json
-from typing import Dict, Any
+import math
+import re
+from typing import Dict, List, Any, Optional, Tuple
+
+# Amounts as written in French financial statements: "6 188 162", "1.234,56", "(12 000)", "-350 €", "12,5 M€"
+_AMOUNT_PATTERN = re.compile(
+    r"^(?P<sign>[-+\u2212])?\s*(?P<digits>\d{1,3}(?:[ .'\u2019]\d{3})+|\d+)(?:,(?P<decimals>\d+))?"
+    r"\s*(?P<trailing_sign>-)?\s*(?P<unit>k|K|M|Md|Mds)?\s*(?:€|EUR|eur|euros?)?$"
+)
+# Plain float notation such as "1234.56" or "1e6", with an optional unit and currency
+_FLOAT_PATTERN = re.compile(r"^(?P<number>[-+]?(?:\d+\.\d+|\d+(?:\.\d*)?[eE][-+]?\d+))"
+                            r"\s*(?P<unit>k|K|M|Md|Mds)?\s*(?:€|EUR|eur|euros?)?$")
+# Multiplier of each unit: thousands, millions and billions of euros
+_UNITS = {"k": 1e3, "K": 1e3, "M": 1e6, "Md": 1e9, "Mds": 1e9}
+# Non-breaking and thin spaces, folded to spaces before matching
+_SPACES = str.maketrans({"\u00a0": " ", "\u202f": " ", "\u2009": " "})
+
+_DECODER = json.JSONDecoder()
+# Opening brace of a candidate object: followed by a key or by its closing brace,
+# which skips the braces of the prose around the answer
+_OBJECT_START = re.compile(r"\{(?=\s*[\"'}])")
+
+# Repairs applied to the text between the strings of a candidate object
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_PYTHON_LITERALS = re.compile(r"\b(None|True|False)\b")
+_LITERAL_VALUES = {"None": "null", "True": "true", "False": "false"}
+_LINE_COMMENT = re.compile(r"//[^\n]*")
+_BLOCK_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+# A bare amount with thousands separators, e.g. "value": 6 188 162 or (12 000)
+_BARE_AMOUNT = re.compile(r"(?<=:)(\s*)(\(?-?\d{1,3}(?:[ \u00a0\u202f]\d{3})+(?:,\d+)?\)?)(?=\s*[,}\]])")
+# A member cut after its key or in its number, at the end of a truncated answer
+_DANGLING_MEMBER = re.compile(r',?\s*"(?:[^"\\]|\\.)*"\s*:\s*[-\d.]*$')
+
+# Value types of the amount columns of a row of the compact output format
+COMPACT_COLUMNS = ("brut", "amortissement", "net")
+
+
+def parse_amount(text: Any) -> Optional[float]:
+    """
+    Parse an amount written in French notation.
+    
+    Spaces, non-breaking spaces, dots and apostrophes are accepted as thousands
+    separators, the comma as decimal separator, a currency sign is ignored,
+    parentheses or a leading or trailing minus denote a negative amount, and
+    the units k€, M€ and Md€ multiply the amount. Numbers in the notation of
+    float(), exponent included ("1e6"), are read as well.
+    
+    Args:
+        text: The amount to parse (numbers are returned as floats)
+        
+    Returns:
+        The amount as a float, or None if the text is not an amount
+    """
+    if isinstance(text, bool) or text is None:
+        return None
+    if isinstance(text, (int, float)):
+        amount = float(text)
+        return amount if math.isfinite(amount) else None
+    if not isinstance(text, str):
+        return None
+    
+    value = text.translate(_SPACES).strip()
+    negative = value.startswith("(") and value.endswith(")")
+    if negative:
+        value = value[1:-1].strip()
+    
+    match = _AMOUNT_PATTERN.match(value)
+    if match:
+        digits = match.group("digits").replace(" ", "").replace(".", "").replace("'", "").replace("\u2019", "")
+        amount = float(f"{digits}.{match.group('decimals') or '0'}")
+        if match.group("sign") in ("-", "\u2212") or match.group("trailing_sign"):
+            amount = -amount
+    else:
+        match = _FLOAT_PATTERN.match(value)
+        if not match:
+            return None
+        amount = float(match.group("number"))
+    if match.group("unit"):
+        amount *= _UNITS[match.group("unit")]
+    if not math.isfinite(amount):
+        return None
+    return -amount if negative else amount
 
 
 def parse_llm_output(json_str: str) -> Dict[str, Any]:
     """
     Parse the JSON output from the LLM and convert it to a Python dictionary.
     
+    The object may be surrounded by prose or a code fence. When the output
+    holds several objects, the first one that can be decoded or repaired is
+    kept, e.g. the answer rather than an example written after it.
+    
     Args:
         json_str: The JSON string output from the LLM
         
     Returns:
-        A dictionary containing the extracted financial variables
-        
-    Raises:
-        json.JSONDecodeError: If the JSON string is invalid and cannot be recovered
+        A dictionary containing the extracted financial variables, empty if no
+        object could be decoded or repaired
     """
     # Check if input is empty or whitespace-only
     if not json_str or json_str.isspace():
@@ -28,27 +123,183 @@ def parse_llm_output(json_str: str) -> Dict[str, Any]:
     
     # Try to parse the JSON directly
     try:
-        return json.loads(json_str)
+        data = json.loads(json_str)
+        if isinstance(data, dict):
+            return data
     except json.JSONDecodeError:
-        # Try to extract JSON from the text
-        # Look for dictionary-like patterns
-        import re
-        
-        # Try to find content between curly braces
-        dict_pattern = re.compile(r'\{.*\}', re.DOTALL)
-        dict_match = dict_pattern.search(json_str)
-        
-        if dict_match:
+        pass
+    
+    match = _OBJECT_START.search(json_str)
+    while match:
+        position = match.start()
+        try:
+            data, end = _DECODER.raw_decode(json_str, position)
+        except json.JSONDecodeError:
+            end = _find_object_end(json_str, position)
             try:
-                # Try to parse the extracted dictionary
-                extracted_json = dict_match.group(0)
-                return json.loads(extracted_json)
+                data = json.loads(_repair_json(json_str[position:end]))
             except json.JSONDecodeError:
-                # If still fails, continue to fallback
-                pass
+                data = None
+        if isinstance(data, dict):
+            return data
+        match = _OBJECT_START.search(json_str, end)
+    return {}
+
+
+def expand_compact_member(key: str, rows: List[Any], registry) -> Tuple[str, Dict[str, Any]]:
+    """
+    Expand a variable of the compact output format into the structured format.
+
+    Args:
+        key: The key of the variable, its account code or its name
+        rows: Its rows of [brut, amortissement, net, year], null for a missing value,
+            or [value, year] for a value of unspecified type
+        registry: The variable registry (see models.registry.get_registry)
+
+    Returns:
+        The name of the variable and its structured data
+    """
+    spec = registry.resolve_key(key)
+    name = spec.name if spec is not None else key
+    if rows and not isinstance(rows[0], list):
+        # A single row written without the enclosing list
+        rows = [rows]
+    values = []
+    for row in rows:
+        if not isinstance(row, list):
+            continue
+        if len(row) <= 2:
+            if row and row[0] is not None:
+                values.append({"value": row[0], "value_type": "unspecified", "year": row[1] if len(row) > 1 else None})
+            continue
+        year = row[len(COMPACT_COLUMNS)] if len(row) > len(COMPACT_COLUMNS) else None
+        for value_type, amount in zip(COMPACT_COLUMNS, row):
+            if amount is not None:
+                values.append({"value": amount, "value_type": value_type, "year": year})
+    data: Dict[str, Any] = {"name": name, "values": values}
+    if spec is not None and spec.code:
+        data["code"] = spec.code
+    return name, data
+
+
+def expand_compact_output(data: Dict[str, Any], registry) -> Dict[str, Any]:
+    """
+    Expand the variables of an answer in the compact output format.
+    Members already in the structured format are kept as they are.
+
+    Args:
+        data: The parsed answer (see parse_llm_output)
+        registry: The variable registry (see models.registry.get_registry)
+
+    Returns:
+        The variables in the structured format, keyed by name
+    """
+    expanded: Dict[str, Any] = {}
+    for key, value in data.items():
+        if isinstance(value, list):
+            key, value = expand_compact_member(key, value, registry)
+        expanded[key] = value
+    return expanded
+
+
+def _find_object_end(text: str, start: int) -> int:
+    """
+    Find the end of the object opening at a position, skipping the brackets in strings.
+    
+    Returns:
+        The position after its closing brace, or the length of the text if it is not closed
+    """
+    depth = 0
+    quote = None
+    escape = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    return len(text)
+
+
+def _split_strings(text: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Split a text into the segments outside and inside strings.
+    
+    Returns:
+        The (quote, text) segments, the quote being None outside strings and the
+        strings given without their quotes (the last one may not be closed)
+    """
+    segments: List[Tuple[Optional[str], str]] = []
+    start = 0
+    quote = None
+    escape = False
+    for index, char in enumerate(text):
+        if quote:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                segments.append((quote, text[start:index]))
+                start, quote = index + 1, None
+        elif char in "\"'":
+            segments.append((None, text[start:index]))
+            start, quote = index + 1, char
+    segments.append((quote, text[start:]))
+    return segments
+
+
+def _repair_json(text: str) -> str:
+    """
+    Repair the common defects of the JSON written by LLMs.
+    
+    Args:
+        text: The text of a candidate object, from its opening brace
         
-        # If all extraction attempts fail, return empty dictionary
-        return {}
+    Returns:
+        The repaired text
+    """
+    segments = _split_strings(text)
+    if segments[-1][0] is not None:
+        # A string cut by a truncated answer, possibly a partial amount
+        segments.pop()
+    parts = []
+    for quote, segment in segments:
+        if quote == "'":
+            parts.append('"' + segment.replace("\\'", "'").replace('"', '\\"') + '"')
+            continue
+        if quote == '"':
+            parts.append('"' + segment + '"')
+            continue
+        segment = _BLOCK_COMMENT.sub("", _LINE_COMMENT.sub("", segment))
+        segment = _PYTHON_LITERALS.sub(lambda match: _LITERAL_VALUES[match.group(1)], segment)
+        segment = _BARE_AMOUNT.sub(lambda match: f'{match.group(1)}"{match.group(2)}"', segment)
+        parts.append(segment)
+    repaired = "".join(parts)
+    
+    # Close the brackets left open by a truncated answer, without its last incomplete member
+    stack = []
+    for quote, segment in _split_strings(repaired):
+        if quote is None:
+            for char in segment:
+                if char in "{[":
+                    stack.append("}" if char == "{" else "]")
+                elif char in "}]" and stack:
+                    stack.pop()
+    if stack:
+        repaired = _DANGLING_MEMBER.sub("", repaired).rstrip().rstrip(",") + "".join(reversed(stack))
+    return _TRAILING_COMMA.sub(r"\1", repaired)
 
 
 def validate_financial_variables(data: Dict[str, Any]) -> Dict[str, Any]:
@@ -72,12 +323,8 @@ def validate_financial_variables(data: Dict[str, Any]) -> Dict[str, Any]:
             # Validate each value in the list
             for i, value_data in enumerate(var_data["values"]):
                 if isinstance(value_data, dict) and "value" in value_data:
-                    try:
-                        # Convert value to float
-                        var_data["values"][i]["value"] = float(value_data["value"])
-                    except (ValueError, TypeError):
-                        # If conversion fails, remove this value
-                        var_data["values"][i]["value"] = None
+                    # Convert value to float (None if it is not an amount, removing the value)
+                    var_data["values"][i]["value"] = parse_amount(value_data["value"])
             
             # Remove values with None
             var_data["values"] = [v for v in var_data["values"] if v.get("value") is not None]
@@ -93,11 +340,9 @@ def validate_financial_variables(data: Dict[str, Any]) -> Dict[str, Any]:
             try:
                 for key, val in var_data.items():
                     if key not in ["name", "code", "description"] and val is not None:
-                        try:
-                            value = float(val)
+                        value = parse_amount(val)
+                        if value is not None:
                             break
-                        except (ValueError, TypeError):
-                            pass
             except (ValueError, TypeError):
                 pass
                 
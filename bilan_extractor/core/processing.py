@@ -0,0 +1,325 @@
+"""
+Module for turning converted Markdown into structured financial variables.
+
+This is the part of the pipeline shared by the single-file CLI and the batch mode:
+rule-based extraction of the table rows that can be read directly, selection of
+the relevant parts of the document, LLM extraction of the remaining variables,
+parsing of the LLM output and construction of the data model, then the
+accounting consistency checks (see core.consistency), the variables failing
+them being asked again with a short prompt. The LLM calls are either
+synchronous (OllamaClient) or awaited (AsyncOllamaClient), the steps around
+them are the same.
+"""
+import asyncio
+import contextvars
+import logging
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple, Union
+
+from .parser import expand_compact_member, expand_compact_output, parse_llm_output
+from .relevance import estimate_tokens, select_relevant_markdown
+from .table_extractor import extract_from_tables
+from ..config import settings
+from ..models.registry import get_registry
+from ..models.variables import FinancialVariables
+from ..utils.metrics import stage
+from ..utils.spill import MarkdownSpill
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+
+def _prepare_extraction(markdown_text: Union[str, MarkdownSpill], year: Optional[int], value_type: Optional[str],
+                        max_document_tokens: Optional[int], use_rules: Optional[bool],
+                        on_variable: Optional[Callable[[str, Any], None]], names: Optional[List[str]] = None
+                        ) -> Tuple[Dict[str, Any], Optional[List[str]], Optional[str]]:
+    """
+    Resolve the variables found in tables and select the part of the document to send to the LLM.
+
+    A document held in a spill file is streamed: only the sections kept for the prompt are read into memory.
+
+    Returns:
+        A tuple with the variables already resolved, the names left for the LLM (None for
+        all of them) and the Markdown to send to the LLM (None if no LLM call is needed)
+    """
+    config = settings.get_config()
+    if max_document_tokens is None:
+        max_document_tokens = config["prompt"]["max_document_tokens"]
+    if use_rules is None:
+        use_rules = config["extraction"]["rule_based"]
+    registry = get_registry()
+
+    data: Dict[str, Any] = {}
+    unresolved: Optional[List[str]] = None
+    if use_rules:
+        with stage("rules"):
+            data = extract_from_tables(markdown_text, registry, year=year, value_type=value_type, names=names)
+        unresolved = [spec.name for spec in registry.select(names) if spec.name not in data]
+        logger.info(f"{len(data)} variables read from tables, {len(unresolved)} left for the LLM")
+        if on_variable is not None:
+            for key, value in data.items():
+                on_variable(key, value)
+    else:
+        unresolved = names
+
+    if unresolved is not None and not unresolved:
+        return data, unresolved, None
+
+    original_tokens = estimate_tokens(markdown_text)
+    with stage("select"):
+        markdown_text = select_relevant_markdown(markdown_text, registry, max_document_tokens,
+                                                 names=unresolved)
+    if max_document_tokens > 0 and original_tokens > max_document_tokens:
+        logger.info(f"Document reduced to its relevant sections: ~{estimate_tokens(markdown_text)} "
+                    f"of ~{original_tokens} tokens")
+    return data, unresolved, markdown_text
+
+
+def _expanding_callback(on_variable: Optional[Callable[[str, Any], None]]
+                        ) -> Optional[Callable[[str, Any], None]]:
+    """
+    Wrap an on_variable callback so that it receives the variables of a compact
+    answer in the structured format.
+    """
+    if on_variable is None:
+        return None
+    registry = get_registry()
+
+    def callback(key: str, value: Any) -> None:
+        if isinstance(value, list):
+            key, value = expand_compact_member(key, value, registry)
+        on_variable(key, value)
+    return callback
+
+
+def _finish_extraction(data: Dict[str, Any], json_str: Optional[str]) -> Dict[str, Any]:
+    """
+    Merge the LLM answer with the variables already resolved and build the data model.
+    """
+    if json_str is not None:
+        with stage("parse"):
+            llm_data = expand_compact_output(parse_llm_output(json_str), get_registry())
+        if isinstance(llm_data, dict):
+            # Values read from the tables take precedence over the LLM's answer
+            for key, value in llm_data.items():
+                data.setdefault(key, value)
+
+    with stage("model_build"):
+        variables = FinancialVariables.from_dict(data)
+        return variables.to_dict()
+
+
+def _plan_recheck(markdown_text: Union[str, MarkdownSpill], result: Dict[str, Any], resolved: Iterable[str]
+                  ) -> Optional[Tuple[List[str], List[str], str, Callable[[Dict[str, Any]], list]]]:
+    """
+    Check the accounting consistency of the extracted variables and prepare the prompt asking again
+    for the variables failing the checks. The variables read from tables are not asked again.
+
+    Returns:
+        None if the checks pass or are disabled, else a tuple with the names to ask again, the notes
+        describing the inconsistencies, the Markdown to send and a function checking another result
+    """
+    config = settings.get_config()["extraction"]
+    if not config["consistency_checks"] or not result:
+        return None
+    # NumPy is only imported when the checks run
+    from .consistency import EXTRACTION_CHECKS, build_grids, check_consistency, suspect_names
+
+    registry = get_registry()
+    tolerance = config["consistency_tolerance"]
+    with stage("check"):
+        grids = build_grids(markdown_text, registry)
+
+        def check(candidate: Dict[str, Any]) -> list:
+            return check_consistency(candidate, registry, grids, tolerance)
+
+        inconsistencies = check(result)
+        for inconsistency in inconsistencies:
+            logger.info(f"Inconsistent values: {inconsistency.describe()}")
+        resolved = set(resolved)
+        names = [name for name in suspect_names(inconsistencies, registry) if name not in resolved]
+        if not names:
+            return None
+        markdown = select_relevant_markdown(markdown_text, registry, config["recheck_max_tokens"], names=names)
+    logger.info(f"Asking again for {len(names)} variables failing the consistency checks")
+    notes = [inconsistency.hint for inconsistency in inconsistencies
+             if inconsistency.check in EXTRACTION_CHECKS and not set(names).isdisjoint(inconsistency.names)]
+    return names, notes, markdown, check
+
+
+def _apply_recheck(result: Dict[str, Any], json_str: str, names: List[str],
+                   check: Callable[[Dict[str, Any]], list]) -> Dict[str, Any]:
+    """
+    Replace the values of the variables asked again by the new answer, unless it makes the
+    result less consistent.
+    """
+    with stage("parse"):
+        llm_data = expand_compact_output(parse_llm_output(json_str), get_registry())
+    if not isinstance(llm_data, dict):
+        logger.warning("Unreadable answer to the consistency recheck, first answer kept")
+        return result
+    with stage("model_build"):
+        answer = FinancialVariables.from_dict(llm_data).to_dict()
+
+    with stage("check"):
+        before = len(check(result))
+        candidate = dict(result)
+        for name in names:
+            if answer.get(name, {}).get("values"):
+                candidate[name] = answer[name]
+        remaining = check(candidate)
+        if len(remaining) > before:
+            logger.warning("The consistency recheck makes the values less consistent, first answer kept")
+            return result
+    for inconsistency in remaining:
+        logger.warning(f"Inconsistent values after the recheck: {inconsistency.describe()}")
+    return candidate
+
+
+def merge_results(previous: Dict[str, Any], result: Dict[str, Any], names: List[str]) -> Dict[str, Any]:
+    """
+    Complete a result extracted with an older configuration of the variables with the
+    variables extracted since, as if the document had been extracted again entirely.
+
+    Args:
+        previous: The recorded result (see FinancialVariables.to_dict)
+        result: The result of the extraction restricted to some variables
+        names: The names of the variables of that extraction, whose recorded values are replaced
+
+    Returns:
+        The merged result, holding the variables of the current configuration only, in
+        configuration order
+    """
+    replaced = set(names)
+    merged = {}
+    for name in get_registry().names:
+        source = result if name in replaced else previous
+        if name in source:
+            merged[name] = source[name]
+    return merged
+
+
+def extract_from_markdown(markdown_text: Union[str, MarkdownSpill], ollama_client, model: Optional[str] = None,
+                          year: Optional[int] = None, value_type: Optional[str] = None,
+                          max_document_tokens: Optional[int] = None,
+                          use_rules: Optional[bool] = None, stream: Optional[bool] = None,
+                          on_variable: Optional[Callable[[str, Any], None]] = None,
+                          names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Extract the financial variables of a document already converted to Markdown.
+
+    Variables that can be read directly from the Markdown tables are resolved
+    without the LLM; only the remaining ones are requested from Ollama. The
+    variables of the answer failing the accounting consistency checks are then
+    requested again, with a short prompt describing the inconsistencies.
+
+    Args:
+        markdown_text: The financial statement in Markdown format, or its spill file (only
+            the selected sections are read into memory)
+        ollama_client: The OllamaClient used to query the LLM
+        model: The LLM model to use (defaults to the client's default_model)
+        year: The specific year to extract values for (optional)
+        value_type: The type of value to extract (brut, net, amortissement) (optional)
+        max_document_tokens: Token budget of the document in the prompt; longer documents
+            are reduced to their most relevant chunks (defaults to the prompt settings, 0 disables)
+        use_rules: Whether to read the variables found in tables before calling the LLM
+            (defaults to the extraction settings)
+        stream: Whether to stream the LLM response and stop the generation once the
+            JSON object is closed (defaults to the Ollama settings)
+        on_variable: Optional callback called with (name, data) for each variable as soon
+            as it is known, before the whole document is processed
+        names: Optional names restricting the extraction to some variables, e.g. the variables
+            added to the configuration since the document was extracted (see merge_results)
+
+    Returns:
+        The extracted variables as a dictionary, ready to be serialized to JSON
+    """
+    if stream is None:
+        stream = settings.get_config()["ollama"]["stream"]
+    data, unresolved, llm_markdown = _prepare_extraction(markdown_text, year, value_type, max_document_tokens,
+                                                         use_rules, on_variable, names)
+
+    json_str = None
+    if llm_markdown is not None:
+        json_str = ollama_client.extract_financial_variables(
+            llm_markdown,
+            model=model,
+            year=year,
+            value_type=value_type,
+            variable_names=unresolved,
+            stream=stream,
+            on_variable=_expanding_callback(on_variable)
+        )
+    resolved = list(data)
+    result = _finish_extraction(data, json_str)
+
+    recheck = _plan_recheck(markdown_text, result, resolved)
+    if recheck is not None:
+        recheck_names, notes, recheck_markdown, check = recheck
+        json_str = ollama_client.extract_financial_variables(
+            recheck_markdown, model=model, year=year, value_type=value_type,
+            variable_names=recheck_names, stream=stream, notes=notes)
+        result = _apply_recheck(result, json_str, recheck_names, check)
+    return result
+
+
+async def extract_from_markdown_async(markdown_text: Union[str, MarkdownSpill], ollama_client,
+                                      model: Optional[str] = None,
+                                      year: Optional[int] = None, value_type: Optional[str] = None,
+                                      max_document_tokens: Optional[int] = None,
+                                      use_rules: Optional[bool] = None, stream: Optional[bool] = None,
+                                      on_variable: Optional[Callable[[str, Any], None]] = None,
+                                      names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Asynchronous version of extract_from_markdown, for an AsyncOllamaClient.
+
+    The table reading, the selection of the relevant sections and the consistency
+    checks are CPU-bound and run in the default executor so that the event loop keeps serving other requests.
+
+    Args:
+        markdown_text: The financial statement in Markdown format, or its spill file (only
+            the selected sections are read into memory)
+        ollama_client: The AsyncOllamaClient used to query the LLM
+        model: The LLM model to use (defaults to the client's default_model)
+        year: The specific year to extract values for (optional)
+        value_type: The type of value to extract (brut, net, amortissement) (optional)
+        max_document_tokens: Token budget of the document in the prompt (defaults to the prompt settings)
+        use_rules: Whether to read the variables found in tables before calling the LLM
+        stream: Whether to stream the LLM response (defaults to the Ollama settings)
+        on_variable: Optional callback called with (name, data) for each variable as soon as it is known
+        names: Optional names restricting the extraction to some variables
+
+    Returns:
+        The extracted variables as a dictionary, ready to be serialized to JSON
+    """
+    if stream is None:
+        stream = settings.get_config()["ollama"]["stream"]
+    loop = asyncio.get_running_loop()
+    # The context carries the metrics record of the document into the executor thread
+    context = contextvars.copy_context()
+    data, unresolved, llm_markdown = await loop.run_in_executor(
+        None, context.run, _prepare_extraction, markdown_text, year, value_type, max_document_tokens,
+        use_rules, on_variable, names)
+
+    json_str = None
+    if llm_markdown is not None:
+        json_str = await ollama_client.extract_financial_variables(
+            llm_markdown,
+            model=model,
+            year=year,
+            value_type=value_type,
+            variable_names=unresolved,
+            stream=stream,
+            on_variable=_expanding_callback(on_variable)
+        )
+    resolved = list(data)
+    result = _finish_extraction(data, json_str)
+
+    recheck = await loop.run_in_executor(None, context.run, _plan_recheck, markdown_text, result, resolved)
+    if recheck is not None:
+        recheck_names, notes, recheck_markdown, check = recheck
+        json_str = await ollama_client.extract_financial_variables(
+            recheck_markdown, model=model, year=year, value_type=value_type,
+            variable_names=recheck_names, stream=stream, notes=notes)
+        result = await loop.run_in_executor(None, context.run, _apply_recheck, result, json_str,
+                                            recheck_names, check)
+    return result
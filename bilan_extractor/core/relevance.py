@@ -0,0 +1,346 @@
+"""
+Module for selecting the parts of a document relevant to the requested variables.
+
+Long annual reports contain a few pages of balance sheet among dozens of pages
+of narrative text. The Markdown is split into chunks (by page, heading and
+table), each chunk is scored against the names, aliases and codes of the
+variables to extract with a lexical (BM25) index, and only the best chunks are
+kept within a token budget, in their original order. Whole aliases and codes
+are found with the registry's multi-pattern matcher, in one pass per chunk.
+
+A document held in a spill file (see utils.spill) is read twice, one chunk at a
+time: the first pass only keeps the figures needed to score each chunk, the
+second one the text of the selected chunks.
+"""
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from ..models.registry import VariableRegistry, normalize_text
+from ..utils.spill import MarkdownSpill, markdown_lines
+
+# Markers inserted by the converters at the start of each page
+PAGE_MARKER_PATTERN = re.compile(r"^## Page (\d+)\s*$")
+
+# Markdown headings
+HEADING_PATTERN = re.compile(r"^#{1,6}\s")
+
+# Maximum size of a chunk, larger sections are split
+DEFAULT_MAX_CHUNK_CHARS = 2000
+
+# Average number of characters per token, used to estimate prompt sizes
+CHARS_PER_TOKEN = 4
+
+# Words too common to discriminate between chunks
+STOP_WORDS = {"de", "du", "des", "la", "le", "les", "et", "en", "sur", "au", "aux", "par", "pour", "un", "une"}
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Bonuses added to the BM25 score when a whole alias or an account code is found in a chunk
+ALIAS_BONUS = 3.0
+CODE_BONUS = 5.0
+TABLE_BONUS = 1.0
+
+
+@dataclass
+class Chunk:
+    """
+    Data class representing a section of a Markdown document.
+    """
+    index: int
+    text: str
+    page: Optional[int] = None
+    kind: str = "text"
+    score: float = 0.0
+
+    @property
+    def tokens(self) -> int:
+        """Estimated number of LLM tokens of the chunk."""
+        return estimate_tokens(self.text)
+
+
+@dataclass
+class ChunkFeatures:
+    """
+    Data class holding what the scoring of a chunk needs, without its text.
+    """
+    index: int
+    kind: str
+    tokens: int
+    length: int
+    frequencies: Dict[str, int]
+    bonus: float
+    score: float = 0.0
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens of a text.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        The approximate number of tokens
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into normalized terms, without stop words.
+
+    Args:
+        text: The text to tokenize
+
+    Returns:
+        The list of terms
+    """
+    return [word for word in normalize_text(text).split() if len(word) > 1 and word not in STOP_WORDS]
+
+
+def _split_lines(lines: List[str], max_chars: int, header: List[str]) -> List[str]:
+    """Split a list of lines into pieces of at most max_chars, repeating a header in each piece."""
+    pieces = []
+    current: List[str] = []
+    size = 0
+    header_size = sum(len(line) + 1 for line in header)
+    for line in lines:
+        if current and size + len(line) + 1 > max_chars:
+            pieces.append("\n".join(current))
+            current, size = list(header), header_size
+        current.append(line)
+        size += len(line) + 1
+    if current and len(current) > len(header):
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def chunk_markdown(markdown_text: Union[str, MarkdownSpill],
+                   max_chunk_chars: int = DEFAULT_MAX_CHUNK_CHARS) -> List[Chunk]:
+    """
+    Split a Markdown document into chunks at page markers, headings and table boundaries.
+
+    Page markers ("## Page N") are not part of the chunks, the page number is
+    stored on each chunk instead. Tables larger than max_chunk_chars are split
+    by rows and their header is repeated in every piece.
+
+    Args:
+        markdown_text: The document in Markdown format, or its spill file
+        max_chunk_chars: Maximum size of a chunk
+
+    Returns:
+        The list of chunks, in document order
+    """
+    return list(iter_chunks(markdown_lines(markdown_text), max_chunk_chars))
+
+
+def iter_chunks(lines: Iterable[str], max_chunk_chars: int = DEFAULT_MAX_CHUNK_CHARS) -> Iterator[Chunk]:
+    """
+    Split the lines of a Markdown document into chunks, one chunk at a time (see chunk_markdown).
+
+    Args:
+        lines: The lines of the document
+        max_chunk_chars: Maximum size of a chunk
+
+    Returns:
+        An iterator over the chunks, in document order
+    """
+    current: List[str] = []
+    kind = "text"
+    page = None
+    index = 0
+
+    def flush() -> List[Chunk]:
+        nonlocal index
+        pieces = []
+        if any(line.strip() for line in current):
+            header = current[:2] if kind == "table" and len(current) > 2 else []
+            for piece in _split_lines(list(current), max_chunk_chars, header):
+                pieces.append(Chunk(index=index, text=piece.strip("\n"), page=page, kind=kind))
+                index += 1
+        current.clear()
+        return pieces
+
+    for line in lines:
+        page_match = PAGE_MARKER_PATTERN.match(line)
+        if page_match:
+            yield from flush()
+            page = int(page_match.group(1))
+            continue
+
+        line_kind = "table" if line.lstrip().startswith("|") else "text"
+        if line_kind != kind and line.strip():
+            yield from flush()
+            kind = line_kind
+        elif line_kind == "text" and HEADING_PATTERN.match(line):
+            yield from flush()
+        current.append(line)
+    yield from flush()
+
+
+def build_query(registry: VariableRegistry, names: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+    """
+    Collect the terms, alias phrases and account codes describing the variables to extract.
+
+    Args:
+        registry: The registry of the configured variables (see get_registry)
+        names: Optional names restricting the query to some variables
+
+    Returns:
+        A dictionary with the "terms", "phrases" and "codes" sets
+    """
+    terms: Set[str] = set()
+    phrases: Set[str] = set()
+    codes: Set[str] = set()
+    for spec in registry.select(names):
+        for label in spec.labels:
+            terms.update(tokenize(label))
+            phrases.add(label)
+        if spec.code:
+            codes.add(spec.code)
+    # Codes are matched separately, with a higher weight
+    terms.difference_update(codes)
+    return {"terms": terms, "phrases": phrases, "codes": codes}
+
+
+def score_chunks(chunks: List[Chunk], query: Dict[str, Set[str]], registry: VariableRegistry) -> None:
+    """
+    Score chunks against a query with BM25, plus bonuses for whole aliases,
+    account codes and tables. The score is stored on each chunk.
+
+    Args:
+        chunks: The chunks to score
+        query: The query built by build_query
+        registry: The registry whose matcher finds the aliases and codes
+    """
+    features = [chunk_features(chunk, query, registry) for chunk in chunks]
+    score_features(features, query)
+    for chunk, chunk_scored in zip(chunks, features):
+        chunk.score = chunk_scored.score
+
+
+def chunk_features(chunk: Chunk, query: Dict[str, Set[str]], registry: VariableRegistry) -> ChunkFeatures:
+    """
+    Measure a chunk against a query: its number of terms, the frequencies of the
+    query terms and the bonus of the whole aliases and codes it contains.
+
+    Args:
+        chunk: The chunk to measure
+        query: The query built by build_query
+        registry: The registry whose matcher finds the aliases and codes
+
+    Returns:
+        The features of the chunk, not scored yet
+    """
+    doc = Counter(tokenize(chunk.text))
+    found = {(match.kind, match.phrase) for match in registry.find(chunk.text)}
+    bonus = ALIAS_BONUS * sum(1 for kind, phrase in found if kind == "alias" and phrase in query["phrases"])
+    bonus += CODE_BONUS * sum(1 for kind, phrase in found if kind == "code" and phrase in query["codes"])
+    return ChunkFeatures(index=chunk.index, kind=chunk.kind, tokens=chunk.tokens, length=sum(doc.values()),
+                         frequencies={term: doc[term] for term in query["terms"] if term in doc}, bonus=bonus)
+
+
+def score_features(features: List[ChunkFeatures], query: Dict[str, Set[str]]) -> None:
+    """
+    Score the features of all the chunks of a document with BM25, plus their bonuses.
+    The score is stored on each entry.
+
+    Args:
+        features: The features of the chunks, see chunk_features
+        query: The query built by build_query
+    """
+    if not features:
+        return
+    average_length = sum(entry.length for entry in features) / len(features) or 1.0
+    document_frequency = Counter(term for entry in features for term in entry.frequencies)
+
+    for entry in features:
+        score = 0.0
+        for term in query["terms"]:
+            frequency = entry.frequencies.get(term)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(features) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (
+                frequency + BM25_K1 * (1 - BM25_B + BM25_B * entry.length / average_length))
+
+        score += entry.bonus
+        if score > 0 and entry.kind == "table":
+            score += TABLE_BONUS
+        entry.score = score
+
+
+def assemble_chunks(chunks: List[Chunk]) -> str:
+    """
+    Rebuild a Markdown document from a subset of chunks, restoring page markers
+    and marking the gaps left by the chunks that were dropped.
+
+    Args:
+        chunks: The chunks to assemble, in document order
+
+    Returns:
+        The Markdown text
+    """
+    parts = []
+    previous: Optional[Chunk] = None
+    for chunk in chunks:
+        if previous is not None and chunk.index != previous.index + 1:
+            parts.append("[...]")
+        if chunk.page is not None and (previous is None or previous.page != chunk.page):
+            parts.append(f"## Page {chunk.page}")
+        parts.append(chunk.text)
+        previous = chunk
+    return "\n\n".join(parts)
+
+
+def select_relevant_markdown(markdown_text: Union[str, MarkdownSpill], registry: VariableRegistry,
+                             max_tokens: int, names: Optional[Iterable[str]] = None) -> str:
+    """
+    Reduce a document to the chunks most likely to contain the requested variables.
+
+    Args:
+        markdown_text: The document in Markdown format, or its spill file
+        registry: The registry of the configured variables (see get_registry)
+        max_tokens: Token budget of the document in the prompt (0 or less disables the filter)
+        names: Optional names restricting the selection to some variables
+
+    Returns:
+        The document itself if it fits in the budget, otherwise the best chunks
+        within the budget, in document order
+    """
+    if max_tokens <= 0 or estimate_tokens(markdown_text) <= max_tokens:
+        return markdown_text if isinstance(markdown_text, str) else markdown_text.read()
+
+    query = build_query(registry, names)
+    if isinstance(markdown_text, str):
+        chunks = chunk_markdown(markdown_text)
+        features = [chunk_features(chunk, query, registry) for chunk in chunks]
+    else:
+        chunks = None
+        features = [chunk_features(chunk, query, registry) for chunk in iter_chunks(markdown_text.lines())]
+    score_features(features, query)
+
+    # Take matching chunks by decreasing score while they fit (document order when nothing matches)
+    ranked = sorted(features, key=lambda entry: (-entry.score, entry.index))
+    has_matches = bool(ranked) and ranked[0].score > 0
+    selected = set()
+    budget = max_tokens
+    for entry in ranked:
+        if has_matches and entry.score <= 0:
+            break
+        # Keep room for the page markers and gap separators added by assemble_chunks
+        cost = entry.tokens + 5
+        if cost <= budget:
+            selected.add(entry.index)
+            budget -= cost
+
+    if chunks is None:
+        # Second pass over the spill file, keeping the text of the selected chunks only
+        chunks = iter_chunks(markdown_text.lines())
+    return assemble_chunks([chunk for chunk in chunks if chunk.index in selected])
\ No newline at end of file
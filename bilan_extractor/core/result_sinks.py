@@ -0,0 +1,332 @@
+"""
+Module for storing extraction results in queryable formats.
+
+A sink receives the result of each document as soon as it is extracted:
+    NDJSONSink    one JSON line per document, flushed as it is written
+    SQLiteSink    a documents table and a variable_values table with one row per
+                  (document hash, variable, value type, year), indexed by variable
+                  and by account code, written in batched transactions
+    ParquetSink   the rows of variable_values, written in row groups (needs pyarrow)
+Loading the values of a variable for every company and year is then a single
+indexed query (see query_variable_values) instead of a scan of JSON files.
+open_sink() picks the sink from the file extension.
+"""
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+
+# Columns of a variable value row
+VALUE_COLUMNS = ("document_hash", "document", "variable", "code", "value_type", "year", "value")
+
+# File extensions of each sink
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+PARQUET_EXTENSIONS = (".parquet",)
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    document_hash TEXT PRIMARY KEY,
+    document TEXT NOT NULL,
+    processed_at REAL NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variable_values (
+    document_hash TEXT NOT NULL REFERENCES documents(document_hash),
+    variable TEXT NOT NULL,
+    code TEXT,
+    value_type TEXT NOT NULL,
+    year INTEGER,
+    value REAL,
+    PRIMARY KEY (document_hash, variable, value_type, year)
+);
+CREATE INDEX IF NOT EXISTS idx_values_variable_year ON variable_values (variable, year);
+CREATE INDEX IF NOT EXISTS idx_values_code_year ON variable_values (code, year);
+"""
+
+
+def _row_year(year: Any) -> Optional[int]:
+    """The year of a value row: the year as an int, None for a label such as "N"."""
+    if isinstance(year, str) and year.strip().isdigit():
+        year = int(year)
+    if type(year) is int and 0 < year < 1 << 31:
+        return year
+    return None
+
+
+def result_rows(document_hash: str, document: str, result: Dict[str, Any]) -> List[Tuple]:
+    """
+    Flatten the result of a document into variable value rows.
+
+    Args:
+        document_hash: SHA-256 of the PDF content
+        document: Path of the PDF file
+        result: The extracted variables (see FinancialVariables.to_dict)
+
+    Returns:
+        One tuple per value, with the fields of VALUE_COLUMNS (the year column is an
+        integer: a year the LLM left as a label is stored as None)
+    """
+    rows = []
+    for name, data in result.items():
+        if not isinstance(data, dict):
+            continue
+        for value in data.get("values", []):
+            rows.append((document_hash, document, name, data.get("code"),
+                         value.get("value_type") or "unspecified", _row_year(value.get("year")), value.get("value")))
+    return rows
+
+
+class ResultSink:
+    """
+    Base class of the result sinks.
+    """
+
+    def write(self, document_hash: str, document: str, result: Dict[str, Any]) -> None:
+        """
+        Store the result of a document.
+
+        Args:
+            document_hash: SHA-256 of the PDF content, identifying the document
+            document: Path of the PDF file
+            result: The extracted variables
+        """
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Write the buffered results."""
+
+    def close(self) -> None:
+        """Flush and release the underlying file."""
+        self.flush()
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class NDJSONSink(ResultSink):
+    """
+    Sink appending one JSON line per document.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open the file in append mode.
+
+        Args:
+            path: Path of the NDJSON file
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, document_hash: str, document: str, result: Dict[str, Any]) -> None:
+        record = {"document_hash": document_hash, "document": document, "processed_at": time.time(),
+                  "result": result}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+class SQLiteSink(ResultSink):
+    """
+    Sink storing the results in an indexed SQLite database.
+    """
+
+    def __init__(self, path: str, batch_size: int = 200):
+        """
+        Open or create the database.
+
+        Args:
+            path: Path of the database file
+            batch_size: Number of documents written per transaction
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SQLITE_SCHEMA)
+        self._documents: List[Tuple] = []
+        self._rows: List[Tuple] = []
+
+    def write(self, document_hash: str, document: str, result: Dict[str, Any]) -> None:
+        self._documents.append((document_hash, document, time.time(), json.dumps(result, ensure_ascii=False)))
+        self._rows.extend(row[:1] + row[2:] for row in result_rows(document_hash, document, result))
+        if len(self._documents) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._documents:
+            return
+        with self._connection:
+            # A document processed again replaces its previous values
+            self._connection.executemany("DELETE FROM variable_values WHERE document_hash = ?",
+                                         [(document[0],) for document in self._documents])
+            self._connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)", self._documents)
+            self._connection.executemany("INSERT OR REPLACE INTO variable_values VALUES (?, ?, ?, ?, ?, ?)",
+                                         self._rows)
+        self._documents, self._rows = [], []
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self.flush()
+            self._connection.close()
+            self._connection = None
+
+
+class ParquetSink(ResultSink):
+    """
+    Sink writing the variable value rows to a Parquet file, one row group per batch.
+    """
+
+    def __init__(self, path: str, batch_size: int = 10000):
+        """
+        Create the file.
+
+        Args:
+            path: Path of the Parquet file (replaced if it exists)
+            batch_size: Number of rows per row group
+
+        Raises:
+            ImportError: If pyarrow is not installed
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet result sinks need pyarrow (pip install pyarrow)") from e
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self._pa = pa
+        self._schema = pa.schema([
+            ("document_hash", pa.string()),
+            ("document", pa.string()),
+            ("variable", pa.string()),
+            ("code", pa.string()),
+            ("value_type", pa.string()),
+            ("year", pa.int32()),
+            ("value", pa.float64()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows: List[Tuple] = []
+
+    def write(self, document_hash: str, document: str, result: Dict[str, Any]) -> None:
+        self._rows.extend(result_rows(document_hash, document, result))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        columns = list(zip(*self._rows))
+        table = self._pa.Table.from_arrays(
+            [self._pa.array(column, type=self._schema.field(index).type) for index, column in enumerate(columns)],
+            schema=self._schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+
+class MultiSink(ResultSink):
+    """
+    Sink forwarding the results to several sinks.
+    """
+
+    def __init__(self, sinks: Iterable[ResultSink]):
+        self.sinks = list(sinks)
+
+    def write(self, document_hash: str, document: str, result: Dict[str, Any]) -> None:
+        for sink in self.sinks:
+            sink.write(document_hash, document, result)
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
+
+
+def open_sink(path: str) -> ResultSink:
+    """
+    Open the sink matching the extension of a file.
+
+    Args:
+        path: Path of the output file (.ndjson/.jsonl, .sqlite/.sqlite3/.db or .parquet)
+
+    Returns:
+        The sink
+
+    Raises:
+        ValueError: If the extension is not supported
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix in NDJSON_EXTENSIONS:
+        return NDJSONSink(path)
+    if suffix in SQLITE_EXTENSIONS:
+        return SQLiteSink(path)
+    if suffix in PARQUET_EXTENSIONS:
+        return ParquetSink(path)
+    raise ValueError(f"Unsupported result sink: {path} (use .ndjson, .jsonl, .sqlite, .db or .parquet)")
+
+
+def open_sinks(paths: Optional[Iterable[str]]) -> Optional[ResultSink]:
+    """
+    Open the sinks of several files.
+
+    Args:
+        paths: Paths of the output files
+
+    Returns:
+        A sink writing to all of them, or None without paths
+    """
+    sinks = [open_sink(path) for path in paths or []]
+    if not sinks:
+        return None
+    return sinks[0] if len(sinks) == 1 else MultiSink(sinks)
+
+
+def query_variable_values(path: str, variable: str, year: Optional[int] = None,
+                          value_type: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Load the values of a variable for every document of a SQLite result store.
+
+    Args:
+        path: Path of the database written by SQLiteSink
+        variable: The variable name, or its account code
+        year: Optional year restricting the values
+        value_type: Optional value type restricting the values
+
+    Returns:
+        One dictionary per value, with the fields of VALUE_COLUMNS, ordered by document and year
+    """
+    column = "code" if variable.isdigit() else "variable"
+    query = (f"SELECT v.document_hash, d.document, v.variable, v.code, v.value_type, v.year, v.value "
+             f"FROM variable_values v JOIN documents d USING (document_hash) WHERE v.{column} = ?")
+    parameters: List[Any] = [variable]
+    if year is not None:
+        query += " AND v.year = ?"
+        parameters.append(year)
+    if value_type is not None:
+        query += " AND v.value_type = ?"
+        parameters.append(value_type)
+    query += " ORDER BY d.document, v.year"
+    with sqlite3.connect(path) as connection:
+        return [dict(zip(VALUE_COLUMNS, row)) for row in connection.execute(query, parameters)]
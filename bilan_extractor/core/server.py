@@ -0,0 +1,441 @@
+"""
+Module implementing a long-lived extraction server.
+
+The server loads the docling converter, the variable configuration and the
+Ollama client once, then accepts extraction jobs over HTTP (on a TCP port bound
+to localhost or on a Unix socket). Jobs are queued and processed by worker
+threads; clients submit a document, get a job identifier back immediately and
+poll for the result.
+
+Endpoints:
+    POST /jobs          Submit a job. Either a JSON body {"filepath": ..., "model": ...,
+                        "year": ..., "value_type": ...} or a raw PDF body
+                        (Content-Type: application/pdf) with the same fields as
+                        query parameters. Returns 202 with the job identifier.
+    GET  /jobs/<id>     Get the status and, once done, the result of a job.
+                        The optional "wait" query parameter (seconds) blocks
+                        until the job is finished or the delay expires.
+    GET  /health        Get the status of the server and the size of the queue.
+    GET  /metrics       Get the per-stage timings and LLM token counts of the processed
+                        documents, in the Prometheus text format (or as JSON with
+                        the "format=json" query parameter).
+"""
+import json
+import logging
+import os
+import queue
+import socketserver
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from .processing import extract_from_markdown
+from ..models.registry import get_registry
+from ..services.docling_wrapper import DoclingWrapper, get_document_converter
+from ..utils.metrics import get_metrics, track_document
+from ..utils.spill import MarkdownSpill
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# Value types accepted in job requests
+VALUE_TYPES = ("brut", "net", "amortissement")
+
+
+@dataclass
+class Job:
+    """
+    Data class representing an extraction job submitted to the server.
+    """
+    job_id: str
+    filepath: str
+    model: Optional[str] = None
+    year: Optional[int] = None
+    value_type: Optional[str] = None
+    status: str = "queued"
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    submitted_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    delete_file: bool = False
+
+    @property
+    def finished(self) -> bool:
+        """Whether the job is done, successfully or not."""
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary representation."""
+        return {
+            "job_id": self.job_id,
+            "filepath": None if self.delete_file else self.filepath,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ExtractionService:
+    """
+    Queue of extraction jobs processed by worker threads sharing warm resources.
+    """
+
+    def __init__(self, ollama_client, workers: int = 2, use_cache: bool = True,
+                 refresh_cache: bool = False, max_finished_jobs: int = 1000):
+        """
+        Initialize the service.
+
+        Args:
+            ollama_client: The OllamaClient shared by all jobs
+            workers: Number of worker threads (LLM requests run concurrently,
+                docling conversions are serialized)
+            use_cache: Whether to use the on-disk conversion cache
+            refresh_cache: Whether to ignore cached conversions
+            max_finished_jobs: Number of finished jobs kept for polling before being forgotten
+        """
+        self.ollama_client = ollama_client
+        self.workers = max(1, workers)
+        self.use_cache = use_cache
+        self.refresh_cache = refresh_cache
+        self.max_finished_jobs = max_finished_jobs
+
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._jobs: Dict[str, Job] = {}
+        self._finished: List[str] = []
+        self._lock = threading.Lock()
+        self._job_done = threading.Condition(self._lock)
+        self._convert_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Load the shared resources and start the worker threads.
+        """
+        logger.info("Loading variable configuration and conversion models...")
+        get_registry()
+        if DoclingWrapper.preferred_backend() == "docling":
+            try:
+                get_document_converter()
+            except Exception as e:
+                logger.warning(f"Could not load docling models: {e}")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"extraction-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Extraction service started with {self.workers} workers")
+
+    def stop(self) -> None:
+        """
+        Stop the worker threads once the queued jobs are processed.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, filepath: str, model: Optional[str] = None, year: Optional[int] = None,
+               value_type: Optional[str] = None, delete_file: bool = False) -> Job:
+        """
+        Queue an extraction job.
+
+        Args:
+            filepath: Path to the PDF file
+            model: The LLM model to use (defaults to the client's default_model)
+            year: The specific year to extract values for (optional)
+            value_type: The type of value to extract (brut, net, amortissement) (optional)
+            delete_file: Whether the file is temporary and must be deleted once processed
+
+        Returns:
+            The queued job
+        """
+        job = Job(
+            job_id=uuid.uuid4().hex,
+            filepath=filepath,
+            model=model,
+            year=year,
+            value_type=value_type,
+            submitted_at=time.time(),
+            delete_file=delete_file
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str, wait: float = 0.0) -> Optional[Job]:
+        """
+        Get a job by its identifier.
+
+        Args:
+            job_id: The identifier returned on submission
+            wait: Maximum number of seconds to wait for the job to finish
+
+        Returns:
+            The job, or None if it is unknown
+        """
+        deadline = time.monotonic() + wait
+        with self._job_done:
+            job = self._jobs.get(job_id)
+            while job is not None and not job.finished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._job_done.wait(remaining)
+            return job
+
+    def health(self) -> Dict[str, Any]:
+        """Get the status of the service."""
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == "running")
+        health = {
+            "status": "ok",
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": running,
+        }
+        pool = getattr(self.ollama_client, "pool", None)
+        if pool is not None:
+            health["ollama_endpoints"] = pool.stats()
+        return health
+
+    def _work(self) -> None:
+        """Process jobs from the queue until a stop sentinel is received."""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            self._process(job)
+
+    def _process(self, job: Job) -> None:
+        """Run one extraction job and record its outcome."""
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            with track_document(job.filepath):
+                # docling models are shared and not meant to be used from several threads at once
+                with self._convert_lock:
+                    markdown_text = DoclingWrapper.parse_document(
+                        job.filepath,
+                        use_cache=self.use_cache,
+                        refresh_cache=self.refresh_cache
+                    )
+                try:
+                    result = extract_from_markdown(
+                        markdown_text,
+                        self.ollama_client,
+                        model=job.model,
+                        year=job.year,
+                        value_type=job.value_type
+                    )
+                finally:
+                    if isinstance(markdown_text, MarkdownSpill):
+                        markdown_text.close()
+            status, error = "done", None
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+            result, status, error = None, "failed", str(e)
+        finally:
+            if job.delete_file:
+                try:
+                    os.unlink(job.filepath)
+                except OSError:
+                    pass
+
+        with self._job_done:
+            job.result, job.error, job.status = result, error, status
+            job.finished_at = time.time()
+            self._finished.append(job.job_id)
+            while len(self._finished) > self.max_finished_jobs:
+                self._jobs.pop(self._finished.pop(0), None)
+            self._job_done.notify_all()
+        logger.info(f"Job {job.job_id} {status} in {job.finished_at - job.started_at:.1f}s")
+
+
+def _parse_job_parameters(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate the optional parameters of a job request.
+
+    Raises:
+        ValueError: If a parameter is invalid
+    """
+    year = params.get("year")
+    if year is not None and year != "":
+        year = int(year)
+    else:
+        year = None
+    value_type = params.get("value_type") or None
+    if value_type is not None and value_type not in VALUE_TYPES:
+        raise ValueError(f"Invalid value_type: {value_type}")
+    return {"model": params.get("model") or None, "year": year, "value_type": value_type}
+
+
+class ExtractionRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler exposing an ExtractionService.
+    """
+    server_version = "BilanExtractor"
+
+    @property
+    def service(self) -> ExtractionService:
+        """The service of the server handling the request."""
+        return self.server.service
+
+    def address_string(self) -> str:
+        """Client address for logs (Unix socket clients have no address)."""
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix-socket"
+
+    def log_message(self, format: str, *args) -> None:
+        """Route the HTTP access log to the application logger."""
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        """Send a JSON response."""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status: int, text: str, content_type: str = "text/plain; charset=utf-8") -> None:
+        """Send a plain text response."""
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        """Handle job polling, health checks and metrics."""
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/health":
+            self._send_json(200, self.service.health())
+            return
+
+        if url.path == "/metrics":
+            if query.get("format") == "json":
+                self._send_json(200, get_metrics().to_dict())
+            else:
+                self._send_text(200, get_metrics().to_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+
+        if url.path.startswith("/jobs/"):
+            try:
+                wait = float(query.get("wait", 0))
+            except ValueError:
+                self._send_json(400, {"error": "Invalid wait parameter"})
+                return
+            job = self.service.get(url.path[len("/jobs/"):], wait=max(0.0, wait))
+            if job is None:
+                self._send_json(404, {"error": "Unknown job"})
+            else:
+                self._send_json(200, job.to_dict())
+            return
+
+        self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self) -> None:
+        """Handle job submissions."""
+        url = urlparse(self.path)
+        if url.path != "/jobs":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+        try:
+            if content_type == "application/pdf":
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                fd, filepath = tempfile.mkstemp(suffix=".pdf", prefix="bilan-")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(body)
+                delete_file = True
+            else:
+                params = json.loads(body.decode("utf-8") or "{}")
+                if not isinstance(params, dict) or not params.get("filepath"):
+                    raise ValueError("Missing filepath")
+                filepath = str(params["filepath"])
+                if not Path(filepath).exists():
+                    raise ValueError(f"File not found: {filepath}")
+                delete_file = False
+            job_params = _parse_job_parameters(params)
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        job = self.service.submit(filepath, delete_file=delete_file, **job_params)
+        self._send_json(202, {"job_id": job.job_id, "status": job.status})
+
+
+class ExtractionHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP server on a TCP port, bound to an ExtractionService.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service: ExtractionService):
+        self.service = service
+        super().__init__(address, ExtractionRequestHandler)
+
+
+class ExtractionUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server on a Unix socket, bound to an ExtractionService.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: ExtractionService):
+        self.service = service
+        # Remove a stale socket left by a previous run
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, ExtractionRequestHandler)
+
+
+def serve(service: ExtractionService, host: str = "127.0.0.1", port: int = 8765,
+          socket_path: Optional[str] = None) -> None:
+    """
+    Start the service and serve requests until interrupted.
+
+    Args:
+        service: The extraction service handling the jobs
+        host: Address to bind the TCP server to (ignored if socket_path is set)
+        port: Port to bind the TCP server to (ignored if socket_path is set)
+        socket_path: Optional Unix socket path to listen on instead of a TCP port
+    """
+    service.start()
+    if socket_path:
+        server = ExtractionUnixHTTPServer(socket_path, service)
+        logger.info(f"Listening on unix socket {socket_path}")
+    else:
+        server = ExtractionHTTPServer((host, port), service)
+        logger.info(f"Listening on http://{host}:{port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+    finally:
+        server.server_close()
+        service.stop()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""
+Module for parsing a JSON object incrementally while the LLM is generating it.
+
+The parser is fed with the chunks of a streamed response. Any text before the
+object (prose, code fence) is skipped: the object starts at the first opening
+brace followed, after any whitespace, by a key or by its closing brace, so that
+a brace in the prose ("les montants {en euros}") is not taken for it. Each
+top-level member of the object is decoded as soon as it is complete, and the
+parser reports when the top-level object is closed so that the generation can
+be stopped.
+"""
+import json
+from typing import Any, List, Optional, Tuple
+
+
+class IncrementalJSONObjectParser:
+    """
+    Incremental parser emitting the members of a streamed top-level JSON object.
+    """
+
+    def __init__(self):
+        """
+        Initialize the parser.
+        """
+        self._buffer: List[str] = []
+        self._started = False
+        # Whitespace after an opening brace that may start the object, None before one
+        self._opening: Optional[List[str]] = None
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        """Whether the top-level object has been closed."""
+        return self._done
+
+    @property
+    def text(self) -> str:
+        """The text of the object received so far, from its opening brace."""
+        return "".join(self._buffer)
+
+    def _emit_member(self) -> List[Tuple[str, Any]]:
+        """Decode the member accumulated since the last top-level comma."""
+        member = "".join(self._member).strip()
+        self._member = []
+        if not member:
+            return []
+        try:
+            return list(json.loads("{" + member + "}").items())
+        except json.JSONDecodeError:
+            # Left to the final parse of the whole response
+            return []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Feed the parser with the next chunk of the response.
+
+        Args:
+            chunk: The text generated since the previous call
+
+        Returns:
+            The (key, value) members of the top-level object completed by this chunk
+        """
+        members: List[Tuple[str, Any]] = []
+        if self._done:
+            return members
+
+        for char in chunk:
+            if not self._started:
+                if char == "{":
+                    self._opening = []
+                    continue
+                if self._opening is None:
+                    continue
+                if char.isspace():
+                    self._opening.append(char)
+                    continue
+                if char not in "\"}":
+                    self._opening = None
+                    continue
+                self._started = True
+                self._depth = 1
+                self._buffer.append("{")
+                self._buffer.extend(self._opening)
+
+            self._buffer.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                self._member.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    members.extend(self._emit_member())
+                    self._done = True
+                    break
+            elif char == "," and self._depth == 1:
+                members.extend(self._emit_member())
+                continue
+            self._member.append(char)
+
+        return members
+
+    def result(self) -> Optional[str]:
+        """
+        Get the complete object text.
+
+        Returns:
+            The JSON text of the object if it was closed, None otherwise
+        """
+        return self.text if self._done else None
@@ -0,0 +1,292 @@
+"""
+Module for extracting financial variables directly from Markdown tables.
+
+docling renders balance sheets as Markdown tables whose rows start with an
+account code or a label and whose columns hold the gross, depreciation and net
+amounts for one or more years. Rows matching the code or an alias of a
+configured variable are read deterministically, without calling the LLM; only
+the variables that could not be resolved this way need to be sent to Ollama.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Union
+
+from .parser import parse_amount
+from .relevance import PAGE_MARKER_PATTERN
+from ..models.registry import VariableRegistry, VariableSpec, normalize_text
+from ..models.variables import ValueType
+from ..utils.spill import MarkdownSpill, markdown_lines, markdown_segments
+
+# Separator row between the header and the body of a Markdown table
+_SEPARATOR_CELL_PATTERN = re.compile(r"^:?-{2,}:?$")
+
+# Years and dates in column headers or in the document ("31/12/2023", "2023")
+_DATE_PATTERN = re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]((?:19|20)\d{2})\b")
+_YEAR_PATTERN = re.compile(r"\b((?:19|20)\d{2})\b")
+
+# Closing date of the fiscal year, e.g. "Exercice clos le 31/12/2023"
+_FISCAL_YEAR_PATTERN = re.compile(
+    r"(?:clos|arr[eê]t[eé]|cl[oô]tur[eé])\w*\s+(?:le\s+|au\s+)?\d{1,2}[/.-]\d{1,2}[/.-]((?:19|20)\d{2})",
+    re.IGNORECASE
+)
+
+# Relative year markers in normalized column headers ("N", "N-1" normalized to "n 1")
+_RELATIVE_YEAR_PATTERN = re.compile(r"\bn(?: (\d))?\b")
+
+
+@dataclass
+class Column:
+    """
+    Data class describing the kind of values held by a table column.
+    """
+    index: int
+    value_type: ValueType = ValueType.UNSPECIFIED
+    year: Optional[int] = None
+
+
+@dataclass
+class MarkdownTable:
+    """
+    Data class representing a table parsed from Markdown.
+    """
+    header: List[str]
+    rows: List[List[str]] = field(default_factory=list)
+    page: Optional[int] = None
+
+
+def _split_row(line: str) -> List[str]:
+    """Split a Markdown table row into its cells."""
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+def parse_markdown_tables(markdown_text: Union[str, MarkdownSpill]) -> List[MarkdownTable]:
+    """
+    Parse the tables of a Markdown document.
+
+    Args:
+        markdown_text: The document in Markdown format, or its spill file
+
+    Returns:
+        The list of tables, with their header, rows and page number (if known)
+    """
+    return list(iter_markdown_tables(markdown_lines(markdown_text)))
+
+
+def iter_markdown_tables(lines: Iterable[str]) -> Iterator[MarkdownTable]:
+    """
+    Parse the tables of the lines of a Markdown document, one table at a time (see parse_markdown_tables).
+
+    Args:
+        lines: The lines of the document
+
+    Returns:
+        An iterator over the tables, in document order
+    """
+    block: List[str] = []
+    page = None
+
+    def flush() -> Optional[MarkdownTable]:
+        table = None
+        if len(block) >= 2:
+            rows = [_split_row(line) for line in block]
+            separator = next((i for i, row in enumerate(rows)
+                              if row and all(_SEPARATOR_CELL_PATTERN.match(cell) for cell in row if cell)), None)
+            if separator is not None and separator > 0:
+                header = [" ".join(cells).strip() for cells in zip(*rows[:separator])]
+                table = MarkdownTable(header=header, rows=rows[separator + 1:], page=page)
+            else:
+                table = MarkdownTable(header=[], rows=rows, page=page)
+        block.clear()
+        return table
+
+    for line in lines:
+        page_match = PAGE_MARKER_PATTERN.match(line)
+        table = None
+        if page_match:
+            table = flush()
+            page = int(page_match.group(1))
+        elif line.lstrip().startswith("|"):
+            block.append(line)
+        else:
+            table = flush()
+        if table is not None:
+            yield table
+    table = flush()
+    if table is not None:
+        yield table
+
+
+def detect_fiscal_year(markdown_text: Union[str, MarkdownSpill]) -> Optional[int]:
+    """
+    Find the closing year of the fiscal year stated in a document.
+
+    Args:
+        markdown_text: The document in Markdown format, or its spill file (searched page by page)
+
+    Returns:
+        The year of the first closing date found, or None
+    """
+    for segment in markdown_segments(markdown_text):
+        match = _FISCAL_YEAR_PATTERN.search(segment)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def classify_columns(header: List[str], fiscal_year: Optional[int] = None) -> List[Column]:
+    """
+    Determine the value type and the year of the columns of a table from its header.
+
+    Args:
+        header: The header cells of the table
+        fiscal_year: The closing year of the document, used for "N" and "N-1" columns
+
+    Returns:
+        The columns holding amounts (the label columns are left out)
+    """
+    columns = []
+    for index, cell in enumerate(header):
+        text = normalize_text(cell)
+        if not text:
+            continue
+
+        if "brut" in text:
+            value_type = ValueType.BRUT
+        elif "amort" in text or "provision" in text or "deprec" in text:
+            value_type = ValueType.AMORTISSEMENT
+        elif re.search(r"\bnet", text):
+            value_type = ValueType.NET
+        else:
+            value_type = ValueType.UNSPECIFIED
+
+        year = None
+        date_match = _DATE_PATTERN.search(cell) or _YEAR_PATTERN.search(cell)
+        if date_match:
+            year = int(date_match.group(1))
+        elif fiscal_year is not None:
+            relative = _RELATIVE_YEAR_PATTERN.search(text)
+            if relative:
+                year = fiscal_year - int(relative.group(1) or 0)
+
+        if value_type != ValueType.UNSPECIFIED or year is not None:
+            columns.append(Column(index=index, value_type=value_type, year=year))
+
+    # A gross column without year belongs to the current year when the net columns are dated
+    dated_years = sorted({column.year for column in columns if column.year is not None}, reverse=True)
+    if dated_years:
+        for column in columns:
+            if column.year is None and column.value_type in (ValueType.BRUT, ValueType.AMORTISSEMENT):
+                column.year = dated_years[0]
+    return columns
+
+
+def _select_columns(columns: List[Column], year: Optional[int], value_type: Optional[str]) -> List[Column]:
+    """Keep the columns matching the requested year and value type."""
+    if value_type:
+        wanted = ValueType(value_type)
+        columns = [column for column in columns if column.value_type == wanted]
+    if year:
+        if any(column.year is not None for column in columns):
+            columns = [column for column in columns if column.year == year]
+        else:
+            # Undated columns can only be attributed to the year if there is no ambiguity
+            kinds = [column.value_type for column in columns]
+            if len(kinds) != len(set(kinds)):
+                return []
+    return columns
+
+
+def match_row(cells: List[str], registry: VariableRegistry, selected: Optional[set],
+              value_indices: set) -> Optional[VariableSpec]:
+    """
+    Find the variable described by a table row, by account code or by exact label.
+
+    Args:
+        cells: The cells of the row
+        registry: The registry of the configured variables (see get_registry)
+        selected: Optional names of the variables that can match
+        value_indices: Indices of the amount columns, left out of the label
+
+    Returns:
+        The matching variable, or None
+    """
+    label_cells = [cell for i, cell in enumerate(cells) if cell and i not in value_indices]
+    words = normalize_text(" ".join(label_cells)).split()
+    for word in words:
+        spec = registry.by_code.get(word)
+        if spec is not None and (selected is None or spec.name in selected):
+            return spec
+    # Codes in their own column are not part of the label
+    label_words = [word for word in words if not word.isdigit() or len(word) == 4]
+    for label in (" ".join(label_words), " ".join(words)):
+        spec = registry.by_label.get(label)
+        if spec is not None and (selected is None or spec.name in selected):
+            return spec
+    return None
+
+
+def extract_from_tables(markdown_text: Union[str, MarkdownSpill], registry: VariableRegistry,
+                        year: Optional[int] = None, value_type: Optional[str] = None,
+                        names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Extract the variables that can be read directly from the Markdown tables of a document.
+
+    Args:
+        markdown_text: The document in Markdown format, or its spill file
+        registry: The registry of the configured variables (see get_registry)
+        year: The specific year to extract values for (optional)
+        value_type: The type of value to extract (brut, net, amortissement) (optional)
+        names: Optional names restricting the extraction to some variables
+
+    Returns:
+        A dictionary in the structured format accepted by FinancialVariables.from_dict,
+        containing only the variables for which at least one value was found
+    """
+    selected = set(names) if names is not None else None
+    if not registry.select(names):
+        return {}
+
+    fiscal_year = detect_fiscal_year(markdown_text)
+    results: Dict[str, Any] = {}
+    seen = set()
+
+    for table in iter_markdown_tables(markdown_lines(markdown_text)):
+        all_columns = classify_columns(table.header, fiscal_year)
+        columns = _select_columns(all_columns, year, value_type)
+        if not columns:
+            continue
+        value_indices = {column.index for column in all_columns}
+
+        for cells in table.rows:
+            spec = match_row(cells, registry, selected, value_indices)
+            if spec is None:
+                continue
+            name = spec.name
+
+            for column in columns:
+                if column.index >= len(cells):
+                    continue
+                amount = parse_amount(cells[column.index])
+                if amount is None:
+                    continue
+                # The same figure often appears in several tables (e.g. detail and summary)
+                key = (name, column.value_type, column.year)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                variable = results.setdefault(name, {"name": name, "values": []})
+                if spec.code:
+                    variable["code"] = spec.code
+                variable["values"].append({
+                    "value": amount,
+                    "value_type": column.value_type.value,
+                    "year": column.year,
+                })
+
+    return results
\ No newline at end of file
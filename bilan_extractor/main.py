@@ -10,33 +10,278 @@ from pathlib import Path
 if __name__ == "__main__":
     # When run as a script
     import os
-    import sys
     # Add the parent directory to sys.path
     sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-    from bilan_extractor.core.loader import load_bilan
-    from bilan_extractor.core.converter import convert_to_markdown
-    from bilan_extractor.core.parser import parse_llm_output, validate_financial_variables
-    from bilan_extractor.models.variables import FinancialVariables
-    from bilan_extractor.services.ollama_client import OllamaClient
+    from bilan_extractor.core.processing import extract_from_markdown
+    from bilan_extractor.core.batch import collect_inputs, run_batch
+    from bilan_extractor.core.journal import JobJournal, make_job_key
+    from bilan_extractor.core.result_sinks import open_sinks, query_variable_values
+    from bilan_extractor.core.server import ExtractionService, serve
+    from bilan_extractor.services.ollama_client import OllamaClient, get_response_cache
+    from bilan_extractor.services.async_ollama_client import AsyncOllamaClient
     from bilan_extractor.services.docling_wrapper import DoclingWrapper
-    from bilan_extractor.config.settings import get_config
+    from bilan_extractor.config.settings import ensure_directories, get_config
+    from bilan_extractor.utils.cache import file_sha256
     from bilan_extractor.utils.logger import setup_logger
+    from bilan_extractor.utils.metrics import get_metrics, stage, track_document
+    from bilan_extractor.utils.spill import MarkdownSpill
 else:
     # When imported as a module
-    from .core.loader import load_bilan
-    from .core.converter import convert_to_markdown
-    from .core.parser import parse_llm_output, validate_financial_variables
-    from .models.variables import FinancialVariables
-    from .services.ollama_client import OllamaClient
+    from .core.processing import extract_from_markdown
+    from .core.batch import collect_inputs, run_batch
+    from .core.journal import JobJournal, make_job_key
+    from .core.result_sinks import open_sinks, query_variable_values
+    from .core.server import ExtractionService, serve
+    from .services.ollama_client import OllamaClient, get_response_cache
+    from .services.async_ollama_client import AsyncOllamaClient
     from .services.docling_wrapper import DoclingWrapper
-    from .config.settings import get_config
+    from .config.settings import ensure_directories, get_config
+    from .utils.cache import file_sha256
     from .utils.logger import setup_logger
+    from .utils.metrics import get_metrics, stage, track_document
+    from .utils.spill import MarkdownSpill
 
 
-def main():
+def log_cache_stats(logger, cache):
+    """
+    Log the hit/miss counters of the LLM response cache.
+    """
+    stats = cache.stats()
+    logger.info(f"LLM response cache: {stats['hits']} hits, {stats['misses']} misses "
+                f"(hit ratio {stats['hit_ratio']:.0%})")
+
+
+def save_metrics(logger, path):
+    """
+    Save the measurements of the processed documents, in the Prometheus text
+    format if the file name ends with .prom, as JSON otherwise.
+    """
+    metrics = get_metrics()
+    metrics_path = Path(path)
+    metrics_path.parent.mkdir(parents=True, exist_ok=True)
+    text = metrics.to_prometheus() if metrics_path.suffix == ".prom" else metrics.to_json()
+    metrics_path.write_text(text, encoding="utf-8")
+    logger.info(f"Metrics saved to: {metrics_path}")
+
+
+def log_stage_summary(logger):
+    """
+    Log the time spent in each stage of the pipeline, summed over the processed documents.
+    """
+    stages = get_metrics().to_dict(include_documents=False)["stages"]
+    if stages:
+        logger.info("Time per stage: " + ", ".join(f"{name} {histogram['sum']:.2f}s"
+                                                   for name, histogram in stages.items()))
+
+
+def log_pipeline_utilisation(logger, report):
+    """
+    Log the utilisation of each stage of the batch pipeline, to tune their numbers of workers.
+    """
+    if report.stages:
+        logger.info("Stage utilisation: " + ", ".join(
+            f"{stats.name} {stats.utilisation(report.elapsed_seconds):.0%} of {stats.workers} workers "
+            f"(blocked {stats.blocked_seconds:.1f}s, queue max {stats.max_queue})"
+            for stats in report.stages))
+
+
+def batch_main(argv):
+    """
+    Batch mode: process a directory, a glob pattern or a manifest of files.
+    """
+    parser = argparse.ArgumentParser(prog="bilan_extractor batch",
+                                     description="Extract financial variables from many financial statements.")
+    parser.add_argument("source", help="Directory, glob pattern or manifest file (one path per line)")
+    parser.add_argument("--model", help="Ollama model to use", default=None)
+    parser.add_argument("--output-dir", help="Directory where one JSON file per document is saved", default=None)
+    parser.add_argument("--report", help="Path to save the JSON batch report", default=None)
+    parser.add_argument("--journal", default=None,
+                        help="Journal recording the state of each document, so that a restarted run skips the extracted ones "
+                             "and only extracts the variables added or modified in variables.json since")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Number of attempts after which a failed document is skipped by the journal (default: 3)")
+    parser.add_argument("--year", type=int, help="Specific year to extract values for", default=None)
+    parser.add_argument("--value-type", choices=["brut", "net", "amortissement"],
+                        help="Type of value to extract (brut, net, amortissement)", default=None)
+    parser.add_argument("--workers", type=int, help="Number of conversion processes (default: number of CPUs)",
+                        default=None)
+    parser.add_argument("--llm-concurrency", type=int, default=None,
+                        help="Maximum number of concurrent LLM requests per Ollama server (default: OLLAMA_MAX_IN_FLIGHT)")
+    parser.add_argument("--llm-workers", type=int, default=None,
+                        help="Number of documents extracted at once (default: the concurrent LLM requests of all servers)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="Number of converted documents waiting for the LLM before the conversion waits "
+                             "(default: --llm-workers)")
+    parser.add_argument("--max-doc-tokens", type=int, default=None,
+                        help="Token budget of the document in the prompt (0 sends the whole document)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the conversion and LLM response caches")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached conversions and LLM responses and refresh the caches")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Wait for the complete LLM response instead of streaming it")
+    parser.add_argument("--metrics", default=None,
+                        help="Path to save the per-stage timings and LLM token counts (.prom for the Prometheus format, JSON otherwise)")
+    parser.add_argument("--sink", action="append", default=None,
+                        help="Result store to write to, by extension: .ndjson/.jsonl, .sqlite/.db or .parquet (repeatable)")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose output")
+
+    args = parser.parse_args(argv)
+
+    # Set up logger
+    log_level = "DEBUG" if args.verbose else "INFO"
+    logger = setup_logger(level=log_level)
+
+    # Get configuration
+    ensure_directories()
+    config = get_config()
+
+    sink = journal = None
+    try:
+        filepaths = collect_inputs(args.source)
+        logger.info(f"Processing {len(filepaths)} files")
+        sink = open_sinks(args.sink)
+
+        ollama_client = AsyncOllamaClient(
+            default_model=config["ollama"]["default_model"],
+            cache=None if args.no_cache else get_response_cache(),
+            refresh_cache=args.refresh,
+            max_in_flight=args.llm_concurrency
+        )
+        model = args.model or config["ollama"]["default_model"]
+        if args.journal:
+            journal = JobJournal(args.journal, make_job_key(model, args.year, args.value_type),
+                                 max_attempts=args.max_attempts)
+
+        report = run_batch(
+            filepaths,
+            ollama_client,
+            model=model,
+            year=args.year,
+            value_type=args.value_type,
+            output_dir=args.output_dir,
+            convert_workers=args.workers,
+            llm_workers=args.llm_workers,
+            queue_size=args.queue_size,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            max_document_tokens=args.max_doc_tokens,
+            stream=False if args.no_stream else None,
+            on_variable=lambda path, name, data: logger.debug(f"{path}: variable {name} extracted"),
+            sink=sink,
+            journal=journal
+        )
+        if sink is not None:
+            sink.close()
+            sink = None
+            logger.info(f"Results stored in: {', '.join(args.sink)}")
+
+        report_json = json.dumps(report.to_dict(), indent=2, ensure_ascii=False)
+        if args.report:
+            report_path = Path(args.report)
+            report_path.parent.mkdir(parents=True, exist_ok=True)
+            report_path.write_text(report_json, encoding="utf-8")
+            logger.info(f"Report saved to: {report_path}")
+
+        print(report_json)
+        logger.info(f"Batch completed: {report.succeeded} succeeded, {report.failed} failed, "
+                    f"{report.skipped} skipped, {report.docs_per_minute:.1f} docs/minute")
+        log_pipeline_utilisation(logger, report)
+        if journal is not None:
+            logger.info(f"Journal {args.journal}: " + ", ".join(
+                f"{count} {state}" for state, count in sorted(journal.counts().items())))
+        if ollama_client.cache is not None:
+            log_cache_stats(logger, ollama_client.cache)
+        log_stage_summary(logger)
+        if args.metrics:
+            save_metrics(logger, args.metrics)
+        if report.failed:
+            sys.exit(2)
+
+    except Exception as e:
+        logger.error(f"Error: {str(e)}", exc_info=args.verbose)
+        sys.exit(1)
+    finally:
+        if sink is not None:
+            sink.close()
+        if journal is not None:
+            journal.close()
+
+
+def serve_main(argv):
+    """
+    Server mode: keep the models warm and process extraction jobs submitted over HTTP.
+    """
+    parser = argparse.ArgumentParser(prog="bilan_extractor serve",
+                                     description="Run a resident extraction server.")
+    parser.add_argument("--host", help="Address to listen on", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Port to listen on", default=8765)
+    parser.add_argument("--socket", help="Unix socket to listen on instead of a TCP port", default=None)
+    parser.add_argument("--workers", type=int, help="Number of worker threads processing jobs", default=2)
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the conversion and LLM response caches")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached conversions and LLM responses and refresh the caches")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose output")
+
+    args = parser.parse_args(argv)
+
+    # Set up logger
+    log_level = "DEBUG" if args.verbose else "INFO"
+    logger = setup_logger(level=log_level)
+
+    # Get configuration
+    ensure_directories()
+    config = get_config()
+
+    try:
+        ollama_client = OllamaClient(
+            default_model=config["ollama"]["default_model"],
+            cache=None if args.no_cache else get_response_cache(),
+            refresh_cache=args.refresh
+        )
+        service = ExtractionService(
+            ollama_client,
+            workers=args.workers,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh
+        )
+        serve(service, host=args.host, port=args.port, socket_path=args.socket)
+    except Exception as e:
+        logger.error(f"Error: {str(e)}", exc_info=args.verbose)
+        sys.exit(1)
+
+
+def query_main(argv):
+    """
+    Query mode: print the values of a variable stored in a SQLite result store, one JSON line per value.
+    """
+    parser = argparse.ArgumentParser(prog="bilan_extractor query",
+                                     description="Query the values of a variable across the documents of a result store.")
+    parser.add_argument("store", help="SQLite result store written with --sink")
+    parser.add_argument("variable", help="Variable name or account code")
+    parser.add_argument("--year", type=int, help="Year of the values", default=None)
+    parser.add_argument("--value-type", choices=["brut", "net", "amortissement", "unspecified"],
+                        help="Type of the values", default=None)
+
+    args = parser.parse_args(argv)
+
+    if not Path(args.store).exists():
+        print(f"Result store not found: {args.store}", file=sys.stderr)
+        sys.exit(1)
+    for row in query_variable_values(args.store, args.variable, year=args.year, value_type=args.value_type):
+        print(json.dumps(row, ensure_ascii=False))
+
+
+def main(argv=None):
     """
     Main function for the bilan_extractor application.
     """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == "batch":
+        return batch_main(argv[1:])
+    if argv and argv[0] == "serve":
+        return serve_main(argv[1:])
+    if argv and argv[0] == "query":
+        return query_main(argv[1:])
+
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Extract financial variables from financial statements.")
     parser.add_argument("filepath", help="Path to the financial statement file")
@@ -44,19 +289,30 @@ def main():
     parser.add_argument("--output", help="Path to save the output JSON", default=None)
     parser.add_argument("--markdown", help="Path to save the intermediate Markdown", default=None)
     parser.add_argument("--year", type=int, help="Specific year to extract values for", default=None)
-    parser.add_argument("--value-type", choices=["brut", "net", "amortissement"], 
+    parser.add_argument("--value-type", choices=["brut", "net", "amortissement"],
                         help="Type of value to extract (brut, net, amortissement)", default=None)
+    parser.add_argument("--max-doc-tokens", type=int, default=None,
+                        help="Token budget of the document in the prompt (0 sends the whole document)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the conversion and LLM response caches")
+    parser.add_argument("--refresh", action="store_true", help="Ignore cached conversions and LLM responses and refresh the caches")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Wait for the complete LLM response instead of streaming it")
+    parser.add_argument("--metrics", default=None,
+                        help="Path to save the per-stage timings and LLM token counts (.prom for the Prometheus format, JSON otherwise)")
+    parser.add_argument("--sink", action="append", default=None,
+                        help="Result store to write to, by extension: .ndjson/.jsonl, .sqlite/.db or .parquet (repeatable)")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose output")
-    
-    args = parser.parse_args()
-    
+
+    args = parser.parse_args(argv)
+
     # Set up logger
     log_level = "DEBUG" if args.verbose else "INFO"
     logger = setup_logger(level=log_level)
-    
+
     # Get configuration
+    ensure_directories()
     config = get_config()
-    
+
     try:
         # Check if file exists
         filepath = Path(args.filepath)
@@ -65,69 +321,95 @@ def main():
             project_root = Path(__file__).resolve().parent.parent
             filename = filepath.name
             alternative_path = project_root / filename
-            
+
             if alternative_path.exists():
                 logger.info(f"File not found at {filepath}, using file at {alternative_path} instead")
                 filepath = alternative_path
             else:
                 logger.error(f"File not found: {filepath}")
                 sys.exit(1)
-        
+
         logger.info(f"Processing file: {filepath}")
-        
-        # Convert to Markdown
-        logger.info("Converting to Markdown...")
-        docling = DoclingWrapper()
-        
-        if args.markdown:
-            markdown_text = docling.parse_to_markdown(str(filepath), args.markdown)
-            logger.info(f"Markdown saved to: {args.markdown}")
-        else:
-            markdown_text = docling.parse_to_markdown(str(filepath))
-        
-        # Print the Markdown content in verbose mode
-        if args.verbose:
-            print("\n--- Markdown Content from PDF ---\n")
-            print(markdown_text)
-            print("\n--- End of Markdown Content ---\n")
-        
-        # Extract variables using Ollama
-        logger.info("Extracting financial variables...")
-        ollama_client = OllamaClient(default_model=config["ollama"]["default_model"])
-        model = args.model or config["ollama"]["default_model"]
-        
-        # Log extraction parameters
-        if args.year:
-            logger.info(f"Extracting values for year: {args.year}")
-        if args.value_type:
-            logger.info(f"Extracting values of type: {args.value_type}")
-        
-        json_str = ollama_client.extract_financial_variables(
-            markdown_text, 
-            model=model,
-            year=args.year,
-            value_type=args.value_type
-        )
-        
-        # Parse and validate the output
-        logger.info("Parsing and validating output...")
-        data = parse_llm_output(json_str)
-        variables = FinancialVariables.from_dict(data)
-        
-        # Output the result
-        result = variables.to_dict()
-        result_json = json.dumps(result, indent=2, ensure_ascii=False)
-        
+
+        with track_document(str(filepath)):
+            # Convert to Markdown
+            logger.info("Converting to Markdown...")
+            docling = DoclingWrapper()
+
+            # Long documents are converted into a spill file instead of a string
+            markdown_text = docling.parse_document(
+                str(filepath),
+                args.markdown,
+                use_cache=not args.no_cache,
+                refresh_cache=args.refresh
+            )
+            try:
+                if args.markdown:
+                    logger.info(f"Markdown saved to: {args.markdown}")
+
+                # Print the Markdown content in verbose mode
+                if args.verbose:
+                    print("\n--- Markdown Content from PDF ---\n")
+                    if isinstance(markdown_text, MarkdownSpill):
+                        markdown_text.write_to(sys.stdout)
+                        print()
+                    else:
+                        print(markdown_text)
+                    print("\n--- End of Markdown Content ---\n")
+
+                # Extract variables using Ollama
+                logger.info("Extracting financial variables...")
+                ollama_client = OllamaClient(
+                    default_model=config["ollama"]["default_model"],
+                    cache=None if args.no_cache else get_response_cache(),
+                    refresh_cache=args.refresh
+                )
+                model = args.model or config["ollama"]["default_model"]
+
+                # Log extraction parameters
+                if args.year:
+                    logger.info(f"Extracting values for year: {args.year}")
+                if args.value_type:
+                    logger.info(f"Extracting values of type: {args.value_type}")
+
+                result = extract_from_markdown(
+                    markdown_text,
+                    ollama_client,
+                    model=model,
+                    year=args.year,
+                    value_type=args.value_type,
+                    max_document_tokens=args.max_doc_tokens,
+                    stream=False if args.no_stream else None,
+                    on_variable=lambda name, data: logger.debug(f"Variable {name} extracted")
+                )
+            finally:
+                if isinstance(markdown_text, MarkdownSpill):
+                    markdown_text.close()
+
+            # Output the result
+            with stage("serialise"):
+                result_json = json.dumps(result, indent=2, ensure_ascii=False)
+
         if args.output:
             output_path = Path(args.output)
             # Create parent directory if it doesn't exist
             output_path.parent.mkdir(parents=True, exist_ok=True)
             output_path.write_text(result_json, encoding="utf-8")
             logger.info(f"Results saved to: {output_path}")
-        
+
+        if args.sink:
+            with open_sinks(args.sink) as sink:
+                sink.write(file_sha256(str(filepath)), str(filepath), result)
+            logger.info(f"Results stored in: {', '.join(args.sink)}")
+
         print(result_json)
+        if ollama_client.cache is not None:
+            log_cache_stats(logger, ollama_client.cache)
+        log_stage_summary(logger)
+        if args.metrics:
+            save_metrics(logger, args.metrics)
         logger.info("Processing completed successfully")
-        
+
     except Exception as e:
         logger.error(f"Error: {str(e)}", exc_info=args.verbose)
         sys.exit(1)
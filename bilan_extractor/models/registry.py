@@ -0,0 +1,366 @@
+"""
+Module providing the registry of the variables to extract.
+
+The variable configuration (config/variables.json) is loaded once and only
+read again when the file changes. The registry precomputes what every stage
+needs from it: the variables in configuration order, the mapping of aliases
+to canonical names, the normalized labels and account codes, and a
+multi-pattern matcher (Aho-Corasick over words) finding every alias and code
+occurring in a document in a single pass, whatever the size of the
+configuration. Each variable has a fingerprint of its definition, so that
+the results extracted with an older configuration can be completed with the
+variables added or modified since (see core.journal). The optional "checks"
+section of the configuration declares accounting identities between variables
+(a total equal to the sum of its parts), verified on the extracted values by
+core.consistency.
+"""
+import json
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Any, Optional, Tuple
+
+from ..utils.cache import make_cache_key
+
+# Default location of the variable configuration file
+VARIABLES_CONFIG_PATH = Path(__file__).resolve().parent.parent / "config" / "variables.json"
+
+# Loaded configurations, keyed by path, with the modification time they were read at
+_loaded_configs: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+
+# Registries built from the loaded configurations, keyed by path
+_registries: Dict[str, "VariableRegistry"] = {}
+
+_NON_ALNUM_PATTERN = re.compile(r"[^0-9a-z]+")
+
+
+def load_variable_config(config_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Load the configuration of the variables to extract.
+    The file is only read again when its modification time changes.
+
+    Args:
+        config_path: Path to the configuration file (defaults to config/variables.json)
+
+    Returns:
+        The configuration, with "default_variables" and "additional_variables" lists
+        and an optional "checks" list. It is shared between callers and must not be modified.
+    """
+    path = Path(config_path) if config_path else VARIABLES_CONFIG_PATH
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {"default_variables": [], "additional_variables": []}
+
+    loaded = _loaded_configs.get(str(path))
+    if loaded is not None and loaded[0] == mtime:
+        return loaded[1]
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        config = {"default_variables": [], "additional_variables": []}
+    _loaded_configs[str(path)] = (mtime, config)
+    return config
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text for matching: lowercase, without accents or punctuation.
+
+    Args:
+        text: The text to normalize
+
+    Returns:
+        The words of the text separated by single spaces
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _NON_ALNUM_PATTERN.sub(" ", text).strip()
+
+
+@dataclass
+class VariableSpec:
+    """
+    Data class describing a configured variable.
+    """
+    name: str
+    group: str
+    code: Optional[str] = None
+    aliases: List[str] = field(default_factory=list)
+    description: Optional[str] = None
+    labels: List[str] = field(default_factory=list)
+
+    @property
+    def fingerprint(self) -> str:
+        """Short hash of the definition of the variable, changing whenever the extraction of its values may."""
+        return make_cache_key(self.name, self.code, self.aliases, self.description)[:16]
+
+
+@dataclass
+class SumCheck:
+    """
+    Data class describing an accounting identity: the total variable equals the sum of the parts.
+    """
+    name: str
+    total: str
+    parts: List[str]
+    description: Optional[str] = None
+
+
+@dataclass
+class Match:
+    """
+    Data class representing an occurrence of an alias or a code in a normalized text.
+    """
+    name: str
+    kind: str
+    phrase: str
+    start: int
+    end: int
+
+
+class AliasMatcher:
+    """
+    Aho-Corasick automaton over words, finding every occurrence of a set of
+    normalized phrases in a text in one pass.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        """
+        Build the automaton.
+
+        Args:
+            patterns: (normalized phrase, payload) pairs; a phrase can have several payloads
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, Any]]] = [[]]
+
+        for phrase, payload in patterns:
+            words = phrase.split()
+            if not words:
+                continue
+            node = 0
+            for word in words:
+                next_node = self._goto[node].get(word)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][word] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append((len(words), payload))
+
+        # Breadth-first computation of the failure links
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(word, 0)
+                self._output[child].extend(self._output[self._fail[child]])
+
+    def find(self, words: List[str]) -> List[Tuple[int, int, Any]]:
+        """
+        Find the occurrences of the patterns in a list of normalized words.
+
+        Args:
+            words: The words of the text (see normalize_text)
+
+        Returns:
+            (start, end, payload) tuples, where start and end are word indices
+        """
+        matches = []
+        node = 0
+        for index, word in enumerate(words):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            for length, payload in self._output[node]:
+                matches.append((index + 1 - length, index + 1, payload))
+        return matches
+
+
+class VariableRegistry:
+    """
+    Registry of the configured variables, rebuilt when the configuration file changes.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Build the registry from a variable configuration.
+
+        Args:
+            config: The configuration (see load_variable_config)
+        """
+        self.config = config
+        self.variables: List[VariableSpec] = []
+        self.by_name: Dict[str, VariableSpec] = {}
+        self.by_code: Dict[str, VariableSpec] = {}
+        self.by_label: Dict[str, VariableSpec] = {}
+        self._aliases: Dict[str, str] = {}
+        self._normalized_aliases: Dict[str, str] = {}
+
+        patterns = []
+        for group in ("default_variables", "additional_variables"):
+            for var_config in config.get(group, []):
+                name = var_config.get("name")
+                if not name:
+                    continue
+                code = var_config.get("code")
+                spec = VariableSpec(
+                    name=name,
+                    group=group,
+                    code=str(code) if code else None,
+                    aliases=list(var_config.get("aliases", [])),
+                    description=var_config.get("description"),
+                )
+                for label in [name.replace("_", " ")] + spec.aliases:
+                    normalized = normalize_text(label)
+                    if normalized and normalized not in spec.labels:
+                        spec.labels.append(normalized)
+                        patterns.append((normalized, (name, "alias")))
+                        self.by_label.setdefault(normalized, spec)
+                if spec.code:
+                    patterns.append((spec.code, (name, "code")))
+                    self.by_code.setdefault(spec.code, spec)
+
+                for alias in spec.aliases:
+                    self._aliases[alias.lower()] = name
+                self._aliases[name.lower()] = name
+                for label in spec.labels:
+                    self._normalized_aliases.setdefault(label, name)
+
+                self.variables.append(spec)
+                self.by_name[name] = spec
+
+        self.checks: List[SumCheck] = []
+        for check_config in config.get("checks", []):
+            total = check_config.get("total")
+            parts = list(check_config.get("parts", []))
+            # Identities on variables that are not configured cannot be verified
+            if total not in self.by_name or not parts or any(part not in self.by_name for part in parts):
+                continue
+            self.checks.append(SumCheck(name=check_config.get("name") or total, total=total, parts=parts,
+                                        description=check_config.get("description")))
+
+        self.matcher = AliasMatcher(patterns)
+
+    @property
+    def names(self) -> List[str]:
+        """The names of the variables, in configuration order."""
+        return [spec.name for spec in self.variables]
+
+    @property
+    def fingerprints(self) -> Dict[str, str]:
+        """The fingerprints of the variables by name, in configuration order."""
+        return {spec.name: spec.fingerprint for spec in self.variables}
+
+    @property
+    def version(self) -> str:
+        """Short hash identifying the version of the configuration of the variables."""
+        return make_cache_key(self.fingerprints)[:16]
+
+    def select(self, names: Optional[Iterable[str]] = None) -> List[VariableSpec]:
+        """
+        Get the variables to extract.
+
+        Args:
+            names: Optional names restricting the selection
+
+        Returns:
+            The selected variables, in configuration order
+        """
+        if names is None:
+            return list(self.variables)
+        selected = set(names)
+        return [spec for spec in self.variables if spec.name in selected]
+
+    def canonical_name(self, key: str) -> Optional[str]:
+        """
+        Find the variable a key returned by the LLM refers to.
+
+        Args:
+            key: A variable name or alias, in any case, with or without accents and punctuation
+
+        Returns:
+            The canonical name of the variable, or None if the key is unknown
+        """
+        return self._aliases.get(key.lower()) or self._normalized_aliases.get(normalize_text(key))
+
+    def output_key(self, spec: VariableSpec) -> str:
+        """
+        Get the key of a variable in the compact output format: its account code,
+        shorter than its name, or its name when it has no code of its own.
+
+        Args:
+            spec: The variable
+
+        Returns:
+            The key
+        """
+        if spec.code and self.by_code.get(spec.code) is spec:
+            return spec.code
+        return spec.name
+
+    def resolve_key(self, key: str) -> Optional[VariableSpec]:
+        """
+        Find the variable a key of the compact output format refers to.
+
+        Args:
+            key: An account code, or a variable name or alias
+
+        Returns:
+            The variable, or None if the key is unknown
+        """
+        spec = self.by_code.get(key)
+        if spec is not None:
+            return spec
+        name = self.canonical_name(key)
+        return self.by_name.get(name) if name else None
+
+    def find(self, text: str, names: Optional[Iterable[str]] = None) -> List[Match]:
+        """
+        Find every occurrence of an alias or an account code in a text.
+
+        Args:
+            text: The text to scan, e.g. a Markdown document or a chunk of it
+            names: Optional names restricting the matches to some variables
+
+        Returns:
+            The matches, in text order, with word indices in the normalized text
+        """
+        selected = set(names) if names is not None else None
+        words = normalize_text(text).split()
+        matches = []
+        for start, end, (name, kind) in self.matcher.find(words):
+            if selected is not None and name not in selected:
+                continue
+            matches.append(Match(name=name, kind=kind, phrase=" ".join(words[start:end]), start=start, end=end))
+        matches.sort(key=lambda match: (match.start, -match.end))
+        return matches
+
+
+def get_registry(config_path: Optional[str] = None) -> VariableRegistry:
+    """
+    Get the registry of the configured variables.
+    It is only rebuilt when the configuration file changes.
+
+    Args:
+        config_path: Path to the configuration file (defaults to config/variables.json)
+
+    Returns:
+        The registry, shared between callers
+    """
+    key = str(Path(config_path) if config_path else VARIABLES_CONFIG_PATH)
+    config = load_variable_config(config_path)
+    registry = _registries.get(key)
+    if registry is None or registry.config is not config:
+        registry = _registries[key] = VariableRegistry(config)
+    return registry
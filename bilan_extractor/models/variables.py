@@ -1,11 +1,13 @@
 """
 Module defining data models for financial variables.
 """
-import json
+from array import array
 from dataclasses import dataclass, field
 from enum import Enum
-from pathlib import Path
-from typing import Dict, List, Optional, Any, Union
+from typing import Dict, Iterable, List, Optional, Any, Tuple
+
+from ..core.parser import parse_amount
+from .registry import get_registry
 
 
 class ValueType(Enum):
@@ -16,14 +18,24 @@ class ValueType(Enum):
     UNSPECIFIED = "unspecified"
 
 
-@dataclass
 class FinancialValue:
     """
-    Data class representing a financial value with its type and year.
+    Class representing a financial value with its type and year.
     """
-    value: float
-    value_type: ValueType = ValueType.UNSPECIFIED
-    year: Optional[int] = None
+    __slots__ = ("value", "value_type", "year")
+
+    def __init__(self, value: float, value_type: ValueType = ValueType.UNSPECIFIED, year: Optional[int] = None):
+        self.value = value
+        self.value_type = value_type
+        self.year = year
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FinancialValue):
+            return NotImplemented
+        return (self.value, self.value_type, self.year) == (other.value, other.value_type, other.year)
+
+    def __repr__(self) -> str:
+        return f"FinancialValue(value={self.value!r}, value_type={self.value_type!r}, year={self.year!r})"
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary representation."""
@@ -34,34 +46,131 @@ class FinancialValue:
         }
 
 
-@dataclass
+# Value types by code, the code of a value type being its position in this tuple
+_VALUE_TYPES = tuple(ValueType)
+_VALUE_TYPE_CODES = {value_type: code for code, value_type in enumerate(_VALUE_TYPES)}
+# Number of bits of the value type code in a value key
+_TYPE_BITS = 2
+_TYPE_MASK = (1 << _TYPE_BITS) - 1
+# Year bits of a value whose year cannot be packed (a label such as "N" or
+# "2023/2024", a string, an out-of-range number): the year itself is kept in
+# the side table of the variable
+_OTHER_YEAR = (1 << (31 - _TYPE_BITS)) - 1
+
+
+def _packed_year(year: Any) -> int:
+    """The year bits of a value key: 0 without year, _OTHER_YEAR if the year cannot be packed."""
+    if year is None:
+        return 0
+    if type(year) is int and 0 < year < _OTHER_YEAR:
+        return year
+    return _OTHER_YEAR
+
+
+def _value_key(value_type: ValueType, year: Any) -> int:
+    """
+    Pack the value type and the year of a value into an integer key.
+
+    The year takes the high bits and the value type code the low bits; a value
+    without year is stored with the year 0, and a year that is not an int of
+    the packable range with the year _OTHER_YEAR.
+    """
+    return _packed_year(year) << _TYPE_BITS | _VALUE_TYPE_CODES[value_type]
+
+
+def _key_value_type(key: int) -> ValueType:
+    """The value type of a value key."""
+    return _VALUE_TYPES[key & _TYPE_MASK]
+
+
+def _key_year(key: int) -> Optional[int]:
+    """The year of a value key (meaningless for a key with the year _OTHER_YEAR)."""
+    return (key >> _TYPE_BITS) or None
+
+
 class FinancialVariable:
     """
-    Data class representing a financial variable with its values.
+    Class representing a financial variable with its values.
+
+    The values are stored in two parallel arrays, the amounts and their keys
+    packing the value type and the year (see _value_key), rather than as one
+    object each. get_value finds a (value type, year) pair in an index built on
+    the first lookup. The years that cannot be packed in a key are kept as
+    given, by position, in a side table.
     """
-    name: str
-    values: List[FinancialValue] = field(default_factory=list)
-    code: Optional[str] = None
-    description: Optional[str] = None
+    __slots__ = ("name", "code", "description", "_amounts", "_keys", "_years", "_index")
+
+    def __init__(self, name: str, values: Optional[Iterable[FinancialValue]] = None, code: Optional[str] = None,
+                 description: Optional[str] = None):
+        self.name = name
+        self.code = code
+        self.description = description
+        values = list(values or ())
+        # Built from lists so that the arrays are allocated to their exact size
+        self._amounts = array("d", [val.value for val in values])
+        self._keys = array("i", [_value_key(val.value_type, val.year) for val in values])
+        self._years: Dict[int, Any] = {position: val.year for position, val in enumerate(values)
+                                       if _packed_year(val.year) == _OTHER_YEAR}
+        self._index: Optional[Dict[int, int]] = None
+
+    def _year(self, position: int) -> Any:
+        """The year of the value at a position."""
+        key = self._keys[position]
+        if key >> _TYPE_BITS == _OTHER_YEAR:
+            return self._years[position]
+        return _key_year(key)
+
+    @property
+    def values(self) -> Tuple[FinancialValue, ...]:
+        """The values of the variable, in insertion order (read-only: use add_value to add one)."""
+        return tuple(FinancialValue(amount, _key_value_type(key), self._year(position))
+                     for position, (amount, key) in enumerate(zip(self._amounts, self._keys)))
+
+    def __len__(self) -> int:
+        return len(self._amounts)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FinancialVariable):
+            return NotImplemented
+        return (self.name, self.code, self.description, self._amounts, self._keys, self._years) == (
+            other.name, other.code, other.description, other._amounts, other._keys, other._years)
+
+    def __repr__(self) -> str:
+        return (f"FinancialVariable(name={self.name!r}, values={self.values!r}, code={self.code!r}, "
+                f"description={self.description!r})")
     
     def add_value(self, value: float, value_type: ValueType = ValueType.UNSPECIFIED, year: Optional[int] = None) -> None:
         """Add a value to this variable."""
-        self.values.append(FinancialValue(value=value, value_type=value_type, year=year))
+        key = _value_key(value_type, year)
+        if key >> _TYPE_BITS == _OTHER_YEAR:
+            self._years[len(self._keys)] = year
+        self._amounts.append(value)
+        self._keys.append(key)
+        if self._index is not None:
+            self._index.setdefault(key, len(self._keys) - 1)
     
     def get_value(self, value_type: Optional[ValueType] = None, year: Optional[int] = None) -> Optional[float]:
-        """Get a value matching the specified type and year."""
-        for val in self.values:
-            type_match = value_type is None or val.value_type == value_type
-            year_match = year is None or val.year == year
-            if type_match and year_match:
-                return val.value
+        """Get the first value matching the specified type and year."""
+        if value_type is not None and year is not None and _packed_year(year) != _OTHER_YEAR:
+            if self._index is None:
+                # Built in reverse so that the first of equal keys wins
+                self._index = {key: position for position, key in reversed(list(enumerate(self._keys)))}
+            position = self._index.get(_value_key(value_type, year))
+            return None if position is None else self._amounts[position]
+        for position, (amount, key) in enumerate(zip(self._amounts, self._keys)):
+            if ((value_type is None or _key_value_type(key) == value_type)
+                    and (year is None or self._year(position) == year)):
+                return amount
         return None
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary representation."""
         result = {
             "name": self.name,
-            "values": [v.to_dict() for v in self.values]
+            "values": [
+                {"value": amount, "value_type": _key_value_type(key).value, "year": self._year(position)}
+                for position, (amount, key) in enumerate(zip(self._amounts, self._keys))
+            ]
         }
         if self.code:
             result["code"] = self.code
@@ -96,56 +205,36 @@ class FinancialVariables:
         Returns:
             A FinancialVariables instance
         """
-        # Load variable configuration
-        config_path = Path(__file__).resolve().parent.parent / "config" / "variables.json"
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            config = {"default_variables": [], "additional_variables": []}
-        
-        # Create mapping of variable aliases to canonical names
-        alias_mapping = {}
-        for var_list in [config.get("default_variables", []), config.get("additional_variables", [])]:
-            for var_config in var_list:
-                name = var_config.get("name")
-                if name:
-                    for alias in var_config.get("aliases", []):
-                        alias_mapping[alias.lower()] = name
-                    # Also map the name itself
-                    alias_mapping[name.lower()] = name
+        # Aliases and configured variables come from the registry, built once per configuration
+        registry = get_registry()
         
         # Create variable objects from configuration
         variables = {}
-        for var_list in [config.get("default_variables", []), config.get("additional_variables", [])]:
-            for var_config in var_list:
-                name = var_config.get("name")
-                if name:
-                    variables[name] = FinancialVariable(
-                        name=name,
-                        code=var_config.get("code"),
-                        description=var_config.get("description")
-                    )
+        for spec in registry.variables:
+            variables[spec.name] = FinancialVariable(
+                name=spec.name,
+                code=spec.code,
+                description=spec.description
+            )
         
         # Process input data
         result = cls()
+        # Values of each variable, stored in its arrays once all are known
+        values: Dict[str, List[FinancialValue]] = {}
         
         # Handle legacy format (flat dictionary of values)
         for key, value in data.items():
-            key_lower = key.lower()
-            
             # Skip null values
             if value is None:
                 continue
                 
-            # Try to convert to float
-            try:
-                float_value = float(value)
-            except (ValueError, TypeError):
+            # Try to convert to float, amounts written in French notation included
+            float_value = parse_amount(value)
+            if float_value is None:
                 continue
                 
             # Find the canonical variable name
-            var_name = alias_mapping.get(key_lower)
+            var_name = registry.canonical_name(key)
             if not var_name:
                 # If not in our mapping, use the key as is
                 var_name = key
@@ -155,7 +244,7 @@ class FinancialVariables:
                 variables[var_name] = FinancialVariable(name=var_name)
                 
             # Add the value
-            variables[var_name].add_value(float_value)
+            values.setdefault(var_name, []).append(FinancialValue(float_value))
         
         # Handle new format (structured with value types and years)
         for var_name, var_data in data.items():
@@ -171,15 +260,19 @@ class FinancialVariables:
                 for val_data in var_data["values"]:
                     if isinstance(val_data, dict) and "value" in val_data:
                         try:
-                            float_value = float(val_data["value"])
-                            value_type = ValueType(val_data.get("value_type", "unspecified"))
+                            float_value = parse_amount(val_data["value"])
+                            if float_value is None:
+                                continue
+                            value_type = ValueType(str(val_data.get("value_type") or "unspecified").lower())
                             year = val_data.get("year")
-                            variables[var_name].add_value(float_value, value_type, year)
+                            values.setdefault(var_name, []).append(FinancialValue(float_value, value_type, year))
                         except (ValueError, TypeError):
                             continue
         
         # Add all variables to the result
-        for var in variables.values():
+        for var_name, var in variables.items():
+            if var_name in values:
+                var = FinancialVariable(var.name, values[var_name], code=var.code, description=var.description)
             result.add_variable(var)
             
         return result
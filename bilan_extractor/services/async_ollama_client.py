@@ -0,0 +1,282 @@
+"""
+Module for interacting with the Ollama API from asyncio code.
+
+The client keeps one pooled HTTP connection per configured server and bounds
+the number of requests in flight on each server with a semaphore of its own,
+so that a batch can submit every document at once while each Ollama server
+only receives as many requests as it has parallel slots. With several servers,
+requests are routed as in OllamaClient (least expected work, failover to
+another server) before waiting for a slot of the chosen server, the requests
+waiting for it counting in its expected work. Requests have a timeout and are
+retried with an exponential backoff on transient errors; the response cache,
+the streaming mode and the model fallback behave as in OllamaClient.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Any, Optional
+
+from .endpoint_pool import Endpoint, EndpointPool
+from .ollama_client import (RequestRetries, build_extraction_prompt, build_messages, build_output_schema,
+                            cached_response, emit_members, fallback_model, generation_options, get_output_format,
+                            response_metadata, stream_metadata)
+from ..config import settings
+from ..core.stream_parser import IncrementalJSONObjectParser
+from ..utils.cache import DiskCache, make_cache_key
+from ..utils.metrics import record_llm_response, stage
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+
+class AsyncOllamaClient:
+    """
+    Asynchronous client for interacting with the Ollama API.
+    """
+
+    def __init__(self, default_model: str = "gemma3", cache: Optional[DiskCache] = None,
+                 refresh_cache: bool = False, options: Optional[Dict[str, Any]] = None,
+                 host: Optional[str] = None, max_in_flight: Optional[int] = None,
+                 timeout: Optional[float] = None, max_retries: Optional[int] = None,
+                 retry_backoff: Optional[float] = None, hosts: Optional[List[str]] = None,
+                 keep_alive: Optional[str] = None):
+        """
+        Initialize the client.
+
+        Args:
+            default_model: The default model to use for queries
+            cache: Optional cache of responses (see get_response_cache)
+            refresh_cache: Whether to ignore cached responses (the cache is still updated)
+            options: Generation options sent to the model, part of the cache key (completed
+                with num_ctx and num_predict from the settings)
+            host: The Ollama server URL (defaults to the OLLAMA_HOST setting)
+            max_in_flight: Maximum number of concurrent requests per server (defaults to the
+                OLLAMA_MAX_IN_FLIGHT setting)
+            timeout: Timeout of a request in seconds, including the generation (defaults to the settings)
+            max_retries: Retries of a request failing with a transient error (defaults to the settings)
+            retry_backoff: Delay before the first retry in seconds (defaults to the settings)
+            hosts: Several Ollama server URLs to spread the requests over (defaults to
+                host, or to the OLLAMA_HOSTS setting)
+            keep_alive: How long the server keeps the model, and the cache of the system
+                prompt, loaded after a request (defaults to the OLLAMA_KEEP_ALIVE setting)
+        """
+        ollama_settings = settings.get_config()["ollama"]
+        self.default_model = default_model
+        self.hosts = list(hosts) if hosts else ([host] if host else ollama_settings["hosts"])
+        self.host = self.hosts[0]
+        self.max_in_flight = max(1, max_in_flight if max_in_flight is not None else ollama_settings["max_in_flight"])
+        self.timeout = timeout if timeout is not None else ollama_settings["timeout"]
+        self.max_retries = max_retries if max_retries is not None else ollama_settings["max_retries"]
+        self.retry_backoff = retry_backoff if retry_backoff is not None else ollama_settings["retry_backoff"]
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        self.options = generation_options(options)
+        self.keep_alive = keep_alive if keep_alive is not None else ollama_settings["keep_alive"]
+
+        self.pool = EndpointPool(self.hosts, probe_interval=ollama_settings["health_check_interval"])
+        self.pool.start()
+
+        # Created on first use, inside the event loop running the requests
+        self._clients: Dict[str, Any] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def __aenter__(self) -> "AsyncOllamaClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """
+        Close the pooled HTTP connections. The client can be used again afterwards,
+        from another event loop, and opens new pools on its next request.
+        """
+        clients, self._clients, self._semaphores = self._clients, {}, {}
+        for client in clients.values():
+            await client.close()
+
+    def close(self) -> None:
+        """
+        Stop the health probes of the Ollama servers.
+        """
+        self.pool.stop()
+
+    def _client_for(self, host: str):
+        """Get the ollama.AsyncClient holding the connection pool of a server."""
+        client = self._clients.get(host)
+        if client is None:
+            import ollama
+            client = self._clients[host] = ollama.AsyncClient(host=host, timeout=self.timeout)
+        return client
+
+    def _semaphore_for(self, endpoint: Endpoint) -> asyncio.Semaphore:
+        """Get the semaphore bounding the number of requests in flight on a server."""
+        semaphore = self._semaphores.get(endpoint.host)
+        if semaphore is None:
+            semaphore = self._semaphores[endpoint.host] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+
+    async def chat(self, prompt: str, model: Optional[str] = None, stream: bool = False,
+                   on_variable: Optional[Callable[[str, Any], None]] = None, system: Optional[str] = None,
+                   schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send a chat message to the Ollama API and get the response.
+        Responses are served from the cache when an identical request was already answered.
+
+        Args:
+            prompt: The prompt to send to the model
+            model: The model to use (defaults to the instance's default_model)
+            stream: Whether to stream the response and stop the generation once the
+                top-level JSON object is closed
+            on_variable: Optional callback called with (key, value) for each member of the JSON object
+            system: Optional system prompt, sent before the prompt
+            schema: Optional JSON schema the answer is constrained to, part of the cache key
+
+        Returns:
+            The model's response as a string
+        """
+        model_to_use = model or self.default_model
+        messages = build_messages(prompt, system)
+
+        if self.cache is None:
+            return await self._chat(messages, model_to_use, stream, on_variable, schema)
+
+        key = make_cache_key(messages, model_to_use, self.options, schema)
+        content = cached_response(self.cache, key, self.refresh_cache, model_to_use, on_variable)
+        if content is not None:
+            return content
+
+        content = await self._chat(messages, model_to_use, stream, on_variable, schema)
+        self.cache.set(key, content)
+        return content
+
+    async def _chat(self, messages: List[Dict[str, str]], model_to_use: str, stream: bool,
+                    on_variable: Optional[Callable[[str, Any], None]],
+                    schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send a chat message, falling back to other models if it is not found.
+        """
+        try:
+            return await self._request(messages, model_to_use, stream, on_variable, schema)
+        except Exception as e:
+            model = fallback_model(e, model_to_use, self.default_model)
+            if model is None:
+                raise
+            return await self._request(messages, model, stream, on_variable, schema)
+
+    async def _request(self, messages: List[Dict[str, str]], model_to_use: str, stream: bool,
+                       on_variable: Optional[Callable[[str, Any], None]],
+                       schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send a chat request within the in-flight limit of the chosen server, retrying
+        on transient errors: immediately on the other servers, then with a backoff once
+        every server failed. The slot is released while waiting before a retry.
+        """
+        retries = RequestRetries(self.pool, self.max_retries, self.retry_backoff)
+        while True:
+            endpoint = retries.acquire()
+            try:
+                async with self._semaphore_for(endpoint):
+                    start = time.perf_counter()
+                    content = await asyncio.wait_for(
+                        self._send(self._client_for(endpoint.host), messages, model_to_use, stream, on_variable,
+                                   schema),
+                        timeout=self.timeout)
+            except Exception as e:
+                delay = retries.failure(endpoint, e)
+                if delay is None:
+                    raise
+            except BaseException:
+                # Cancelled while waiting for a slot or for the server
+                self.pool.release(endpoint)
+                raise
+            else:
+                self.pool.release(endpoint, latency=time.perf_counter() - start)
+                return content
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def _send(self, client, messages: List[Dict[str, str]], model_to_use: str, stream: bool,
+                    on_variable: Optional[Callable[[str, Any], None]],
+                    schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send one chat request to an Ollama server.
+        """
+        if not stream:
+            response = await client.chat(
+                model=model_to_use,
+                messages=messages,
+                options=self.options or None,
+                format=schema,
+                keep_alive=self.keep_alive
+            )
+            content = response['message']['content']
+            record_llm_response(response_metadata(response))
+            emit_members(content, on_variable)
+            return content
+
+        parser = IncrementalJSONObjectParser()
+        received = []
+        started, first_chunk_at, chunk = time.perf_counter(), None, None
+        chunks = await client.chat(
+            model=model_to_use,
+            messages=messages,
+            options=self.options or None,
+            format=schema,
+            keep_alive=self.keep_alive,
+            stream=True
+        )
+        try:
+            async for chunk in chunks:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                text = chunk['message']['content']
+                received.append(text)
+                for key, value in parser.feed(text):
+                    if on_variable is not None:
+                        on_variable(key, value)
+                if parser.done:
+                    logger.debug("JSON object complete, stopping the generation")
+                    break
+        finally:
+            # Closing the stream drops the connection, which cancels the generation on the server
+            close = getattr(chunks, "aclose", None)
+            if close is not None:
+                await close()
+        record_llm_response(stream_metadata(chunk, len(received), started, first_chunk_at))
+
+        return parser.result() or "".join(received)
+
+    async def extract_financial_variables(self, markdown_text: str, model: Optional[str] = None,
+                                          year: Optional[int] = None, value_type: Optional[str] = None,
+                                          variable_names: Optional[List[str]] = None, stream: bool = False,
+                                          on_variable: Optional[Callable[[str, Any], None]] = None,
+                                          output_format: Optional[str] = None,
+                                          notes: Optional[List[str]] = None) -> str:
+        """
+        Extract financial variables from Markdown text using a local LLM via Ollama.
+
+        Args:
+            markdown_text: The financial statement in Markdown format
+            model: The LLM model to use (defaults to the instance's default_model)
+            year: The specific year to extract values for (optional)
+            value_type: The type of value to extract (brut, net, amortissement) (optional)
+            variable_names: Optional names restricting the prompt to some variables
+            stream: Whether to stream the response and stop the generation once the JSON object is closed
+            on_variable: Optional callback called with (name, data) for each variable as soon as it is complete
+            output_format: "compact" or "verbose" (defaults to the PROMPT_OUTPUT_FORMAT setting); the
+                members of a compact answer are rows, to expand with core.parser.expand_compact_output
+            notes: Optional remarks on the values of a previous answer to check again
+
+        Returns:
+            The extracted variables as a JSON string
+        """
+        output_format = get_output_format(output_format)
+        with stage("prompt_build"):
+            system_prompt, prompt = build_extraction_prompt(markdown_text, year=year, value_type=value_type,
+                                                            variable_names=variable_names,
+                                                            output_format=output_format, notes=notes)
+            schema = build_output_schema(variable_names) if output_format == "compact" else None
+        with stage("llm"):
+            return await self.chat(prompt, model, stream=stream, on_variable=on_variable, system=system_prompt,
+                                   schema=schema)
@@ -4,47 +4,309 @@ Uses docling.document_converter.DocumentConverter for PDF to Markdown conversion
 With fallback to PyPDF2 for direct text extraction if docling fails.
 
 Supports disabling SSL verification for environments with SSL certificate issues.
+Conversions are cached on disk so that unchanged PDFs are never converted twice.
+Long documents are split into page ranges converted in a process pool; the
+Markdown of the ranges is merged back in page order, each page starting with a
+"## Page N" marker whatever the backend. Before a docling conversion, the pages
+are triaged from their PyPDF2 text layer (see core.page_triage) and only those
+looking like financial statements go through the docling models.
+Long documents can be converted into a spill file (see utils.spill) instead of a
+string: the pages are written as they are converted, docling converting at most
+one range of pages at a time, so the memory used does not grow with the length
+of the document.
+docling (and its torch-based models) and PyPDF2 are only imported when a
+conversion actually needs them, so importing this module is cheap.
 """
+import importlib.util
 import logging
 import os
-import ssl
-import urllib.request
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 # Import settings to access configuration
 from ..config import settings
+from ..core.page_triage import select_pages
+from ..models.registry import get_registry
+from ..utils.cache import DiskCache, file_sha256, make_cache_key
+from ..utils.metrics import current_document, stage
+from ..utils.spill import MarkdownSpill
 
-# Configure SSL verification before importing docling
-config = settings.get_config()
-if config["docling"]["disable_ssl_verification"]:
-    # Disable SSL certificate verification
-    ssl._create_default_https_context = ssl._create_unverified_context
-    os.environ["PYTHONHTTPSVERIFY"] = "0"
-    # Disable SSL verification warnings
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# Whether configure_ssl() already ran in this process
+_ssl_configured = False
+
+
+def configure_ssl() -> None:
+    """
+    Disable SSL certificate verification if requested by the configuration.
+    Must run before docling downloads its models; does nothing after the first call.
+    """
+    global _ssl_configured
+    if _ssl_configured:
+        return
+    _ssl_configured = True
+    
+    if settings.get_config()["docling"]["disable_ssl_verification"]:
+        import ssl
+        
+        # Disable SSL certificate verification
+        ssl._create_default_https_context = ssl._create_unverified_context
+        os.environ["PYTHONHTTPSVERIFY"] = "0"
+        # Disable SSL verification warnings
+        try:
+            import urllib3
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        except ImportError:
+            pass
+        
+        logger.warning("SSL certificate verification is disabled. This is not recommended for production use.")
+
+
+def is_docling_available() -> bool:
+    """
+    Check whether the docling library is installed, without importing it.
+    
+    Returns:
+        True if docling can be imported
+    """
+    return importlib.util.find_spec("docling") is not None
+
+
+# Options passed to the docling pipeline, part of the identity of cached conversions
+DOCLING_PIPELINE_OPTIONS = {}
+
+# Version of the Markdown produced by this module, bump it to invalidate cached conversions
+# (2: docling output has a "## Page N" marker before each page)
+MARKDOWN_FORMAT_VERSION = 2
+
+# Lazily created cache of converted documents
+_markdown_cache = None
+
+# Lazily created docling converter, kept for the lifetime of the process
+_document_converter = None
+
+# Lazily created process pool converting page ranges, with its number of workers
+_page_pool: Optional[ProcessPoolExecutor] = None
+_page_pool_workers = 0
+
+
+def get_markdown_cache() -> DiskCache:
+    """
+    Get the on-disk cache of PDF to Markdown conversions.
+
+    Returns:
+        The DiskCache shared by all conversions of this process
+    """
+    global _markdown_cache
+    if _markdown_cache is None:
+        cache_settings = settings.get_config()["cache"]
+        _markdown_cache = DiskCache(
+            str(Path(cache_settings["dir"]) / "markdown"),
+            max_bytes=cache_settings["markdown_max_bytes"]
+        )
+    return _markdown_cache
+
+
+def get_document_converter():
+    """
+    Get the docling DocumentConverter of this process.
+    docling is imported and its layout and table models are loaded on first use only,
+    then reused by every conversion.
+    
+    Returns:
+        The shared DocumentConverter instance
+        
+    Raises:
+        ImportError: If docling is not installed
+    """
+    global _document_converter
+    if _document_converter is None:
+        configure_ssl()
+        from docling.document_converter import DocumentConverter
+        _document_converter = DocumentConverter()
+    return _document_converter
+
+
+def get_page_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Get the process pool converting page ranges.
+    The pool is kept for the lifetime of the process, so that each worker loads
+    the docling models once; it is recreated if a different size is requested.
+
+    Args:
+        workers: Number of worker processes
+
+    Returns:
+        The shared ProcessPoolExecutor
+    """
+    global _page_pool, _page_pool_workers
+    if _page_pool is None or _page_pool_workers != workers:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=False)
+        _page_pool, _page_pool_workers = ProcessPoolExecutor(max_workers=workers), workers
+    return _page_pool
+
+
+def count_pages(input_path: Path) -> Optional[int]:
+    """
+    Count the pages of a PDF file without converting it.
+
+    Args:
+        input_path: Path to the PDF file
+
+    Returns:
+        The number of pages, or None if PyPDF2 is missing or cannot read the file
+    """
     try:
-        import urllib3
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    except ImportError:
-        pass
+        import PyPDF2
+
+        with open(input_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    except Exception as e:
+        logger.debug(f"Could not count the pages of {input_path}: {e}")
+        return None
+
+
+def page_ranges(pages: List[int], workers: int, pages_per_chunk: int) -> List[Tuple[int, int]]:
+    """
+    Group the pages to convert into ranges converted by separate processes.
+
+    Args:
+        pages: The page numbers to convert, 1-based and sorted
+        workers: Number of worker processes
+        pages_per_chunk: Maximum number of pages of a range
+
+    Returns:
+        The (first, last) page ranges, inclusive, in page order: runs of consecutive
+        pages, split so that every worker gets at least one range when there are enough pages
+    """
+    size = max(1, min(pages_per_chunk, -(-len(pages) // max(1, workers))))
+    ranges: List[Tuple[int, int]] = []
+    for page in pages:
+        if ranges and page == ranges[-1][1] + 1 and ranges[-1][1] - ranges[-1][0] + 1 < size:
+            ranges[-1] = (ranges[-1][0], page)
+        else:
+            ranges.append((page, page))
+    return ranges
+
+
+def _pypdf2_page_texts(filepath: str, first: int = 1, last: Optional[int] = None) -> Iterator[str]:
+    """
+    Extract the text layer of a range of pages with PyPDF2, one page at a time.
+    """
+    import PyPDF2
+
+    with open(filepath, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        last = len(reader.pages) if last is None else min(last, len(reader.pages))
+        for page_num in range(first - 1, last):
+            text = reader.pages[page_num].extract_text() or ""
+            # Drop the objects resolved for the page (its decompressed content streams), so that
+            # they do not accumulate over a long document; they are read again if ever needed
+            reader.resolved_objects.clear()
+            yield text
+
+
+def _pypdf2_pages_to_markdown(filepath: str, first: int = 1, last: Optional[int] = None) -> Iterator[str]:
+    """
+    Extract the text of a range of pages with PyPDF2, one "## Page N" section per non-empty page.
+    """
+    for page_num, text in enumerate(_pypdf2_page_texts(filepath, first, last), start=first):
+        if text:
+            yield f"## Page {page_num}\n\n{text}\n\n"
+
+
+def _docling_pages_to_markdown(filepath: str, first: int = 1, last: Optional[int] = None) -> Iterator[str]:
+    """
+    Convert a range of pages with docling, one "## Page N" section per non-empty page.
+    """
+    converter = get_document_converter()
+    if last is None:
+        result = converter.convert(filepath)
+    else:
+        result = converter.convert(filepath, page_range=(first, last))
+    document = result.document
+
+    for page_no in sorted(document.pages):
+        text = document.export_to_markdown(page_no=page_no).strip()
+        if text:
+            yield f"## Page {page_no}\n\n{text}\n\n"
+
+
+def _iter_page_range(filepath: str, backend: str, first: int = 1, last: Optional[int] = None) -> Iterator[str]:
+    """
+    Convert a range of pages to Markdown, one page at a time.
+
+    Args:
+        filepath: Path to the PDF file
+        backend: The conversion backend ("docling" or "pypdf2")
+        first: First page of the range, 1-based
+        last: Last page of the range, inclusive (None for the end of the document)
+
+    Returns:
+        An iterator over the Markdown of the pages of the range
+    """
+    if backend == "docling":
+        return _docling_pages_to_markdown(filepath, first, last)
+    return _pypdf2_pages_to_markdown(filepath, first, last)
+
+
+def _convert_page_range(filepath: str, backend: str, first: int = 1, last: Optional[int] = None) -> str:
+    """
+    Convert a range of pages to Markdown. Runs in a worker process of the page pool.
+
+    Args:
+        filepath: Path to the PDF file
+        backend: The conversion backend ("docling" or "pypdf2")
+        first: First page of the range, 1-based
+        last: Last page of the range, inclusive (None for the end of the document)
+
+    Returns:
+        The Markdown of the pages of the range
+    """
+    return "".join(_iter_page_range(filepath, backend, first, last))
+
+
+def _package_version(package: str) -> Optional[str]:
+    """Get the installed version of a package, if any."""
+    import importlib.metadata
     
-    logger = logging.getLogger("bilan_extractor")
-    logger.warning("SSL certificate verification is disabled. This is not recommended for production use.")
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
 
-# Import docling for PDF to Markdown conversion
-try:
-    from docling.document_converter import DocumentConverter
-    DOCLING_AVAILABLE = True
-except ImportError:
-    DOCLING_AVAILABLE = False
-    logger = logging.getLogger("bilan_extractor")
-    logger.warning("docling library not available. Will use PyPDF2 for text extraction.")
 
-# Import PyPDF2 for fallback text extraction
-import PyPDF2
+def converter_identity(backend: str) -> Dict[str, Any]:
+    """
+    Describe the converter producing the Markdown, so that cached conversions
+    are invalidated when the backend, its version or its options change.
 
-# Set up logger
-logger = logging.getLogger("bilan_extractor")
+    Args:
+        backend: The conversion backend ("docling" or "pypdf2")
+
+    Returns:
+        A dictionary identifying the converter
+    """
+    identity = {"backend": backend, "format_version": MARKDOWN_FORMAT_VERSION}
+    if backend == "docling":
+        identity["docling_version"] = _package_version("docling")
+        identity["pipeline_options"] = DOCLING_PIPELINE_OPTIONS
+        docling_settings = settings.get_config()["docling"]
+        if docling_settings["page_triage"]:
+            # The selected pages depend on the triage settings and on the aliases and codes of the variables
+            identity["page_triage"] = {
+                "min_score": docling_settings["triage_min_score"],
+                "margin": docling_settings["triage_margin"],
+                "min_pages": docling_settings["triage_min_pages"],
+                "variables": make_cache_key([(spec.labels, spec.code) for spec in get_registry().variables]),
+            }
+    else:
+        identity["pypdf2_version"] = _package_version("PyPDF2")
+    return identity
 
 
 class DoclingWrapper:
@@ -52,10 +314,25 @@ class DoclingWrapper:
     Wrapper for the docling library for processing PDF files.
     Uses DocumentConverter for PDF to Markdown conversion.
     Falls back to PyPDF2 if docling fails.
+    Conversions are cached on disk, keyed by the PDF's content hash and the converter identity.
     """
     
     @staticmethod
-    def parse_to_markdown(filepath: str, output_file: Optional[str] = None) -> str:
+    def preferred_backend() -> str:
+        """
+        Get the backend that will be tried first for the conversion.
+        
+        Returns:
+            "docling" if docling is available and enabled, "pypdf2" otherwise
+        """
+        if os.environ.get("DISABLE_DOCLING", "").lower() in ("1", "true", "yes"):
+            return "pypdf2"
+        return "docling" if is_docling_available() else "pypdf2"
+    
+    @staticmethod
+    def parse_to_markdown(filepath: str, output_file: Optional[str] = None,
+                          use_cache: bool = True, refresh_cache: bool = False,
+                          page_workers: Optional[int] = None) -> str:
         """
         Parse a PDF file to Markdown format using docling.DocumentConverter.
         Falls back to PyPDF2 if docling fails.
@@ -63,6 +340,10 @@ class DoclingWrapper:
         Args:
             filepath: Path to the PDF file
             output_file: Optional path to save the Markdown output
+            use_cache: Whether to read and write the on-disk conversion cache
+            refresh_cache: Whether to ignore cached conversions (the cache is still updated)
+            page_workers: Number of processes converting page ranges in parallel (defaults to
+                the docling settings, 1 converts the document in this process)
             
         Returns:
             The Markdown content as a string
@@ -71,71 +352,290 @@ class DoclingWrapper:
             FileNotFoundError: If the input file does not exist
         """
         input_path = Path(filepath)
-        if not input_path.exists():
-            raise FileNotFoundError(f"Input file not found: {filepath}")
+        metrics = current_document()
+        with stage("load"):
+            if not input_path.exists():
+                raise FileNotFoundError(f"Input file not found: {filepath}")
+            
+            backend = DoclingWrapper.preferred_backend()
+            cache = get_markdown_cache() if use_cache else None
+            content_hash = None
+            markdown_text = None
+            
+            if cache is not None:
+                content_hash = file_sha256(str(input_path))
+                if not refresh_cache:
+                    markdown_text = cache.get(make_cache_key(content_hash, converter_identity(backend)))
         
-        # Check if docling should be disabled via environment variable
-        if os.environ.get("DISABLE_DOCLING", "").lower() in ("1", "true", "yes"):
-            logger.info("Docling is disabled by environment variable. Using PyPDF2 for text extraction.")
-            return DoclingWrapper._extract_text_with_pypdf2(input_path, output_file)
+        if markdown_text is not None:
+            logger.info(f"Using cached {backend} conversion of {input_path}")
+            if metrics is not None:
+                metrics.backend, metrics.markdown_chars = "cache", len(markdown_text)
+            DoclingWrapper._save_markdown(markdown_text, output_file)
+            return markdown_text
         
-        # Try to use docling if available
-        if DOCLING_AVAILABLE:
-            try:
-                logger.info(f"Converting {input_path} to Markdown using docling.DocumentConverter")
-                converter = DocumentConverter()
-                result = converter.convert(str(input_path))
-                markdown_text = result.document.export_to_markdown()
+        with stage("convert"):
+            markdown_text, backend_used, succeeded = DoclingWrapper._convert(input_path, backend, page_workers)
+        if metrics is not None:
+            metrics.backend, metrics.markdown_chars = backend_used, len(markdown_text)
+        
+        # Never cache the placeholder document produced when extraction failed
+        if cache is not None and succeeded:
+            cache.set(make_cache_key(content_hash, converter_identity(backend_used)), markdown_text)
+        
+        DoclingWrapper._save_markdown(markdown_text, output_file)
+        return markdown_text
+    
+    @staticmethod
+    def parse_to_spill(filepath: str, output_file: Optional[str] = None,
+                       use_cache: bool = True, refresh_cache: bool = False,
+                       page_workers: Optional[int] = None) -> MarkdownSpill:
+        """
+        Parse a PDF file to Markdown written page by page into a spill file, so that
+        the document is never held in memory as a whole. Same conversion and cache
+        as parse_to_markdown, except that docling converts at most one range of pages
+        (see the pages_per_chunk setting) at a time.
+        
+        Args:
+            filepath: Path to the PDF file
+            output_file: Optional path to save the Markdown output
+            use_cache: Whether to read and write the on-disk conversion cache
+            refresh_cache: Whether to ignore cached conversions (the cache is still updated)
+            page_workers: Number of processes converting page ranges in parallel (defaults to the settings)
+            
+        Returns:
+            The spill file holding the Markdown, closed by the caller
+            
+        Raises:
+            FileNotFoundError: If the input file does not exist
+        """
+        input_path = Path(filepath)
+        metrics = current_document()
+        spill = None
+        try:
+            with stage("load"):
+                if not input_path.exists():
+                    raise FileNotFoundError(f"Input file not found: {filepath}")
                 
-                # Save to file if requested
-                if output_file:
-                    output_path = Path(output_file)
-                    output_path.write_text(markdown_text, encoding="utf-8")
-                    logger.info(f"Saved Markdown to {output_path}")
+                backend = DoclingWrapper.preferred_backend()
+                cache = get_markdown_cache() if use_cache else None
+                content_hash = None
+                spill = MarkdownSpill(settings.get_config()["docling"]["spill_dir"])
                 
-                return markdown_text
-            except Exception as e:
-                logger.warning(f"Docling conversion failed: {e}. Falling back to PyPDF2 for text extraction.")
-                return DoclingWrapper._extract_text_with_pypdf2(input_path, output_file)
-        else:
-            logger.warning("Docling library not available. Using PyPDF2 for text extraction.")
-            return DoclingWrapper._extract_text_with_pypdf2(input_path, output_file)
+                cached = None
+                if cache is not None:
+                    content_hash = file_sha256(str(input_path))
+                    if not refresh_cache:
+                        cached = cache.open(make_cache_key(content_hash, converter_identity(backend)))
+                if cached is not None:
+                    with cached:
+                        spill.append_file(cached)
+            
+            if cached is not None:
+                logger.info(f"Using cached {backend} conversion of {input_path}")
+                backend_used = "cache"
+            else:
+                with stage("convert"):
+                    _, backend_used, succeeded = DoclingWrapper._convert(input_path, backend, page_workers, spill)
+                spill.finish()
+                # Never cache the placeholder document produced when extraction failed
+                if cache is not None and succeeded:
+                    cache.set_file(make_cache_key(content_hash, converter_identity(backend_used)), spill.path)
+            
+            if metrics is not None:
+                metrics.backend, metrics.markdown_chars = backend_used, len(spill)
+            logger.info(f"Converted {input_path} into spill file {spill.path} ({spill.size} bytes)")
+            if output_file:
+                spill.save(output_file)
+                logger.info(f"Saved Markdown to {output_file}")
+            return spill
+        except BaseException:
+            if spill is not None:
+                spill.close()
+            raise
     
     @staticmethod
-    def _extract_text_with_pypdf2(input_path: Path, output_file: Optional[str] = None) -> str:
+    def parse_document(filepath: str, output_file: Optional[str] = None,
+                       use_cache: bool = True, refresh_cache: bool = False,
+                       page_workers: Optional[int] = None,
+                       spill: Optional[bool] = None) -> Union[str, MarkdownSpill]:
         """
-        Extract text from PDF using PyPDF2 as a fallback method.
+        Parse a PDF file to Markdown, into a spill file when the document is long.
         
         Args:
-            input_path: Path to the PDF file
+            filepath: Path to the PDF file
             output_file: Optional path to save the Markdown output
+            use_cache: Whether to read and write the on-disk conversion cache
+            refresh_cache: Whether to ignore cached conversions (the cache is still updated)
+            page_workers: Number of processes converting page ranges in parallel (defaults to the settings)
+            spill: Whether to convert into a spill file (defaults to documents of at least
+                spill_min_pages pages, see the docling settings)
             
         Returns:
-            The extracted text formatted as Markdown
+            The Markdown content as a string, or the MarkdownSpill holding it (closed by the caller)
+            
+        Raises:
+            FileNotFoundError: If the input file does not exist
         """
-        logger.info(f"Extracting text from {input_path} using PyPDF2")
+        if spill is None:
+            min_pages = settings.get_config()["docling"]["spill_min_pages"]
+            page_count = count_pages(Path(filepath)) if min_pages > 0 and Path(filepath).exists() else None
+            spill = page_count is not None and page_count >= min_pages
+        if spill:
+            return DoclingWrapper.parse_to_spill(filepath, output_file, use_cache=use_cache,
+                                                 refresh_cache=refresh_cache, page_workers=page_workers)
+        return DoclingWrapper.parse_to_markdown(filepath, output_file, use_cache=use_cache,
+                                                refresh_cache=refresh_cache, page_workers=page_workers)
+    
+    @staticmethod
+    def _convert(input_path: Path, backend: str, page_workers: Optional[int] = None,
+                 spill: Optional[MarkdownSpill] = None) -> Tuple[Optional[str], str, bool]:
+        """
+        Convert a PDF file to Markdown with the given backend, falling back to PyPDF2.
+        
+        Args:
+            input_path: Path to the PDF file
+            backend: The backend to try first ("docling" or "pypdf2")
+            page_workers: Number of processes converting page ranges in parallel (defaults to the settings)
+            spill: Optional spill file the pages are written to as they are converted
+            
+        Returns:
+            A tuple with the Markdown content (None when written to the spill file), the
+            backend actually used and whether the conversion succeeded
+        """
+        def collect(pages: Iterator[str]) -> Optional[str]:
+            if spill is None:
+                return "".join(pages)
+            # Drop the pages written by a failed attempt
+            spill.clear()
+            for page in pages:
+                spill.append(page)
+            return None
+        
+        if backend == "docling":
+            try:
+                logger.info(f"Converting {input_path} to Markdown using docling.DocumentConverter")
+                pages = DoclingWrapper._convert_pages(input_path, "docling", page_workers, bounded=spill is not None)
+                return collect(pages), "docling", True
+            except Exception as e:
+                logger.warning(f"Docling conversion failed: {e}. Falling back to PyPDF2 for text extraction.")
+        elif os.environ.get("DISABLE_DOCLING", "").lower() in ("1", "true", "yes"):
+            logger.info("Docling is disabled by environment variable. Using PyPDF2 for text extraction.")
+        else:
+            logger.warning("Docling library not available. Using PyPDF2 for text extraction.")
         
-        # Extract text using PyPDF2
-        text_content = []
         try:
-            with open(input_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for page_num, page in enumerate(reader.pages):
-                    text = page.extract_text()
-                    if text:
-                        text_content.append(f"## Page {page_num + 1}\n\n{text}\n\n")
+            return collect(DoclingWrapper._iter_pypdf2_markdown(input_path, page_workers)), "pypdf2", True
         except Exception as e:
             logger.error(f"Error extracting text with PyPDF2: {e}")
             # Return a minimal markdown with error information
-            return f"# Error Processing PDF\n\nCould not extract text from {input_path}.\n\nError: {str(e)}"
+            error_text = f"# Error Processing PDF\n\nCould not extract text from {input_path}.\n\nError: {str(e)}"
+            return collect(iter((error_text,))), "pypdf2", False
+    
+    @staticmethod
+    def _convert_pages(input_path: Path, backend: str, page_workers: Optional[int] = None,
+                       bounded: bool = False) -> Iterator[str]:
+        """
+        Convert the pages of a PDF file, in parallel page ranges when the document is long enough.
         
-        # Combine all text into a markdown document
-        markdown_text = "# PDF Document\n\n" + "".join(text_content)
+        Args:
+            input_path: Path to the PDF file
+            backend: The conversion backend ("docling" or "pypdf2")
+            page_workers: Number of worker processes (defaults to the settings)
+            bounded: Whether docling must convert at most pages_per_chunk pages at a time,
+                even in a single process, to bound the memory used
+            
+        Returns:
+            An iterator over the Markdown of the pages (or page ranges), in page order
+        """
+        docling_settings = settings.get_config()["docling"]
+        workers = page_workers if page_workers is not None else docling_settings["page_workers"]
+        workers = workers if workers > 0 else (os.cpu_count() or 1)
+        pages_per_chunk = max(1, docling_settings["pages_per_chunk"])
+        # PyPDF2 extracts one page at a time anyway, docling converts a whole range at once
+        bounded = bounded and backend == "docling"
+        filepath = str(input_path)
+        
+        pages = None
+        if backend == "docling" and docling_settings["page_triage"]:
+            pages = DoclingWrapper._select_pages(input_path)
+        if pages is None and (workers > 1 or bounded):
+            page_count = count_pages(input_path)
+            if page_count is not None and (bounded or page_count >= docling_settings["min_pages_to_split"]):
+                pages = list(range(1, page_count + 1))
+        if pages is None:
+            yield from _iter_page_range(filepath, backend)
+            return
         
-        # Save to file if requested
+        parallel = workers > 1 and len(pages) >= docling_settings["min_pages_to_split"]
+        if parallel:
+            ranges = page_ranges(pages, workers, pages_per_chunk)
+        else:
+            ranges = page_ranges(pages, 1, pages_per_chunk if bounded else len(pages))
+        if not parallel or len(ranges) < 2:
+            for first, last in ranges:
+                yield from _iter_page_range(filepath, backend, first, last)
+            return
+        
+        logger.info(f"Converting {len(ranges)} page ranges of {input_path} with {min(workers, len(ranges))} processes")
+        pool = get_page_pool(min(workers, len(ranges)))
+        # map() yields the results in submission order, i.e. in page order
+        yield from pool.map(_convert_page_range, [filepath] * len(ranges), [backend] * len(ranges),
+                            [first for first, _ in ranges], [last for _, last in ranges])
+    
+    @staticmethod
+    def _select_pages(input_path: Path) -> Optional[List[int]]:
+        """
+        Pick the pages worth a docling conversion from their PyPDF2 text layer.
+        
+        Args:
+            input_path: Path to the PDF file
+            
+        Returns:
+            The page numbers to convert, or None to convert every page (short document,
+            text layer unreadable)
+        """
+        docling_settings = settings.get_config()["docling"]
+        page_count = count_pages(input_path)
+        if page_count is None:
+            logger.warning(f"Page triage of {input_path} failed, converting every page: "
+                           f"its pages could not be counted")
+            return None
+        if page_count < docling_settings["triage_min_pages"]:
+            return None
+        try:
+            # The pages are scored as they are extracted, their text is not kept
+            return select_pages(_pypdf2_page_texts(str(input_path)), get_registry(),
+                                min_score=docling_settings["triage_min_score"],
+                                margin=docling_settings["triage_margin"], document=str(input_path))
+        except Exception as e:
+            logger.warning(f"Page triage of {input_path} failed, converting every page: {e}")
+            return None
+    
+    @staticmethod
+    def _save_markdown(markdown_text: str, output_file: Optional[str]) -> None:
+        """Save the Markdown content to a file if requested."""
         if output_file:
             output_path = Path(output_file)
             output_path.write_text(markdown_text, encoding="utf-8")
-            logger.info(f"Saved extracted text to {output_path}")
+            logger.info(f"Saved Markdown to {output_path}")
+    
+    @staticmethod
+    def _iter_pypdf2_markdown(input_path: Path, page_workers: Optional[int] = None) -> Iterator[str]:
+        """
+        Extract text from PDF using PyPDF2, one page (or page range) at a time.
+        
+        Args:
+            input_path: Path to the PDF file
+            page_workers: Number of processes extracting page ranges in parallel (defaults to the settings)
+            
+        Returns:
+            An iterator over the extracted text formatted as Markdown
+            
+        Raises:
+            Exception: If PyPDF2 cannot read the file
+        """
+        logger.info(f"Extracting text from {input_path} using PyPDF2")
         
-        return markdown_text
\ No newline at end of file
+        yield "# PDF Document\n\n"
+        yield from DoclingWrapper._convert_pages(input_path, "pypdf2", page_workers)
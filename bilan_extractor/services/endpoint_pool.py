@@ -0,0 +1,194 @@
+"""
+Module for spreading LLM requests over several Ollama servers.
+
+Each request is routed to the healthy endpoint with the least expected work,
+estimated from its outstanding requests and an exponentially weighted moving
+average of its latency. An endpoint failing with a transient error is taken
+out of the rotation until a health probe (GET /api/version) succeeds again;
+probes run periodically in a background thread.
+"""
+import logging
+import threading
+import urllib.request
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Any, Optional
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# Weight of the last observed latency in the moving average
+LATENCY_EWMA_ALPHA = 0.3
+
+# Timeout of a health probe in seconds
+PROBE_TIMEOUT = 2.0
+
+
+@dataclass
+class Endpoint:
+    """
+    Data class holding the routing state of an Ollama server.
+    """
+    host: str
+    outstanding: int = 0
+    latency: Optional[float] = None
+    healthy: bool = True
+    requests: int = 0
+    failures: int = 0
+
+    def expected_work(self) -> float:
+        """Estimated time to serve one more request: queue length times average latency."""
+        return (self.outstanding + 1) * (self.latency or 0.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the endpoint state to a dictionary."""
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+def probe_endpoint(host: str, timeout: float = PROBE_TIMEOUT) -> bool:
+    """
+    Check whether an Ollama server answers.
+
+    Args:
+        host: The server URL
+        timeout: Timeout of the probe in seconds
+
+    Returns:
+        True if the server answered the version endpoint
+    """
+    url = host.rstrip("/") + "/api/version"
+    if "://" not in url:
+        url = "http://" + url
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status == 200
+    except Exception:
+        return False
+
+
+class EndpointPool:
+    """
+    Thread-safe set of Ollama endpoints with least-work routing and health tracking.
+    """
+
+    def __init__(self, hosts: Iterable[str], probe_interval: float = 10.0):
+        """
+        Initialize the pool.
+
+        Args:
+            hosts: The URLs of the Ollama servers
+            probe_interval: Seconds between two health probes of the endpoints (0 disables the probes)
+        """
+        self.endpoints = [Endpoint(host=host) for host in dict.fromkeys(hosts)]
+        if not self.endpoints:
+            raise ValueError("At least one Ollama host is required")
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def start(self) -> None:
+        """
+        Start the background health probes (only useful with several endpoints).
+        """
+        if self._thread is not None or not self.probe_interval or len(self.endpoints) < 2:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._probe_loop, name="ollama-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background health probes.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=PROBE_TIMEOUT + 1)
+            self._thread = None
+
+    def _probe_loop(self) -> None:
+        """Probe every endpoint periodically until the pool is stopped."""
+        while not self._stop.wait(self.probe_interval):
+            self.probe()
+
+    def probe(self) -> None:
+        """
+        Probe every endpoint and update its health.
+        """
+        for endpoint in self.endpoints:
+            healthy = probe_endpoint(endpoint.host)
+            with self._lock:
+                if healthy != endpoint.healthy:
+                    logger.info(f"Ollama endpoint {endpoint.host} is {'back up' if healthy else 'down'}")
+                endpoint.healthy = healthy
+
+    def acquire(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """
+        Pick the endpoint for a new request and count it as outstanding.
+
+        Args:
+            exclude: Endpoints to avoid, e.g. those that already failed for this request
+
+        Returns:
+            The healthy endpoint with the least expected work; when every candidate
+            is down, the one with the fewest failures so that the request still has a chance
+        """
+        excluded = {id(endpoint) for endpoint in exclude}
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if id(endpoint) not in excluded] or self.endpoints
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+            if healthy:
+                endpoint = min(healthy, key=lambda e: (e.expected_work(), e.outstanding, e.requests))
+            else:
+                endpoint = min(candidates, key=lambda e: (e.failures, e.outstanding))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: Optional[float] = None, failed: bool = False) -> None:
+        """
+        Record the end of a request.
+
+        Args:
+            endpoint: The endpoint returned by acquire
+            latency: The duration of the request in seconds, if it succeeded
+            failed: Whether the request failed with a transient error, which takes
+                the endpoint out of the rotation until a probe succeeds
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                if endpoint.healthy and len(self.endpoints) > 1:
+                    logger.warning(f"Taking Ollama endpoint {endpoint.host} out of the rotation")
+                endpoint.healthy = False
+            else:
+                endpoint.healthy = True
+                if latency is not None:
+                    endpoint.latency = latency if endpoint.latency is None else (
+                        LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * endpoint.latency)
+
+    def healthy_count(self) -> int:
+        """Number of endpoints currently in the rotation."""
+        with self._lock:
+            return sum(1 for endpoint in self.endpoints if endpoint.healthy)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Get the routing state of every endpoint.
+
+        Returns:
+            One dictionary per endpoint
+        """
+        with self._lock:
+            return [endpoint.to_dict() for endpoint in self.endpoints]
+
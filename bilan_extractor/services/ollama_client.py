@@ -1,72 +1,732 @@
 """
 Module for interacting with the Ollama API.
+
+The extraction prompt is split into a system prompt shared by every document
+of a run and a user prompt holding the document, so that the server reuses the
+evaluation of the shared prefix; the model is kept loaded between requests
+(keep_alive).
+Responses can be cached on disk, keyed by the messages, the model and the
+generation options, so that re-running a corpus only costs an inference
+for prompts that were never sent before. Responses can also be streamed: the
+JSON object is parsed while it is generated and the generation is stopped as
+soon as the object is closed.
+By default the model answers in a compact format, each variable mapping to
+rows of [brut, amortissement, net, year], enforced by a JSON schema generated
+from the variable registry and sent as the format of the request; the rows are
+expanded back into the structured format after parsing (see core.parser).
+Requests have a timeout and are retried with an exponential backoff on
+transient errors (connection errors, timeouts, 429 and 5xx responses). When
+several Ollama servers are configured, each request goes to the server with the
+least expected work and a failed request is retried on another server first.
+The ollama library is only imported when a client is created.
 """
+import asyncio
 import logging
-import ollama
-from typing import Dict, List, Any, Optional
-from ollama._types import ResponseError
+import random
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from .endpoint_pool import Endpoint, EndpointPool
+from ..config import settings
+from ..core.stream_parser import IncrementalJSONObjectParser
+from ..models.registry import get_registry
+from ..utils.cache import DiskCache, make_cache_key
+from ..utils.metrics import LLM_FIELDS, record_llm_response, stage
 
 # Set up logger
 logger = logging.getLogger("bilan_extractor")
 
+# Lazily created cache of LLM responses
+_response_cache = None
+
+# HTTP status codes worth retrying: rate limited, server busy or temporarily unavailable
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Model used when the default model is not found either
+FALLBACK_MODEL = "gemma3"
+# Error of a request for a model the server does not have, e.g. 'model "llama3" not found, try pulling it first'
+_MODEL_NOT_FOUND = re.compile(r"\bmodel\b.*\bnot found\b", re.IGNORECASE)
+
+# Formats of the LLM answer
+OUTPUT_FORMATS = ("compact", "verbose")
+
+# Answer format instructions of the system prompt
+_COMPACT_FORMAT_SECTION = """Pour chaque variable présente, renvoie une entrée dont la clé est celle donnée dans la liste
+(le code comptable, ou le nom de la variable si elle n'a pas de code), dans l'ordre de la liste,
+et dont la valeur est une liste de lignes [brut, amortissement, net, année], une ligne par année :
+- brut : la valeur brute, avant amortissements et provisions
+- amortissement : les amortissements et provisions
+- net : la valeur nette
+- année : l'année de la colonne, ou son intitulé ("N", "N-1") si l'année n'est pas indiquée
+Une valeur seule dont le type n'est pas précisé s'écrit [valeur, année].
+Mets null pour une valeur ou une année absente et omets les variables absentes du bilan.
+
+Exemple de format de réponse :
+{"actif_total": [[1000000, null, 900000, 2023]], "2154220": [[50000, 20000, 30000, 2023]], "resultat_net": [[150000, "N-1"]]}
+
+Réponds uniquement avec un objet JSON."""
+
+_VERBOSE_FORMAT_SECTION = """Pour chaque variable, renvoie un dictionnaire avec les clés suivantes :
+- "name": le nom de la variable
+- "code": le code comptable (si disponible)
+- "values": une liste de dictionnaires avec les clés suivantes :
+  - "value": la valeur numérique
+  - "value_type": le type de valeur ("brut", "amortissement", "net")
+  - "year": l'année (si disponible)
+
+Exemple de format de réponse :
+{
+  "actif_total": {
+    "name": "actif_total",
+    "values": [
+      {
+        "value": 1000000,
+        "value_type": "brut",
+        "year": 2023
+      },
+      {
+        "value": 900000,
+        "value_type": "net",
+        "year": 2023
+      }
+    ]
+  },
+  "2154220_mat_ind_subv_bioclad_2012": {
+    "name": "2154220_mat_ind_subv_bioclad_2012",
+    "code": "2154220",
+    "values": [
+      {
+        "value": 50000,
+        "value_type": "brut",
+        "year": 2023
+      },
+      {
+        "value": 20000,
+        "value_type": "amortissement",
+        "year": 2023
+      },
+      {
+        "value": 30000,
+        "value_type": "net",
+        "year": 2023
+      }
+    ]
+  }
+}
+
+Réponds uniquement avec un dictionnaire JSON parsable."""
+
+# Schema of a row of the compact format: brut, amortissement, net, year, or value, year
+# for a value of unspecified type; the year may be a column label such as "N-1"
+_AMOUNT_SCHEMA = {"type": ["number", "null"]}
+_YEAR_SCHEMA = {"type": ["integer", "string", "null"]}
+_ROWS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "anyOf": [
+            {
+                "type": "array",
+                "prefixItems": [_AMOUNT_SCHEMA, _AMOUNT_SCHEMA, _AMOUNT_SCHEMA, _YEAR_SCHEMA],
+                "minItems": 4,
+                "maxItems": 4,
+            },
+            {
+                "type": "array",
+                "prefixItems": [{"type": "number"}, _YEAR_SCHEMA],
+                "minItems": 2,
+                "maxItems": 2,
+            },
+        ],
+    },
+}
+
+
+def get_response_cache() -> DiskCache:
+    """
+    Get the on-disk cache of LLM responses.
+
+    Returns:
+        The DiskCache shared by all clients of this process
+    """
+    global _response_cache
+    if _response_cache is None:
+        cache_settings = settings.get_config()["cache"]
+        _response_cache = DiskCache(
+            str(Path(cache_settings["dir"]) / "llm"),
+            max_bytes=cache_settings["llm_max_bytes"],
+            ttl_seconds=cache_settings["llm_ttl_seconds"]
+        )
+    return _response_cache
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Tell whether a failed Ollama request is worth retrying.
+
+    Args:
+        error: The exception raised by the request
+
+    Returns:
+        True for connection errors, timeouts and 429/5xx responses
+    """
+    from ollama import ResponseError
+
+    if isinstance(error, ResponseError):
+        return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+
+    import httpx
+    return isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError))
+
+
+def retry_delay(attempt: int, backoff: float) -> float:
+    """
+    Compute the delay before retrying a request, with exponential backoff and jitter.
+
+    Args:
+        attempt: The number of the failed attempt, starting at 0
+        backoff: The delay before the first retry in seconds
+
+    Returns:
+        The delay in seconds
+    """
+    return backoff * 2 ** attempt + random.uniform(0, backoff)
+
+
+class RequestRetries:
+    """
+    Retry and failover policy of one request, shared by the clients: a request
+    failing with a transient error is retried at once on the other servers of
+    the pool, then with an exponential backoff once every server failed.
+    """
+
+    def __init__(self, pool: EndpointPool, max_retries: int, backoff: float):
+        """
+        Initialize the policy.
+
+        Args:
+            pool: The servers of the client
+            max_retries: Retries once every server failed
+            backoff: The delay before the first of these retries in seconds
+        """
+        self.pool = pool
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.attempt = 0
+        self.failed: List[Endpoint] = []
+
+    def acquire(self) -> Endpoint:
+        """Pick the server of the next try, avoiding those that failed since the last backoff."""
+        return self.pool.acquire(exclude=self.failed)
+
+    def failure(self, endpoint: Endpoint, error: Exception) -> Optional[float]:
+        """
+        Release the server of a failed try and decide whether to try again.
+
+        Args:
+            endpoint: The server returned by acquire
+            error: The exception raised by the request
+
+        Returns:
+            The delay before the next try in seconds (0 to try another server at
+            once), None to raise the error: it is not transient or the retries are exhausted
+        """
+        transient = is_transient_error(error)
+        self.pool.release(endpoint, failed=transient)
+        if not transient:
+            return None
+        self.failed.append(endpoint)
+        if len(self.failed) < len(self.pool):
+            logger.warning(f"Ollama request to {endpoint.host} failed ({error!r}), retrying on another server")
+            return 0.0
+        if self.attempt >= self.max_retries:
+            return None
+        delay = retry_delay(self.attempt, self.backoff)
+        logger.warning(f"Ollama request failed ({error!r}), retrying in {delay:.1f}s")
+        self.attempt += 1
+        self.failed.clear()
+        return delay
+
+
+def fallback_model(error: Exception, model: str, default_model: str) -> Optional[str]:
+    """
+    Decide which model to retry a request with when its model is not found.
+
+    Args:
+        error: The exception raised by the request
+        model: The model of the request
+        default_model: The default model of the client
+
+    Returns:
+        The default model, or FALLBACK_MODEL when the default model was not found,
+        None to raise the error
+    """
+    from ollama import ResponseError
+
+    if not isinstance(error, ResponseError) or not _MODEL_NOT_FOUND.search(str(error)):
+        return None
+    if model != default_model:
+        logger.warning(f"Model '{model}' not found. Falling back to default model '{default_model}'")
+        return default_model
+    logger.warning(f"Default model '{default_model}' not found. Falling back to '{FALLBACK_MODEL}'")
+    return FALLBACK_MODEL
+
+
+def emit_members(content: str, on_variable: Optional[Callable[[str, Any], None]]) -> None:
+    """Call on_variable with each member of the JSON object of a complete response."""
+    if on_variable is not None:
+        for key, value in IncrementalJSONObjectParser().feed(content):
+            on_variable(key, value)
+
+
+def cached_response(cache: Optional[DiskCache], key: str, refresh: bool, model: str,
+                    on_variable: Optional[Callable[[str, Any], None]] = None) -> Optional[str]:
+    """
+    Look up the cached response of a request, emitting its members to on_variable.
+
+    Args:
+        cache: The cache of responses of the client, if any
+        key: The cache key of the request (see make_cache_key)
+        refresh: Whether cached responses are ignored
+        model: The model of the request, for the logs
+        on_variable: Optional callback for the members of the JSON object
+
+    Returns:
+        The cached response, None if the request has to be sent
+    """
+    if cache is None or refresh:
+        return None
+    content = cache.get(key)
+    if content is not None:
+        logger.debug(f"Using cached response of model '{model}'")
+        emit_members(content, on_variable)
+    return content
+
+
+def response_metadata(response: Any) -> Dict[str, Any]:
+    """
+    Get the token counts and durations reported by Ollama in a response.
+
+    Args:
+        response: A chat response, or the last chunk of a streamed response
+
+    Returns:
+        The fields of LLM_FIELDS present in the response
+    """
+    metadata = {}
+    for key in LLM_FIELDS:
+        try:
+            value = response[key]
+        except (KeyError, TypeError, AttributeError):
+            value = None
+        if value is not None:
+            metadata[key] = value
+    return metadata
+
+
+def stream_metadata(last_chunk: Any, chunks: int, started: float, first_chunk_at: Optional[float]) -> Dict[str, Any]:
+    """
+    Get the metadata of a streamed response.
+    Ollama only reports its statistics in the final chunk, which is never received
+    when the generation is stopped after the JSON object; they are then estimated
+    from the timing of the chunks, one chunk being one token.
+
+    Args:
+        last_chunk: The last chunk received
+        chunks: The number of chunks received
+        started: perf_counter() value when the request was sent
+        first_chunk_at: perf_counter() value when the first chunk was received
+
+    Returns:
+        The token counts and durations (in nanoseconds) of the response
+    """
+    metadata = response_metadata(last_chunk) if last_chunk is not None else {}
+    if "eval_count" not in metadata and first_chunk_at is not None:
+        metadata["prompt_eval_duration"] = int((first_chunk_at - started) * 1e9)
+        metadata["eval_count"] = chunks
+        metadata["eval_duration"] = int((time.perf_counter() - first_chunk_at) * 1e9)
+    return metadata
+
+
+def _format_variable(spec, key: Optional[str] = None) -> str:
+    """Format a variable of the prompt list, preceded by its key in the compact format."""
+    name, code, aliases = spec.name, spec.code, spec.aliases
+    if spec.group == "default_variables":
+        return f"- {name}"
+    if key is not None and key != name:
+        # The key is the account code
+        return f"- {key} : {name} (aussi appelé: {aliases[0]})" if aliases else f"- {key} : {name}"
+    if code and aliases:
+        # Include the code and first alias in the prompt for better identification
+        return f"- {name} (code: {code}, aussi appelé: {aliases[0]})"
+    if code:
+        return f"- {name} (code: {code})"
+    if aliases:
+        return f"- {name} (aussi appelé: {aliases[0]})"
+    return f"- {name}"
+
+
+def get_output_format(output_format: Optional[str] = None) -> str:
+    """
+    Get the format of the LLM answer.
+
+    Args:
+        output_format: The requested format (defaults to the PROMPT_OUTPUT_FORMAT setting)
+
+    Returns:
+        "compact" or "verbose"
+
+    Raises:
+        ValueError: If the format is unknown
+    """
+    output_format = (output_format or settings.get_config()["prompt"]["output_format"]).lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format} (use {' or '.join(OUTPUT_FORMATS)})")
+    return output_format
+
+
+def build_output_schema(variable_names: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Build the JSON schema of the compact answer, sent as the format of the request
+    so that the server constrains the generation to it.
+
+    Args:
+        variable_names: Optional names restricting the schema to some variables
+
+    Returns:
+        The schema of an object mapping the key of each variable (see
+        VariableRegistry.output_key) to its rows of [brut, amortissement, net, year]
+    """
+    registry = get_registry()
+    return {
+        "type": "object",
+        "properties": {registry.output_key(spec): {"$ref": "#/$defs/rows"}
+                       for spec in registry.select(variable_names)},
+        "additionalProperties": False,
+        "$defs": {"rows": _ROWS_SCHEMA},
+    }
+
+
+def build_extraction_prompt(markdown_text: str, year: Optional[int] = None, value_type: Optional[str] = None,
+                            variable_names: Optional[List[str]] = None,
+                            output_format: Optional[str] = None,
+                            notes: Optional[List[str]] = None) -> Tuple[str, str]:
+    """
+    Build the prompt asking the LLM to extract the financial variables of a document.
+
+    The prompt is split into a system prompt, identical for every document of a
+    run, and a user prompt holding the document. The server can then reuse the
+    evaluation of the system prompt (its KV cache) from one request to the next
+    and only evaluate the document. The list of the variables is part of the
+    system prompt when every configured variable is requested; a list
+    restricted to some variables, which changes from one document to the next,
+    comes after the document, as do the notes on the values to check again.
+
+    Args:
+        markdown_text: The financial statement in Markdown format
+        year: The specific year to extract values for (optional)
+        value_type: The type of value to extract (brut, net, amortissement) (optional)
+        variable_names: Optional names restricting the prompt to some variables
+        output_format: "compact" or "verbose" (defaults to the PROMPT_OUTPUT_FORMAT setting)
+        notes: Optional remarks on the values of a previous answer to check again (see core.consistency)
+
+    Returns:
+        A tuple with the system prompt and the user prompt
+    """
+    # Build the list of variables to extract
+    registry = get_registry()
+    selected = registry.select(variable_names)
+    compact = get_output_format(output_format) == "compact"
+    variables_to_extract = "\n".join(_format_variable(spec, registry.output_key(spec) if compact else None)
+                                     for spec in selected)
+    
+    # Build the value type instruction
+    value_type_instruction = ""
+    if value_type:
+        if value_type.lower() == "brut":
+            value_type_instruction = "Pour chaque variable, extrait la valeur brute (avant amortissements et provisions)."
+        elif value_type.lower() == "net":
+            value_type_instruction = "Pour chaque variable, extrait la valeur nette (après amortissements et provisions)."
+        elif value_type.lower() in ["amortissement", "amortissements"]:
+            value_type_instruction = "Pour chaque variable, extrait la valeur des amortissements et provisions."
+        else:
+            value_type_instruction = "Pour chaque variable, extrait les valeurs brutes, nettes et d'amortissements si disponibles."
+    else:
+        value_type_instruction = "Pour chaque variable, extrait les valeurs brutes, nettes et d'amortissements si disponibles."
+    
+    # Build the year instruction
+    year_instruction = ""
+    if year:
+        year_instruction = f"Extrait les valeurs pour l'année {year}."
+    
+    if len(selected) == len(registry.variables):
+        variables_section = f"Identifie et renvoie un dictionnaire Python avec les variables suivantes si elles sont présentes :\n{variables_to_extract}"
+        user_suffix = ""
+    else:
+        variables_section = "Identifie et renvoie un dictionnaire Python avec les variables listées après le bilan si elles sont présentes."
+        user_suffix = f"\n\nVariables à extraire :\n{variables_to_extract}"
+    if notes:
+        user_suffix += "\n\nValeurs incohérentes à vérifier dans le bilan :\n" + "\n".join(f"- {note}" for note in notes)
+    
+    format_section = _COMPACT_FORMAT_SECTION if compact else _VERBOSE_FORMAT_SECTION
+
+    # Build the prompt
+    system_prompt = f"""Tu extrais les variables financières d'un bilan comptable fourni au format Markdown.
+
+{variables_section}
+
+{value_type_instruction}
+{year_instruction}
+
+{format_section}"""
+    user_prompt = f"""Voici un bilan comptable au format Markdown :
+
+{markdown_text}{user_suffix}"""
+    return system_prompt, user_prompt
+
+
+def generation_options(options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Build the generation options sent to the model.
+
+    Args:
+        options: Options given by the caller, taking precedence
+
+    Returns:
+        The options, with the context size and the maximum number of generated
+        tokens of the settings when they are set
+    """
+    ollama_settings = settings.get_config()["ollama"]
+    defaults = {key: ollama_settings[key] for key in ("num_ctx", "num_predict") if ollama_settings[key] > 0}
+    return {**defaults, **(options or {})}
+
+
+def build_messages(prompt: str, system: Optional[str] = None) -> List[Dict[str, str]]:
+    """Build the chat messages of a prompt, the system prompt first."""
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
 
 class OllamaClient:
     """
     Client for interacting with the Ollama API.
     """
     
-    def __init__(self, default_model: str = "gemma3"):
+    def __init__(self, default_model: str = "gemma3", cache: Optional[DiskCache] = None,
+                 refresh_cache: bool = False, options: Optional[Dict[str, Any]] = None,
+                 host: Optional[str] = None, timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None, retry_backoff: Optional[float] = None,
+                 hosts: Optional[List[str]] = None, keep_alive: Optional[str] = None):
         """
         Initialize the Ollama client.
+        One HTTP session per server is created once and reused for every request.
         
         Args:
             default_model: The default model to use for queries
+            cache: Optional cache of responses (see get_response_cache)
+            refresh_cache: Whether to ignore cached responses (the cache is still updated)
+            options: Generation options sent to the model, part of the cache key (completed
+                with num_ctx and num_predict from the settings)
+            host: The Ollama server URL (defaults to the OLLAMA_HOST setting)
+            timeout: Timeout of a request in seconds (defaults to the OLLAMA_TIMEOUT setting)
+            max_retries: Retries of a request failing with a transient error (defaults to the settings)
+            retry_backoff: Delay before the first retry in seconds (defaults to the settings)
+            hosts: Several Ollama server URLs to spread the requests over (defaults to
+                host, or to the OLLAMA_HOSTS setting)
+            keep_alive: How long the server keeps the model, and the cache of the system
+                prompt, loaded after a request (defaults to the OLLAMA_KEEP_ALIVE setting)
         """
+        ollama_settings = settings.get_config()["ollama"]
         self.default_model = default_model
+        self.hosts = list(hosts) if hosts else ([host] if host else ollama_settings["hosts"])
+        self.host = self.hosts[0]
+        self.timeout = timeout if timeout is not None else ollama_settings["timeout"]
+        self.max_retries = max_retries if max_retries is not None else ollama_settings["max_retries"]
+        self.retry_backoff = retry_backoff if retry_backoff is not None else ollama_settings["retry_backoff"]
+        
+        import ollama
+        self._clients = {endpoint: ollama.Client(host=endpoint, timeout=self.timeout) for endpoint in self.hosts}
+        self.pool = EndpointPool(self.hosts, probe_interval=ollama_settings["health_check_interval"])
+        self.pool.start()
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        self.options = generation_options(options)
+        self.keep_alive = keep_alive if keep_alive is not None else ollama_settings["keep_alive"]
     
-    def chat(self, prompt: str, model: Optional[str] = None) -> str:
+    def close(self) -> None:
+        """
+        Stop the health probes of the Ollama servers.
+        """
+        self.pool.stop()
+    
+    def chat(self, prompt: str, model: Optional[str] = None, stream: bool = False,
+             on_variable: Optional[Callable[[str, Any], None]] = None, system: Optional[str] = None,
+             schema: Optional[Dict[str, Any]] = None) -> str:
         """
         Send a chat message to the Ollama API and get the response.
+        Responses are served from the cache when an identical request was already answered.
         
         Args:
             prompt: The prompt to send to the model
             model: The model to use (defaults to the instance's default_model)
+            stream: Whether to stream the response, parse the JSON object incrementally
+                and stop the generation as soon as the top-level object is closed
+            on_variable: Optional callback called with (key, value) for each member of the
+                JSON object, as soon as it is complete when streaming
+            system: Optional system prompt, sent before the prompt
+            schema: Optional JSON schema the answer is constrained to, part of the cache key
             
         Returns:
-            The model's response as a string
+            The model's response as a string (only the JSON object when the generation
+            was stopped after it)
         """
         model_to_use = model or self.default_model
+        messages = build_messages(prompt, system)
         
+        if self.cache is None:
+            return self._chat(messages, model_to_use, stream, on_variable, schema)
+        
+        key = make_cache_key(messages, model_to_use, self.options, schema)
+        content = cached_response(self.cache, key, self.refresh_cache, model_to_use, on_variable)
+        if content is not None:
+            return content
+        
+        content = self._chat(messages, model_to_use, stream, on_variable, schema)
+        self.cache.set(key, content)
+        return content
+    
+    def _chat(self, messages: List[Dict[str, str]], model_to_use: str, stream: bool = False,
+              on_variable: Optional[Callable[[str, Any], None]] = None,
+              schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send a chat message to the Ollama API, falling back to other models if it is not found.
+        
+        Args:
+            messages: The chat messages to send to the model
+            model_to_use: The model to use
+            stream: Whether to stream the response
+            on_variable: Optional callback for the members of the JSON object
+            schema: Optional JSON schema the answer is constrained to
+            
+        Returns:
+            The model's response as a string
+        """
         try:
-            response = ollama.chat(
+            return self._request(messages, model_to_use, stream, on_variable, schema)
+        except Exception as e:
+            model = fallback_model(e, model_to_use, self.default_model)
+            if model is None:
+                raise
+            return self._request(messages, model, stream, on_variable, schema)
+    
+    def _request(self, messages: List[Dict[str, str]], model_to_use: str, stream: bool,
+                 on_variable: Optional[Callable[[str, Any], None]],
+                 schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send a chat request to the Ollama API, retrying on transient errors.
+        A failed request is retried immediately on the other servers, then with a
+        backoff once every server failed. When a streamed request is retried, the
+        variables already received are emitted again.
+        
+        Args:
+            messages: The chat messages to send to the model
+            model_to_use: The model to use
+            stream: Whether to stream the response
+            on_variable: Optional callback for the members of the JSON object
+            schema: Optional JSON schema the answer is constrained to
+            
+        Returns:
+            The model's response as a string
+        """
+        retries = RequestRetries(self.pool, self.max_retries, self.retry_backoff)
+        while True:
+            endpoint = retries.acquire()
+            start = time.perf_counter()
+            try:
+                content = self._send(self._clients[endpoint.host], messages, model_to_use, stream, on_variable,
+                                     schema)
+            except Exception as e:
+                delay = retries.failure(endpoint, e)
+                if delay is None:
+                    raise
+                if delay:
+                    time.sleep(delay)
+                continue
+            self.pool.release(endpoint, latency=time.perf_counter() - start)
+            return content
+    
+    def _send(self, client, messages: List[Dict[str, str]], model_to_use: str, stream: bool,
+              on_variable: Optional[Callable[[str, Any], None]],
+              schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Send one chat request to an Ollama server.
+        
+        Args:
+            client: The ollama.Client of the server
+            messages: The chat messages to send to the model
+            model_to_use: The model to use
+            stream: Whether to stream the response
+            on_variable: Optional callback for the members of the JSON object
+            schema: Optional JSON schema the answer is constrained to
+            
+        Returns:
+            The model's response as a string
+        """
+        if not stream:
+            response = client.chat(
                 model=model_to_use,
-                messages=[{"role": "user", "content": prompt}]
+                messages=messages,
+                options=self.options or None,
+                format=schema,
+                keep_alive=self.keep_alive
             )
-            return response['message']['content']
-        except ResponseError as e:
-            if "model not found" in str(e).lower() and model_to_use != self.default_model:
-                logger.warning(f"Model '{model_to_use}' not found. Falling back to default model '{self.default_model}'")
-                # Try again with the default model
-                response = ollama.chat(
-                    model=self.default_model,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                return response['message']['content']
-            elif "model not found" in str(e).lower() and model_to_use == self.default_model:
-                # If the default model is also not found, try with "gemma3"
-                fallback_model = "gemma3"
-                logger.warning(f"Default model '{self.default_model}' not found. Falling back to '{fallback_model}'")
-                response = ollama.chat(
-                    model=fallback_model,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                return response['message']['content']
-            else:
-                # Re-raise other errors
-                raise
+            content = response['message']['content']
+            record_llm_response(response_metadata(response))
+            emit_members(content, on_variable)
+            return content
+        
+        parser = IncrementalJSONObjectParser()
+        received = []
+        started, first_chunk_at, chunk = time.perf_counter(), None, None
+        chunks = client.chat(
+            model=model_to_use,
+            messages=messages,
+            options=self.options or None,
+            format=schema,
+            keep_alive=self.keep_alive,
+            stream=True
+        )
+        try:
+            for chunk in chunks:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                text = chunk['message']['content']
+                received.append(text)
+                for key, value in parser.feed(text):
+                    if on_variable is not None:
+                        on_variable(key, value)
+                if parser.done:
+                    logger.debug("JSON object complete, stopping the generation")
+                    break
+        finally:
+            # Closing the stream drops the connection, which cancels the generation on the server
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        record_llm_response(stream_metadata(chunk, len(received), started, first_chunk_at))
+        
+        return parser.result() or "".join(received)
     
     def extract_financial_variables(self, markdown_text: str, model: Optional[str] = None, 
-                                  year: Optional[int] = None, value_type: Optional[str] = None) -> str:
+                                  year: Optional[int] = None, value_type: Optional[str] = None,
+                                  variable_names: Optional[List[str]] = None, stream: bool = False,
+                                  on_variable: Optional[Callable[[str, Any], None]] = None,
+                                  output_format: Optional[str] = None,
+                                  notes: Optional[List[str]] = None) -> str:
         """
         Extract financial variables from Markdown text using a local LLM via Ollama.
         
@@ -75,124 +735,22 @@ class OllamaClient:
             model: The LLM model to use (defaults to the instance's default_model)
             year: The specific year to extract values for (optional)
             value_type: The type of value to extract (brut, net, amortissement) (optional)
+            variable_names: Optional names restricting the prompt to some variables
+            stream: Whether to stream the response and stop the generation once the JSON object is closed
+            on_variable: Optional callback called with (name, data) for each variable as soon as it is complete
+            output_format: "compact" or "verbose" (defaults to the PROMPT_OUTPUT_FORMAT setting); the
+                members of a compact answer are rows, to expand with core.parser.expand_compact_output
+            notes: Optional remarks on the values of a previous answer to check again
             
         Returns:
             The extracted variables as a JSON string
         """
-        # Load variable configuration
-        import json
-        from pathlib import Path
-        
-        config_path = Path(__file__).resolve().parent.parent / "config" / "variables.json"
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            config = {"default_variables": [], "additional_variables": []}
-        
-        # Build the list of variables to extract
-        variables_to_extract = []
-        
-        # Add default variables
-        for var in config.get("default_variables", []):
-            name = var.get("name")
-            if name:
-                variables_to_extract.append(f"- {name}")
-        
-        # Add additional variables
-        for var in config.get("additional_variables", []):
-            name = var.get("name")
-            code = var.get("code")
-            aliases = var.get("aliases", [])
-            if name and (code or aliases):
-                # Include the code and first alias in the prompt for better identification
-                if code and aliases:
-                    variables_to_extract.append(f"- {name} (code: {code}, aussi appelé: {aliases[0]})")
-                elif code:
-                    variables_to_extract.append(f"- {name} (code: {code})")
-                elif aliases:
-                    variables_to_extract.append(f"- {name} (aussi appelé: {aliases[0]})")
-                else:
-                    variables_to_extract.append(f"- {name}")
-        
-        # Build the value type instruction
-        value_type_instruction = ""
-        if value_type:
-            if value_type.lower() == "brut":
-                value_type_instruction = "Pour chaque variable, extrait la valeur brute (avant amortissements et provisions)."
-            elif value_type.lower() == "net":
-                value_type_instruction = "Pour chaque variable, extrait la valeur nette (après amortissements et provisions)."
-            elif value_type.lower() in ["amortissement", "amortissements"]:
-                value_type_instruction = "Pour chaque variable, extrait la valeur des amortissements et provisions."
-            else:
-                value_type_instruction = "Pour chaque variable, extrait les valeurs brutes, nettes et d'amortissements si disponibles."
-        else:
-            value_type_instruction = "Pour chaque variable, extrait les valeurs brutes, nettes et d'amortissements si disponibles."
-        
-        # Build the year instruction
-        year_instruction = ""
-        if year:
-            year_instruction = f"Extrait les valeurs pour l'année {year}."
-        
-        # Build the prompt
-        prompt = f"""Voici un bilan comptable au format Markdown :
-
-{markdown_text}
-
-Identifie et renvoie un dictionnaire Python avec les variables suivantes si elles sont présentes :
-{chr(10).join(variables_to_extract)}
-
-{value_type_instruction}
-{year_instruction}
-
-Pour chaque variable, renvoie un dictionnaire avec les clés suivantes :
-- "name": le nom de la variable
-- "code": le code comptable (si disponible)
-- "values": une liste de dictionnaires avec les clés suivantes :
-  - "value": la valeur numérique
-  - "value_type": le type de valeur ("brut", "amortissement", "net")
-  - "year": l'année (si disponible)
-
-Exemple de format de réponse :
-{{
-  "actif_total": {{
-    "name": "actif_total",
-    "values": [
-      {{
-        "value": 1000000,
-        "value_type": "brut",
-        "year": 2023
-      }},
-      {{
-        "value": 900000,
-        "value_type": "net",
-        "year": 2023
-      }}
-    ]
-  }},
-  "2154220_mat_ind_subv_bioclad_2012": {{
-    "name": "2154220_mat_ind_subv_bioclad_2012",
-    "code": "2154220",
-    "values": [
-      {{
-        "value": 50000,
-        "value_type": "brut",
-        "year": 2023
-      }},
-      {{
-        "value": 20000,
-        "value_type": "amortissement",
-        "year": 2023
-      }},
-      {{
-        "value": 30000,
-        "value_type": "net",
-        "year": 2023
-      }}
-    ]
-  }}
-}}
-
-Réponds uniquement avec un dictionnaire JSON parsable."""
-        
-        return self.chat(prompt, model)
\ No newline at end of file
+        output_format = get_output_format(output_format)
+        with stage("prompt_build"):
+            system_prompt, prompt = build_extraction_prompt(markdown_text, year=year, value_type=value_type,
+                                                            variable_names=variable_names,
+                                                            output_format=output_format, notes=notes)
+            schema = build_output_schema(variable_names) if output_format == "compact" else None
+        with stage("llm"):
+            return self.chat(prompt, model, stream=stream, on_variable=on_variable, system=system_prompt,
+                             schema=schema)
\ No newline at end of file
@@ -0,0 +1,37 @@
+"""
+Tests of the routing of the asynchronous Ollama client.
+"""
+import asyncio
+from collections import Counter
+
+import pytest
+
+from bilan_extractor.services.async_ollama_client import AsyncOllamaClient
+
+pytest.importorskip("ollama")
+
+
+def test_in_flight_limit_per_server():
+    client = AsyncOllamaClient(hosts=["http://a:11434", "http://b:11434"], max_in_flight=2, max_retries=0)
+    client.pool.stop()
+    in_flight, peak, served = Counter(), Counter(), Counter()
+
+    async def send(host, messages, model, stream, on_variable, schema=None):
+        in_flight[host] += 1
+        peak[host] = max(peak[host], in_flight[host])
+        # The first server is slower: the requests queued for it count in its expected work
+        await asyncio.sleep(0.02 if host == "http://a:11434" else 0.01)
+        in_flight[host] -= 1
+        served[host] += 1
+        return "{}"
+
+    client._client_for = lambda host: host
+    client._send = send
+
+    async def run():
+        return await asyncio.gather(*(client.chat(f"document {index}") for index in range(20)))
+
+    assert asyncio.run(run()) == ["{}"] * 20
+    assert peak == {"http://a:11434": 2, "http://b:11434": 2}
+    assert sum(served.values()) == 20
+    assert all(endpoint.outstanding == 0 for endpoint in client.pool.endpoints)
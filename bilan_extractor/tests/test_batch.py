@@ -0,0 +1,255 @@
+"""
+Tests of the batch pipeline, with the conversion and the LLM replaced by fakes.
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from bilan_extractor.config import settings
+from bilan_extractor.core import batch
+from bilan_extractor.core.journal import JobJournal
+from bilan_extractor.models import registry as registry_module
+from bilan_extractor.models.registry import get_registry
+from bilan_extractor.utils.metrics import DocumentMetrics
+from bilan_extractor.utils.spill import MarkdownSpill
+
+# Directory of the spill files written by fake_convert, inherited by the forked conversion processes
+SPILL_DIR = None
+# File listing the documents converted by fake_convert
+CONVERT_LOG = None
+
+
+def fake_convert(filepath, use_cache, refresh_cache, page_workers=1, content_hash=None):
+    """Stand-in of _convert_document: the Markdown is the text of the file, in a spill file if SPILL_DIR is set."""
+    markdown = Path(filepath).read_text(encoding="utf-8")
+    if CONVERT_LOG is not None:
+        with open(CONVERT_LOG, "a", encoding="utf-8") as log:
+            log.write(Path(filepath).name + "\n")
+    if SPILL_DIR is not None:
+        spill = MarkdownSpill(SPILL_DIR)
+        spill.append(markdown)
+        spill.finish()
+        markdown = spill
+    return markdown, content_hash or Path(filepath).stem, 0.0, DocumentMetrics(document=filepath)
+
+
+class FakeClient:
+    """Synchronous client answering every requested variable with a fixed net amount."""
+
+    default_model = "fake"
+
+    def __init__(self, delay=0.0, failing=()):
+        self.delay = delay
+        self.failing = failing
+        self.requests = []
+
+    def extract_financial_variables(self, markdown_text, model=None, year=None, value_type=None,
+                                    variable_names=None, stream=False, on_variable=None, output_format=None,
+                                    notes=None):
+        self.requests.append(variable_names)
+        time.sleep(self.delay)
+        if any(text in str(markdown_text) for text in self.failing):
+            raise ConnectionError("server unreachable")
+        names = variable_names or get_registry().names
+        return json.dumps({name: [[None, None, 1000, 2023]] for name in names})
+
+
+@pytest.fixture(autouse=True)
+def fake_pipeline(monkeypatch, tmp_path):
+    global SPILL_DIR, CONVERT_LOG
+    SPILL_DIR = None
+    CONVERT_LOG = str(tmp_path / "converted.txt")
+    monkeypatch.setattr(batch, "_convert_document", fake_convert)
+    monkeypatch.setitem(settings.EXTRACTION_SETTINGS, "rule_based", False)
+    monkeypatch.setitem(settings.EXTRACTION_SETTINGS, "consistency_checks", False)
+    monkeypatch.setitem(settings.OLLAMA_SETTINGS, "stream", False)
+    yield
+    SPILL_DIR = CONVERT_LOG = None
+
+
+def make_documents(directory, count):
+    """Write documents whose Markdown is their own text."""
+    paths = []
+    for index in range(count):
+        path = directory / f"doc{index}.pdf"
+        path.write_text(f"# Bilan {index}\n\nTotal actif 1000\n", encoding="utf-8")
+        paths.append(path)
+    return paths
+
+
+class FailingJournal(JobJournal):
+    """Journal failing to record a result, or to start a given document."""
+
+    def __init__(self, path, fail_start=None):
+        super().__init__(path)
+        self.fail_start = fail_start
+
+    def start(self, content_hash, document):
+        if content_hash == self.fail_start:
+            raise RuntimeError("journal unavailable")
+        super().start(content_hash, document)
+
+    def mark_extracted(self, content_hash, result, variables=None):
+        raise RuntimeError("disk full")
+
+
+def test_write_failure_is_recorded(tmp_path):
+    paths = make_documents(tmp_path, 4)
+    with FailingJournal(str(tmp_path / "journal.sqlite")) as journal:
+        report = batch.run_batch(paths, FakeClient(), convert_workers=1, llm_workers=1, queue_size=1,
+                                 journal=journal)
+    assert [(doc.status, doc.stage, doc.error) for doc in report.documents] == [("failed", "write", "disk full")] * 4
+
+
+def test_stage_failure_stops_the_run_and_removes_spill_files(tmp_path):
+    global SPILL_DIR
+    SPILL_DIR = str(tmp_path / "spill")
+    os.mkdir(SPILL_DIR)
+    paths = make_documents(tmp_path, 3)
+    journal = FailingJournal(str(tmp_path / "journal.sqlite"), fail_start=batch.file_sha256(str(paths[2])))
+    try:
+        with pytest.raises(RuntimeError, match="journal unavailable"):
+            # The first document is being extracted and the second waits for the LLM when the third fails
+            batch.run_batch(paths, FakeClient(delay=0.5), convert_workers=1, llm_workers=1, queue_size=1,
+                            journal=journal)
+    finally:
+        journal.close()
+    assert os.listdir(SPILL_DIR) == []
+
+
+def test_resume_after_failure(tmp_path):
+    paths = make_documents(tmp_path, 3)
+    journal_path = str(tmp_path / "journal.sqlite")
+    with JobJournal(journal_path) as journal:
+        report = batch.run_batch(paths, FakeClient(failing=["Bilan 1"]), convert_workers=1, llm_workers=1,
+                                 journal=journal)
+        assert [doc.status for doc in report.documents] == ["ok", "failed", "ok"]
+        assert journal.counts() == {"extracted": 2, "failed": 1}
+
+    client = FakeClient()
+    with JobJournal(journal_path) as journal:
+        report = batch.run_batch(paths, client, convert_workers=1, llm_workers=1, journal=journal)
+        assert [doc.status for doc in report.documents] == ["skipped", "ok", "skipped"]
+        assert report.documents[0].result["actif_total"]["values"][0]["value"] == 1000
+        assert journal.get(report.documents[1].content_hash).attempts == 2
+        assert journal.counts() == {"extracted": 3}
+    # Only the failed document was extracted again
+    assert client.requests == [None]
+
+
+@pytest.fixture
+def variables_config(monkeypatch, tmp_path):
+    """A copy of the variable configuration, used instead of config/variables.json."""
+    path = tmp_path / "variables.json"
+    path.write_text(registry_module.VARIABLES_CONFIG_PATH.read_text(encoding="utf-8"), encoding="utf-8")
+    monkeypatch.setattr(registry_module, "VARIABLES_CONFIG_PATH", path)
+    return path
+
+
+def edit_config(path, edit):
+    """Apply a function to the variable configuration, making sure the registry sees the change."""
+    config = json.loads(path.read_text(encoding="utf-8"))
+    edit(config)
+    mtime = path.stat().st_mtime_ns
+    path.write_text(json.dumps(config), encoding="utf-8")
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+
+def variable(config, name):
+    """The definition of a configured variable."""
+    return next(spec for group in ("default_variables", "additional_variables") for spec in config.get(group, [])
+                if spec["name"] == name)
+
+
+def converted(tmp_path):
+    """The documents converted so far, in order."""
+    log = tmp_path / "converted.txt"
+    return log.read_text(encoding="utf-8").split() if log.exists() else []
+
+
+def test_fingerprints_follow_the_configuration(variables_config):
+    before = get_registry().fingerprints
+    edit_config(variables_config, lambda config: variable(config, "dettes")["aliases"].append("total des dettes"))
+    after = get_registry().fingerprints
+    assert [name for name in after if after[name] != before[name]] == ["dettes"]
+
+    edit_config(variables_config, lambda config: variable(config, "resultat_net").update(description="Bénéfice"))
+    assert [name for name, fingerprint in get_registry().fingerprints.items()
+            if fingerprint != after[name]] == ["resultat_net"]
+
+
+def test_delta_run(tmp_path, variables_config):
+    paths = make_documents(tmp_path, 2)
+    journal_path = str(tmp_path / "journal.sqlite")
+    with JobJournal(journal_path) as journal:
+        batch.run_batch(paths, FakeClient(), convert_workers=1, llm_workers=1, journal=journal)
+
+    def change(config):
+        variable(config, "dettes")["description"] = "Dettes fournisseurs et financières"
+        config["additional_variables"].append({"name": "stocks", "aliases": ["stocks"], "description": "Stocks"})
+    edit_config(variables_config, change)
+
+    client = FakeClient()
+    with JobJournal(journal_path) as journal:
+        report = batch.run_batch(paths, client, convert_workers=1, llm_workers=1, journal=journal)
+        assert client.requests == [["dettes", "stocks"]] * 2
+        assert [doc.status for doc in report.documents] == ["ok", "ok"]
+        assert list(report.documents[0].result) == get_registry().names
+        assert journal.get(report.documents[0].content_hash).variables == get_registry().fingerprints
+
+        # Up to date: nothing to do
+        client = FakeClient()
+        report = batch.run_batch(paths, client, convert_workers=1, llm_workers=1, journal=journal)
+        assert [doc.status for doc in report.documents] == ["skipped", "skipped"]
+        assert client.requests == []
+
+
+def test_delta_run_retried_after_failure(tmp_path, variables_config):
+    paths = make_documents(tmp_path, 1)
+    journal_path = str(tmp_path / "journal.sqlite")
+    with JobJournal(journal_path) as journal:
+        batch.run_batch(paths, FakeClient(), convert_workers=1, llm_workers=1, journal=journal)
+    edit_config(variables_config,
+                lambda config: variable(config, "dettes").update(description="Dettes fournisseurs et financières"))
+
+    with JobJournal(journal_path) as journal:
+        report = batch.run_batch(paths, FakeClient(failing=["Bilan"]), convert_workers=1, llm_workers=1,
+                                 journal=journal)
+        assert report.documents[0].status == "failed"
+        record = journal.get(report.documents[0].content_hash)
+        assert record.state == "failed" and record.result is not None
+
+        # The failed delta is retried with the same variables, and merged into the recorded result
+        client = FakeClient()
+        report = batch.run_batch(paths, client, convert_workers=1, llm_workers=1, journal=journal)
+        assert client.requests == [["dettes"]]
+        assert report.documents[0].status == "ok"
+        assert list(report.documents[0].result) == get_registry().names
+        assert journal.get(report.documents[0].content_hash).state == "extracted"
+
+
+def test_removed_variables_only(tmp_path, variables_config):
+    paths = make_documents(tmp_path, 1)
+    journal_path = str(tmp_path / "journal.sqlite")
+    with JobJournal(journal_path) as journal:
+        batch.run_batch(paths, FakeClient(), convert_workers=1, llm_workers=1, journal=journal)
+    assert converted(tmp_path) == ["doc0.pdf"]
+
+    def remove(config):
+        config["default_variables"] = [spec for spec in config["default_variables"]
+                                       if spec["name"] != "chiffre_affaires"]
+    edit_config(variables_config, remove)
+
+    client = FakeClient()
+    with JobJournal(journal_path) as journal:
+        report = batch.run_batch(paths, client, convert_workers=1, llm_workers=1, journal=journal)
+        result = report.documents[0].result
+        assert report.documents[0].status == "ok"
+        assert "chiffre_affaires" not in result and list(result) == get_registry().names
+        assert journal.get(report.documents[0].content_hash).result == result
+    # Neither converted again nor sent to the LLM
+    assert client.requests == []
+    assert converted(tmp_path) == ["doc0.pdf"]
@@ -0,0 +1,185 @@
+"""
+Tests of the accounting consistency checks and of the recheck of the failing variables.
+"""
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from bilan_extractor.config import settings
+from bilan_extractor.core.consistency import (BRUT, AMORTISSEMENT, NET, ValueGrid, build_grids,
+                                              check_consistency, check_net_amounts, check_subtotals,
+                                              check_sums, check_tables, suspect_names)
+from bilan_extractor.core.processing import extract_from_markdown
+from bilan_extractor.models.registry import get_registry
+
+MATERIEL = "2154220_mat_ind_subv_bioclad_2012"
+BUREAU = "2818300_amort_mat_bureau_inform"
+
+ACTIF = """Bilan - Exercice clos le 31/12/2023
+
+| Rubrique | Brut | Amortissements | Net N | Net N-1 |
+|---|---|---|---|---|
+| 2154220 Matériel industriel | 50 000 | 20 000 | 30 000 | 35 000 |
+| 2818300 Matériel de bureau | 10 000 | 4 000 | 6 000 | 5 000 |
+| Total de l'actif | 60 000 | 24 000 | {total} | 40 000 |
+"""
+
+DOCUMENT = """Bilan - Exercice clos le 31/12/2023
+
+Total actif 900 000
+Total passif 900 000
+Capitaux propres 100 000
+"""
+
+
+def variable(name, *values):
+    """A variable in the format of FinancialVariables.to_dict, from (value, value type, year) tuples."""
+    return {"name": name, "values": [{"value": value, "value_type": value_type, "year": year}
+                                     for value, value_type, year in values]}
+
+
+def result_of(*variables):
+    return {data["name"]: data for data in variables}
+
+
+def test_build_grids():
+    grid, = build_grids(ACTIF.format(total="36 000"), get_registry())
+    assert [(column.value_type.value, column.year) for column in grid.columns] == [
+        ("brut", 2023), ("amortissement", 2023), ("net", 2023), ("net", 2022)]
+    assert [spec.name if spec else None for spec in grid.specs] == [MATERIEL, BUREAU, "actif_total"]
+    assert grid.values.tolist() == [[50000, 20000, 30000, 35000], [10000, 4000, 6000, 5000],
+                                    [60000, 24000, 36000, 40000]]
+    assert grid.totals.tolist() == [False, False, True]
+
+
+def test_value_grid_falls_back_to_unspecified_amount():
+    values = ValueGrid.from_result(result_of(
+        variable("actif_total", (900000, "unspecified", 2023), (850000, "net", 2022)),
+        variable(MATERIEL, (50000, "brut", 2023), (20000, "amortissement", 2023), (30000, "net", 2023))))
+    assert values.years == [2022, 2023]
+    assert values.values[0, NET].tolist() == [850000, 900000]
+    assert values.values[1, BRUT, 1] == 50000 and values.values[1, AMORTISSEMENT, 1] == 20000
+
+
+def test_check_net_amounts():
+    consistent = ValueGrid.from_result(result_of(
+        variable(MATERIEL, (50000, "brut", 2023), (20000, "amortissement", 2023), (30000, "net", 2023))))
+    assert check_net_amounts(consistent) == []
+
+    inconsistent = ValueGrid.from_result(result_of(
+        variable(MATERIEL, (50000, "brut", 2023), (20000, "amortissement", 2023), (3000, "net", 2023))))
+    inconsistency, = check_net_amounts(inconsistent)
+    assert (inconsistency.check, inconsistency.names, inconsistency.year) == ("net", [MATERIEL], 2023)
+    assert (inconsistency.expected, inconsistency.found) == (30000, 3000)
+
+
+def test_check_sums():
+    registry = get_registry()
+    balanced = ValueGrid.from_result(result_of(
+        variable("actif_total", (900000, "net", 2023)), variable("passif_total", (900000.5, "net", 2023))))
+    assert check_sums(balanced, registry) == []
+
+    unbalanced = ValueGrid.from_result(result_of(
+        variable("actif_total", (900000, "net", 2023)), variable("passif_total", (800000, "net", 2023))))
+    inconsistency, = check_sums(unbalanced, registry)
+    assert inconsistency.check == "sum"
+    assert inconsistency.names == ["actif_total", "passif_total"]
+    assert (inconsistency.expected, inconsistency.found) == (800000, 900000)
+
+    # An identity with a missing amount is skipped
+    partial = ValueGrid.from_result(result_of(variable("actif_total", (900000, "net", 2023))))
+    assert check_sums(partial, registry) == []
+
+
+def test_check_subtotals():
+    grid, = build_grids(ACTIF.format(total="36 000"), get_registry())
+    assert check_subtotals(grid) == []
+
+    grid, = build_grids(ACTIF.format(total="37 000"), get_registry())
+    inconsistency, = check_subtotals(grid)
+    assert inconsistency.check == "subtotal"
+    assert inconsistency.names == [MATERIEL, BUREAU, "actif_total"]
+    assert (inconsistency.year, inconsistency.expected, inconsistency.found) == (2023, 36000, 37000)
+
+
+def test_check_tables():
+    grids = build_grids(ACTIF.format(total="36 000"), get_registry())
+    found = ValueGrid.from_result(result_of(variable(MATERIEL, (30000, "net", 2023), (35000, "net", 2022))))
+    assert check_tables(found, grids) == []
+
+    misread = ValueGrid.from_result(result_of(variable(MATERIEL, (30000, "net", 2023), (53000, "net", 2022))))
+    inconsistency, = check_tables(misread, grids)
+    assert (inconsistency.check, inconsistency.names, inconsistency.year) == ("table", [MATERIEL], 2022)
+    assert (inconsistency.expected, inconsistency.found) == (35000, 53000)
+
+
+def test_suspect_names_leave_out_subtotals():
+    registry = get_registry()
+    grids = build_grids(ACTIF.format(total="37 000"), registry)
+    result = result_of(variable("actif_total", (36000, "net", 2023)), variable("passif_total", (35000, "net", 2023)),
+                       variable(MATERIEL, (50000, "brut", 2023), (20000, "amortissement", 2023)))
+    inconsistencies = check_consistency(result, registry, grids)
+    assert sorted(inconsistency.check for inconsistency in inconsistencies) == ["subtotal", "sum", "table"]
+    # The subtotal failure involves the rows of the table, not the variables asked again
+    assert suspect_names(inconsistencies, registry) == ["actif_total", "passif_total"]
+
+
+class ScriptedClient:
+    """Synchronous client giving scripted answers in the compact format, and recording the requests."""
+
+    default_model = "fake"
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def extract_financial_variables(self, markdown_text, model=None, year=None, value_type=None,
+                                    variable_names=None, stream=False, on_variable=None, output_format=None,
+                                    notes=None):
+        self.requests.append((variable_names, notes))
+        return json.dumps(self.answers.pop(0))
+
+
+@pytest.fixture
+def recheck(monkeypatch):
+    monkeypatch.setitem(settings.EXTRACTION_SETTINGS, "consistency_checks", True)
+    monkeypatch.setitem(settings.EXTRACTION_SETTINGS, "consistency_tolerance", 1.0)
+
+
+FIRST_ANSWER = {"actif_total": [[None, None, 900000, 2023]], "passif_total": [[None, None, 800000, 2023]],
+                "capitaux_propres": [[None, None, 100000, 2023]]}
+
+
+def net_values(result, name):
+    return [value["value"] for value in result[name]["values"] if value["value_type"] == "net"]
+
+
+def test_recheck_asks_again_for_failing_variables(recheck):
+    client = ScriptedClient(FIRST_ANSWER, {"actif_total": [[None, None, 900000, 2023]],
+                                           "passif_total": [[None, None, 900000, 2023]]})
+    result = extract_from_markdown(DOCUMENT, client, use_rules=False, stream=False)
+    assert len(client.requests) == 2
+    names, notes = client.requests[1]
+    assert names == ["actif_total", "passif_total"]
+    assert notes and "passif_total" in notes[0]
+    assert net_values(result, "passif_total") == [900000]
+    assert net_values(result, "capitaux_propres") == [100000]
+
+
+def test_recheck_less_consistent_keeps_first_answer(recheck):
+    # The new answer still breaks the identity and adds an inconsistent net amount
+    client = ScriptedClient(FIRST_ANSWER, {"actif_total": [[1000, 0, 900000, 2023]],
+                                           "passif_total": [[None, None, 850000, 2023]]})
+    result = extract_from_markdown(DOCUMENT, client, use_rules=False, stream=False)
+    assert len(client.requests) == 2
+    assert net_values(result, "passif_total") == [800000]
+    assert [value["value_type"] for value in result["actif_total"]["values"]] == ["net"]
+
+
+def test_consistent_answer_is_not_rechecked(recheck):
+    answer = dict(FIRST_ANSWER, passif_total=[[None, None, 900000, 2023]])
+    client = ScriptedClient(answer)
+    extract_from_markdown(DOCUMENT, client, use_rules=False, stream=False)
+    assert len(client.requests) == 1
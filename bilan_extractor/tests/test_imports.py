@@ -0,0 +1,29 @@
+"""
+Tests of the import time of the entry points, measured in a fresh interpreter.
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+# Budget of the import of the entry point and of the data model, heavy backends excluded
+IMPORT_BUDGET_SECONDS = 1.0
+# Backends only imported on first use
+LAZY_MODULES = ("docling", "ollama", "numpy")
+
+_CODE = f"""
+import json, sys, time
+start = time.perf_counter()
+import bilan_extractor.main, bilan_extractor.models.variables
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def test_import_time_budget():
+    root = Path(__file__).resolve().parents[2]
+    completed = subprocess.run([sys.executable, "-c", _CODE], cwd=root, capture_output=True, text=True,
+                               check=True, timeout=60)
+    measure = json.loads(completed.stdout.strip().splitlines()[-1])
+    assert measure["loaded"] == []
+    assert measure["seconds"] < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,102 @@
+"""
+Tests of the job journal of batch runs.
+"""
+import sqlite3
+
+from bilan_extractor.core.journal import (CONVERTED, EXTRACTED, FAILED, PENDING, JobJournal, make_job_key,
+                                          outdated_variables)
+
+# Schema of the first version of the journal, before the fingerprints of the variables were recorded
+_FIRST_SCHEMA = """
+CREATE TABLE jobs (
+    job_key TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    document TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    stage TEXT,
+    error TEXT,
+    result TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_key, content_hash)
+);
+"""
+
+
+def test_added_columns_migration(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    connection = sqlite3.connect(path)
+    connection.executescript(_FIRST_SCHEMA)
+    connection.execute("INSERT INTO jobs VALUES ('', 'abc', 'a.pdf', 'extracted', 1, NULL, NULL, "
+                       "'{\"actif_total\": {\"values\": []}}', 0)")
+    connection.commit()
+    connection.close()
+
+    with JobJournal(path) as journal:
+        record = journal.get("abc")
+        assert record.state == EXTRACTED and record.variables is None
+        assert record.result == {"actif_total": {"values": []}}
+        # A result recorded before the fingerprints were tracked is current
+        assert outdated_variables(record, {"actif_total": "f1", "dettes": "f2"}) == ([], [])
+        journal.start("def", "b.pdf")
+        journal.mark_extracted("def", {}, {"actif_total": "f1"})
+        assert journal.get("def").variables == {"actif_total": "f1"}
+
+    # Opening the migrated journal again leaves it as it is
+    with JobJournal(path) as journal:
+        assert journal.counts() == {EXTRACTED: 2}
+
+
+def test_attempts(tmp_path):
+    with JobJournal(str(tmp_path / "journal.sqlite"), max_attempts=2) as journal:
+        journal.start("abc", "a.pdf")
+        journal.mark_converted("abc")
+        assert (journal.get("abc").state, journal.get("abc").attempts) == (CONVERTED, 1)
+        journal.mark_failed("abc", "extract", "timeout")
+        record = journal.get("abc")
+        assert (record.state, record.stage, record.error) == (FAILED, "extract", "timeout")
+        assert not journal.is_done(record)
+
+        journal.start("abc", "a.pdf")
+        record = journal.get("abc")
+        assert (record.state, record.attempts, record.stage, record.error) == (PENDING, 2, None, None)
+        journal.mark_failed("abc", "extract", "timeout")
+        assert journal.is_done(journal.get("abc"))
+
+
+def test_start_after_extraction_resets_attempts(tmp_path):
+    with JobJournal(str(tmp_path / "journal.sqlite"), max_attempts=2) as journal:
+        journal.start("abc", "a.pdf")
+        journal.mark_failed("abc", "convert", "crash")
+        journal.start("abc", "a.pdf")
+        journal.mark_extracted("abc", {"dettes": {"values": []}}, {"dettes": "f1"})
+        assert journal.get("abc").attempts == 2
+
+        # A delta run starts a new job with its own attempts
+        journal.start("abc", "a.pdf")
+        record = journal.get("abc")
+        assert (record.state, record.attempts) == (PENDING, 1)
+        assert record.result == {"dettes": {"values": []}}
+        assert not journal.is_done(record)
+
+
+def test_interrupted_document_counts_as_an_attempt(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    with JobJournal(path, max_attempts=2) as journal:
+        journal.start("abc", "a.pdf")
+    # The run died while the document was pending
+    with JobJournal(path, max_attempts=2) as journal:
+        record = journal.get("abc")
+        assert (record.state, record.attempts) == (PENDING, 1)
+        assert not journal.is_done(record)
+        journal.start("abc", "a.pdf")
+        assert journal.is_done(journal.get("abc"))
+
+
+def test_job_keys_are_separate(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    with JobJournal(path, job_key=make_job_key("gemma3", 2023, None)) as journal:
+        journal.start("abc", "a.pdf")
+        journal.mark_extracted("abc", {})
+    with JobJournal(path, job_key=make_job_key("gemma3", 2022, None)) as journal:
+        assert journal.get("abc") is None
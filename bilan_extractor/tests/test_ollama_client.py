@@ -0,0 +1,94 @@
+"""
+Tests of the request policy shared by the Ollama clients.
+"""
+import asyncio
+
+import pytest
+
+from bilan_extractor.services.async_ollama_client import AsyncOllamaClient
+from bilan_extractor.services.ollama_client import OllamaClient
+from bilan_extractor.utils.cache import DiskCache
+
+ollama = pytest.importorskip("ollama")
+
+HOSTS = ["http://a:11434", "http://b:11434"]
+
+
+def make_client(client_class, send, **kwargs):
+    """Create a client whose requests are answered by send(host, model)."""
+    client = client_class(hosts=HOSTS, max_retries=1, retry_backoff=0.0, **kwargs)
+    client.pool.stop()
+    client._clients = {host: host for host in HOSTS}
+    client._client_for = lambda host: host
+    if client_class is AsyncOllamaClient:
+        async def send_async(host, messages, model, stream, on_variable, schema=None):
+            return send(host, model)
+        client._send = send_async
+    else:
+        client._send = lambda host, messages, model, stream, on_variable, schema=None: send(host, model)
+    return client
+
+
+def chat(client, *args, **kwargs):
+    """Send a chat message with a client of either kind."""
+    if isinstance(client, AsyncOllamaClient):
+        return asyncio.run(client.chat(*args, **kwargs))
+    return client.chat(*args, **kwargs)
+
+
+@pytest.mark.parametrize("client_class", [OllamaClient, AsyncOllamaClient])
+def test_failover_then_backoff(client_class):
+    calls = []
+
+    def send(host, model):
+        calls.append(host)
+        if len(calls) < 3:
+            raise ConnectionError("refused")
+        return '{"a": 1}'
+
+    client = make_client(client_class, send)
+    assert chat(client, "prompt") == '{"a": 1}'
+    # Both servers failed once, then the request was retried after the backoff
+    assert sorted(calls[:2]) == HOSTS and len(calls) == 3
+    assert all(endpoint.outstanding == 0 for endpoint in client.pool.endpoints)
+
+
+@pytest.mark.parametrize("client_class", [OllamaClient, AsyncOllamaClient])
+def test_retries_exhausted(client_class):
+    def send(host, model):
+        raise ConnectionError("refused")
+
+    client = make_client(client_class, send)
+    with pytest.raises(ConnectionError):
+        chat(client, "prompt")
+
+
+@pytest.mark.parametrize("client_class", [OllamaClient, AsyncOllamaClient])
+def test_model_fallback(client_class):
+    models = []
+
+    def send(host, model):
+        models.append(model)
+        if model != "llama3":
+            raise ollama.ResponseError(f'model "{model}" not found, try pulling it first', 404)
+        return "{}"
+
+    client = make_client(client_class, send, default_model="llama3")
+    assert chat(client, "prompt", model="missing") == "{}"
+    assert models == ["missing", "llama3"]
+
+
+@pytest.mark.parametrize("client_class", [OllamaClient, AsyncOllamaClient])
+def test_cached_response_emits_members(client_class, tmp_path):
+    sent = []
+
+    def send(host, model):
+        sent.append(model)
+        return '{"a": 1, "b": 2}'
+
+    client = make_client(client_class, send, cache=DiskCache(str(tmp_path)))
+    chat(client, "prompt")
+    members = []
+    assert chat(client, "prompt", on_variable=lambda key, value: members.append((key, value))) == '{"a": 1, "b": 2}'
+    assert members == [("a", 1), ("b", 2)]
+    assert len(sent) == 1
@@ -0,0 +1,98 @@
+"""
+Tests of the parsing of LLM answers.
+"""
+import pytest
+
+from bilan_extractor.benchmarks.stub_ollama import canned_response
+from bilan_extractor.core.parser import expand_compact_output, parse_amount, parse_llm_output
+from bilan_extractor.models.registry import get_registry
+from bilan_extractor.models.variables import FinancialVariables
+
+
+def test_code_fence():
+    answer = 'Voici les variables :\n```json\n{"capital": {"values": [{"value": 1000, "value_type": "net"}]}}\n```'
+    assert parse_llm_output(answer) == {"capital": {"values": [{"value": 1000, "value_type": "net"}]}}
+
+
+def test_trailing_commas_and_python_literals():
+    answer = '{"capital": {"values": [{"value": 1000, "year": None,},],}, "reserves": null,}'
+    assert parse_llm_output(answer) == {"capital": {"values": [{"value": 1000, "year": None}]}, "reserves": None}
+
+
+def test_truncated_answer():
+    answer = '{"capital": {"values": [{"value": 1000, "year": 2023}]}, "reserves": {"values": [{"value": 25'
+    assert parse_llm_output(answer) == {"capital": {"values": [{"value": 1000, "year": 2023}]},
+                                        "reserves": {"values": [{}]}}
+
+
+def test_first_object_wins():
+    assert parse_llm_output('{"a": 1}\nExemple : {"a": 99, "b": 2}') == {"a": 1}
+
+
+def test_prose_braces_are_skipped():
+    assert parse_llm_output('Le bilan {en euros} :\n{"a": 1,}') == {"a": 1}
+
+
+def test_no_object():
+    assert parse_llm_output("") == {}
+    assert parse_llm_output("Aucune valeur trouvée.") == {}
+
+
+def test_bare_french_amount():
+    assert parse_llm_output('{"a": 6 188 162, "b": (12 000)}') == {"a": "6 188 162", "b": "(12 000)"}
+
+
+@pytest.mark.parametrize("text, amount", [
+    ("6 188 162", 6188162.0),
+    ("6 188 162 €", 6188162.0),
+    ("1.234,56", 1234.56),
+    ("(12 000)", -12000.0),
+    ("-350 €", -350.0),
+    ("350-", -350.0),
+    ("12,5 M€", 12500000.0),
+    ("3 k€", 3000.0),
+    ("1234.56", 1234.56),
+    ("1e6", 1000000.0),
+    (1000, 1000.0),
+])
+def test_parse_amount(text, amount):
+    assert parse_amount(text) == amount
+
+
+@pytest.mark.parametrize("text", [None, True, "", "N/A", "1e999", float("nan"), "12 34"])
+def test_parse_amount_rejects(text):
+    assert parse_amount(text) is None
+
+
+def test_expand_compact_output_matches_verbose_answer():
+    compact = {
+        "actif_total": [[1000000, None, 900000, 2023], [850000, "N-1"]],
+        "2154220": [[50000, 20000, 30000, 2023]],
+        "resultat_net": [120000, None],
+    }
+    verbose = {
+        "actif_total": {"name": "actif_total", "values": [
+            {"value": 1000000, "value_type": "brut", "year": 2023},
+            {"value": 900000, "value_type": "net", "year": 2023},
+            {"value": 850000, "value_type": "unspecified", "year": "N-1"},
+        ]},
+        "2154220_mat_ind_subv_bioclad_2012": {"name": "2154220_mat_ind_subv_bioclad_2012", "values": [
+            {"value": 50000, "value_type": "brut", "year": 2023},
+            {"value": 20000, "value_type": "amortissement", "year": 2023},
+            {"value": 30000, "value_type": "net", "year": 2023},
+        ], "code": "2154220"},
+        "resultat_net": {"name": "resultat_net", "values": [
+            {"value": 120000, "value_type": "unspecified", "year": None},
+        ]},
+    }
+    assert expand_compact_output(compact, get_registry()) == verbose
+
+
+def test_stub_answers_identical_in_both_formats():
+    registry = get_registry()
+    prompt = " ".join(registry.names)
+    compact = expand_compact_output(canned_response(prompt, compact=True), registry)
+    verbose = canned_response(prompt)
+    value_types = {value["value_type"] for data in verbose.values() for value in data["values"]}
+    assert value_types == {"brut", "amortissement", "net", "unspecified"}
+    assert FinancialVariables.from_dict(compact).to_dict() == FinancialVariables.from_dict(verbose).to_dict()
@@ -0,0 +1,63 @@
+"""
+Tests of the incremental parsing of streamed LLM answers.
+"""
+import json
+
+from bilan_extractor.core.parser import parse_llm_output
+from bilan_extractor.core.stream_parser import IncrementalJSONObjectParser
+
+
+def feed(chunks):
+    """Feed a parser with chunks, returning it and the members it emitted."""
+    parser = IncrementalJSONObjectParser()
+    members = []
+    for chunk in chunks:
+        members.extend(parser.feed(chunk))
+    return parser, members
+
+
+def test_members_emitted_as_completed():
+    parser = IncrementalJSONObjectParser()
+    assert parser.feed('{"a": 1, "b"') == [("a", 1)]
+    assert parser.feed(': "x"}') == [("b", "x")]
+    assert parser.done
+    assert json.loads(parser.result()) == {"a": 1, "b": "x"}
+
+
+def test_prose_before_the_object():
+    parser, members = feed(["Voici les montants {en euros} ", "du bilan :\n```json\n{", '\n  "a": 1', "}\n```"])
+    assert members == [("a", 1)]
+    assert parser.result() == '{\n  "a": 1}'
+
+
+def test_opening_brace_split_from_key():
+    parser, members = feed(["Réponse : {", "  ", '"a": [1, 2]}'])
+    assert members == [("a", [1, 2])]
+    assert parse_llm_output(parser.result()) == {"a": [1, 2]}
+
+
+def test_empty_object():
+    parser, members = feed(["{ }"])
+    assert members == []
+    assert parser.done
+    assert parser.result() == "{ }"
+
+
+def test_nested_objects():
+    answer = '{"a": {"values": [{"value": 1, "year": 2023}, {"value": 2, "year": 2022}]}, "b": {"c": {}}}'
+    parser, members = feed([answer[index:index + 7] for index in range(0, len(answer), 7)])
+    assert members == list(json.loads(answer).items())
+    assert parser.done
+
+
+def test_truncated_object():
+    parser, members = feed(['{"a": {"values": [1]}, "b": {"values": [2'])
+    assert members == [("a", {"values": [1]})]
+    assert not parser.done
+    assert parser.result() is None
+
+
+def test_text_after_the_object_is_ignored():
+    parser, members = feed(['{"a": 1}\nExemple : {"a": 99}'])
+    assert members == [("a", 1)]
+    assert parse_llm_output(parser.result()) == parse_llm_output('{"a": 1}\nExemple : {"a": 99}')
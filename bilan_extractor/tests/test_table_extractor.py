@@ -0,0 +1,114 @@
+"""
+Tests of the extraction of financial variables from Markdown tables.
+"""
+from bilan_extractor.core.table_extractor import (Column, classify_columns, detect_fiscal_year,
+                                                  extract_from_tables, parse_markdown_tables)
+from bilan_extractor.models.registry import get_registry
+from bilan_extractor.models.variables import ValueType
+
+ACTIF = """Bilan - Exercice clos le 31/12/2023
+
+| Rubrique | Brut | Amortissements | Net | Net |
+|  | | et provisions | 31/12/2023 | 31/12/2022 |
+|---|---|---|---|---|
+| 2154220 Matériel industriel | 50 000 | 20 000 | 30 000 | 35 000 |
+| Total de l'actif | 1 200 000 | 300 000 | 900 000 | 850 000 |
+"""
+
+
+def values(result, name):
+    """The (value, value type, year) of a variable of the result."""
+    return [(value["value"], value["value_type"], value["year"]) for value in result[name]["values"]]
+
+
+def test_multi_line_header():
+    table, = parse_markdown_tables(ACTIF)
+    assert table.header == ["Rubrique", "Brut", "Amortissements et provisions", "Net 31/12/2023", "Net 31/12/2022"]
+    assert len(table.rows) == 2
+    assert classify_columns(table.header) == [
+        Column(1, ValueType.BRUT, 2023), Column(2, ValueType.AMORTISSEMENT, 2023),
+        Column(3, ValueType.NET, 2023), Column(4, ValueType.NET, 2022),
+    ]
+
+
+def test_code_and_exact_label_rows():
+    result = extract_from_tables(ACTIF, get_registry())
+    assert values(result, "2154220_mat_ind_subv_bioclad_2012") == [
+        (50000.0, "brut", 2023), (20000.0, "amortissement", 2023), (30000.0, "net", 2023), (35000.0, "net", 2022)]
+    assert result["2154220_mat_ind_subv_bioclad_2012"]["code"] == "2154220"
+    assert values(result, "actif_total")[2:] == [(900000.0, "net", 2023), (850000.0, "net", 2022)]
+
+
+def test_label_rows_must_match_exactly():
+    markdown = """| Rubrique | Net |
+|---|---|
+| Total actif circulant | 400 000 |
+| Dettes fournisseurs | 80 000 |
+"""
+    assert extract_from_tables(markdown, get_registry()) == {}
+
+
+def test_relative_year_columns():
+    markdown = """Comptes annuels arrêtés au 30/06/2024
+
+| Poste | N | N-1 |
+|---|---|---|
+| Total passif | 1 500 | 1 400 |
+"""
+    assert detect_fiscal_year(markdown) == 2024
+    result = extract_from_tables(markdown, get_registry())
+    assert values(result, "passif_total") == [(1500.0, "unspecified", 2024), (1400.0, "unspecified", 2023)]
+    assert values(extract_from_tables(markdown, get_registry(), year=2023), "passif_total") == [
+        (1400.0, "unspecified", 2023)]
+
+
+def test_relative_year_columns_without_fiscal_year():
+    markdown = """| Poste | N | N-1 |
+|---|---|---|
+| Total passif | 1 500 | 1 400 |
+"""
+    # Neither a type nor a year: the columns are not read
+    assert extract_from_tables(markdown, get_registry()) == {}
+
+
+def test_figure_repeated_in_detail_and_summary_tables():
+    markdown = """Exercice clos le 31/12/2023
+
+| Détail des dettes | Net 2023 |
+|---|---|
+| Dettes | 120 000 |
+
+| Bilan passif | Net 2023 |
+|---|---|
+| Dettes | 999 999 |
+| Total passif | 500 000 |
+"""
+    result = extract_from_tables(markdown, get_registry())
+    assert values(result, "dettes") == [(120000.0, "net", 2023)]
+    assert values(result, "passif_total") == [(500000.0, "net", 2023)]
+
+
+def test_undated_columns_dropped_when_ambiguous():
+    markdown = """| Rubrique | Net | Net |
+|---|---|---|
+| Capitaux propres | 300 000 | 280 000 |
+"""
+    registry = get_registry()
+    # Two undated net columns: which one is the requested year is unknown
+    assert extract_from_tables(markdown, registry, year=2023) == {}
+    assert values(extract_from_tables(markdown, registry), "capitaux_propres") == [(300000.0, "net", None)]
+
+
+def test_single_undated_column_kept_for_a_year():
+    markdown = """| Rubrique | Net |
+|---|---|
+| Capitaux propres | 300 000 |
+"""
+    assert values(extract_from_tables(markdown, get_registry(), year=2023), "capitaux_propres") == [
+        (300000.0, "net", None)]
+
+
+def test_restricted_to_names():
+    result = extract_from_tables(ACTIF, get_registry(), names=["actif_total"])
+    assert list(result) == ["actif_total"]
+    assert extract_from_tables(ACTIF, get_registry(), names=[]) == {}
@@ -0,0 +1,36 @@
+"""
+Tests of the storage of financial variable values.
+"""
+import pytest
+
+from bilan_extractor.models.variables import FinancialValue, FinancialVariable, ValueType
+
+
+@pytest.mark.parametrize("year", [None, 2023, "N", "N-1", "2023/2024", "2023", 10 ** 12, -1])
+def test_year_round_trip(year):
+    variable = FinancialVariable("capital", [FinancialValue(1000.0, ValueType.NET, year)])
+    variable.add_value(2000.0, ValueType.BRUT, year)
+
+    assert [val["year"] for val in variable.to_dict()["values"]] == [year, year]
+    assert [val.year for val in variable.values] == [year, year]
+    assert variable.get_value(ValueType.BRUT, year) == 2000.0
+
+
+def test_label_year_does_not_match_packed_years():
+    variable = FinancialVariable("capital", [FinancialValue(1.0, ValueType.NET, "N"),
+                                             FinancialValue(2.0, ValueType.NET, 2023),
+                                             FinancialValue(3.0, ValueType.NET, "2023")])
+
+    assert variable.get_value(ValueType.NET, 2023) == 2.0
+    assert variable.get_value(ValueType.NET, "2023") == 3.0
+    assert variable.get_value(ValueType.NET, "N") == 1.0
+    assert variable.get_value(ValueType.NET, None) == 1.0
+
+
+def test_values_are_read_only():
+    variable = FinancialVariable("capital", [FinancialValue(1.0, ValueType.NET, 2023)])
+
+    with pytest.raises(AttributeError):
+        variable.values.append(FinancialValue(2.0))
+    variable.add_value(2.0)
+    assert variable.values == (FinancialValue(1.0, ValueType.NET, 2023), FinancialValue(2.0))
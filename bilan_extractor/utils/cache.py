@@ -0,0 +1,288 @@
+"""
+Module providing a persistent, content-addressed on-disk cache.
+
+Entries are stored as one file per key under a two-level directory layout.
+The modification time of an entry records when it was written (used for the
+time-to-live) and its access time is refreshed on every read, so evicting the
+least recently accessed entries when the size cap is exceeded gives a
+least-recently-used policy shared by every process using the same directory.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# Size of the blocks read when hashing files
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(filepath: str) -> str:
+    """
+    Compute the SHA-256 hash of a file's content.
+
+    Args:
+        filepath: Path to the file
+
+    Returns:
+        The hexadecimal digest of the file's content
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """
+    Build a cache key from arbitrary JSON-serializable parts.
+
+    Args:
+        parts: The values identifying the cached entry
+
+    Returns:
+        The hexadecimal SHA-256 digest of the canonical JSON encoding of the parts
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Persistent key/value cache storing text entries on disk with LRU and TTL eviction.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            directory: Directory where the entries are stored (created on first write)
+            max_bytes: Maximum total size of the entries, None for no limit
+            ttl_seconds: Maximum age of an entry, None for entries that never expire
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expirations": 0}
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        """Increment one of the usage counters."""
+        with self._lock:
+            self._stats[counter] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the usage counters of the cache since it was created.
+
+        Returns:
+            A dictionary with the hit, miss, write, eviction and expiration counts and the hit ratio
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _path_for(self, key: str) -> Path:
+        """Get the path of the file storing an entry."""
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get an entry from the cache.
+
+        Args:
+            key: The key of the entry
+
+        Returns:
+            The cached text, or None if the key is not in the cache
+        """
+        return self._read(key, lambda path: path.read_text(encoding="utf-8"))
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """
+        Open an entry of the cache for reading, to stream large entries instead of loading them.
+
+        Args:
+            key: The key of the entry
+
+        Returns:
+            The entry's file opened in binary mode (closed by the caller), or None if
+            the key is not in the cache
+        """
+        return self._read(key, lambda path: open(path, "rb"))
+
+    def _read(self, key: str, reader) -> Any:
+        """Read an entry with the given function of its path, handling the TTL and the usage counters."""
+        path = self._path_for(key)
+        try:
+            written_at = path.stat().st_mtime
+            if self.ttl_seconds is not None and time.time() - written_at > self.ttl_seconds:
+                self._count("expirations")
+                self.delete(key)
+                self._count("misses")
+                return None
+            value = reader(path)
+        except (FileNotFoundError, UnicodeDecodeError):
+            self._count("misses")
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read cache entry {path}: {e}")
+            self._count("misses")
+            return None
+
+        # Mark the entry as recently used, keeping its write time for the TTL
+        try:
+            os.utime(path, (time.time(), written_at))
+        except OSError:
+            pass
+        self._count("hits")
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Store an entry in the cache, evicting the least recently used entries if needed.
+
+        Args:
+            key: The key of the entry
+            value: The text to store
+        """
+        data = value.encode("utf-8")
+        self._write(key, lambda f: f.write(data), len(data))
+
+    def set_file(self, key: str, source: str) -> None:
+        """
+        Store the content of a file in the cache, copying it block by block.
+
+        Args:
+            key: The key of the entry
+            source: Path to the file holding the text to store
+        """
+        def copy(f: BinaryIO) -> None:
+            with open(source, "rb") as src:
+                shutil.copyfileobj(src, f)
+
+        try:
+            size = os.path.getsize(source)
+        except OSError as e:
+            logger.warning(f"Could not read {source} to cache it: {e}")
+            return
+        self._write(key, copy, size)
+
+    def _write(self, key: str, writer, size: int) -> None:
+        """Write an entry with the given function of its file, then evict entries if the cache is too large."""
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    writer(f)
+                os.replace(tmp_name, path)
+            except BaseException:
+                os.unlink(tmp_name)
+                raise
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {path}: {e}")
+            return
+        self._count("writes")
+
+        if self.max_bytes is not None:
+            with self._lock:
+                if self._total_bytes is None:
+                    self._total_bytes = sum(size for _, _, _, size in self._entries())
+                else:
+                    self._total_bytes += size
+                over_limit = self._total_bytes > self.max_bytes
+            if over_limit:
+                self.evict()
+
+    def delete(self, key: str) -> None:
+        """Remove an entry from the cache if it exists."""
+        try:
+            self._path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        for path, _, _, _ in self._entries():
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        self._total_bytes = 0
+
+    def _entries(self) -> List[Tuple[Path, float, float, int]]:
+        """List the entries of the cache as (path, last access time, write time, size) tuples."""
+        entries = []
+        if not self.directory.exists():
+            return entries
+        for path in self.directory.glob("??/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_atime, stat.st_mtime, stat.st_size))
+        return entries
+
+    def evict(self) -> None:
+        """
+        Remove the expired entries, then the least recently used entries until
+        the cache is below 90% of its size cap.
+        """
+        entries = self._entries()
+        total = sum(size for _, _, _, size in entries)
+        removed = 0
+
+        if self.ttl_seconds is not None:
+            now = time.time()
+            expired = [entry for entry in entries if now - entry[2] > self.ttl_seconds]
+            for path, _, _, size in expired:
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+            entries = [entry for entry in entries if now - entry[2] <= self.ttl_seconds]
+
+        if self.max_bytes is not None and total > self.max_bytes:
+            target = int(self.max_bytes * 0.9)
+            entries.sort(key=lambda entry: entry[1])
+            for path, _, _, size in entries:
+                if total <= target:
+                    break
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+
+        if removed:
+            self._count("evictions", removed)
+            logger.debug(f"Evicted {removed} cache entries in {self.directory}, {total} bytes remaining")
+        with self._lock:
+            self._total_bytes = total
+
+    @staticmethod
+    def _remove(path: Path) -> bool:
+        """Remove an entry file, returning whether it no longer exists."""
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not evict cache entry {path}: {e}")
+            return False
+        return True
\ No newline at end of file
@@ -28,6 +28,12 @@ def setup_logger(
     logger = logging.getLogger(name)
     logger.setLevel(level)
     
+    # Remove the handlers of a previous call so that messages are not duplicated
+    for handler in list(logger.handlers):
+        if getattr(handler, "_bilan_extractor_handler", False):
+            logger.removeHandler(handler)
+            handler.close()
+    
     # Create formatter
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -42,12 +48,14 @@ def setup_logger(
         
         file_handler = logging.FileHandler(log_path, encoding="utf-8")
         file_handler.setFormatter(formatter)
+        file_handler._bilan_extractor_handler = True
         logger.addHandler(file_handler)
     
     # Add console handler if console_output is True
     if console_output:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
+        console_handler._bilan_extractor_handler = True
         logger.addHandler(console_handler)
     
     return logger
@@ -0,0 +1,393 @@
+"""
+Module for measuring where the time of each document goes.
+
+A DocumentMetrics record is opened for every processed document with
+track_document(). The pipeline stages (load, convert, rules, select,
+prompt_build, llm, parse, model_build, check, serialise) time themselves with
+stage() into the record of the current document, found through a context
+variable so that no signature has to carry it; outside of a tracked
+document, stage() does nothing. The Ollama response metadata (token counts and durations) is
+attached to the record as well. When a document is done its record is added
+to the process-wide collector, which keeps counters and histograms that can
+be dumped as JSON or in the Prometheus text format.
+"""
+import contextvars
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+
+# Stages of the pipeline, in processing order ("rules" reads the tables, "select" picks the relevant sections,
+# "check" runs the accounting consistency checks)
+STAGES = ("load", "convert", "rules", "select", "prompt_build", "llm", "parse", "model_build", "check", "serialise")
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Upper bounds of the histogram buckets of the generation speed, in tokens per second
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+# Metadata of the Ollama responses kept in the records (durations are in nanoseconds)
+LLM_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration",
+              "load_duration", "total_duration")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("bilan_extractor_document_metrics", default=None)
+
+
+@dataclass
+class DocumentMetrics:
+    """
+    Data class holding the measurements of one document.
+    """
+    document: str
+    status: str = "ok"
+    backend: Optional[str] = None
+    stages: Dict[str, float] = field(default_factory=dict)
+    llm: Dict[str, float] = field(default_factory=dict)
+    llm_calls: int = 0
+    markdown_chars: Optional[int] = None
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Add the duration of a stage (stages run several times are summed)."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_llm_response(self, metadata: Dict[str, Any]) -> None:
+        """Add the token counts and durations reported by Ollama for one response."""
+        self.llm_calls += 1
+        for key in LLM_FIELDS:
+            value = metadata.get(key)
+            if value is not None:
+                self.llm[key] = self.llm.get(key, 0) + value
+
+    @property
+    def total_seconds(self) -> float:
+        """Sum of the stage durations."""
+        return sum(self.stages.values())
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Generation speed reported by Ollama."""
+        if self.llm.get("eval_count") and self.llm.get("eval_duration"):
+            return self.llm["eval_count"] / (self.llm["eval_duration"] / 1e9)
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary representation."""
+        tokens_per_second = self.tokens_per_second
+        return {
+            "document": self.document,
+            "status": self.status,
+            "backend": self.backend,
+            "markdown_chars": self.markdown_chars,
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "total_seconds": round(self.total_seconds, 4),
+            "llm_calls": self.llm_calls,
+            "llm": dict(self.llm),
+            "tokens_per_second": round(tokens_per_second, 2) if tokens_per_second is not None else None,
+        }
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, as exposed by Prometheus.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record a value."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """The (upper bound, number of values at or below it) pairs, ending with +Inf."""
+        pairs = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            pairs.append(("+Inf" if bound == float("inf") else f"{bound:g}", total))
+        return pairs
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile from the buckets.
+
+        Returns:
+            The upper bound of the bucket holding the quantile, None if there is no
+            value or if it is above the last bucket
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary representation."""
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class MetricsCollector:
+    """
+    Thread-safe aggregation of the document records of a process.
+    """
+
+    def __init__(self, keep_documents: int = 1000):
+        """
+        Initialize the collector.
+
+        Args:
+            keep_documents: Number of most recent document records kept for the JSON dump
+        """
+        self.keep_documents = keep_documents
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every measurement."""
+        with self._lock:
+            self.started_at = time.time()
+            self.documents: List[DocumentMetrics] = []
+            self.document_counts: Dict[str, int] = {}
+            self.backend_counts: Dict[str, int] = {}
+            self.stage_seconds: Dict[str, Histogram] = {}
+            self.document_seconds = Histogram(DURATION_BUCKETS)
+            self.tokens_per_second = Histogram(TOKENS_PER_SECOND_BUCKETS)
+            self.llm_totals: Dict[str, float] = {}
+            self.llm_calls = 0
+
+    def record(self, metrics: DocumentMetrics) -> None:
+        """
+        Add the record of a finished document.
+
+        Args:
+            metrics: The record
+        """
+        with self._lock:
+            self.documents.append(metrics)
+            if len(self.documents) > self.keep_documents:
+                del self.documents[0]
+            self.document_counts[metrics.status] = self.document_counts.get(metrics.status, 0) + 1
+            if metrics.backend:
+                self.backend_counts[metrics.backend] = self.backend_counts.get(metrics.backend, 0) + 1
+            for name, seconds in metrics.stages.items():
+                self.stage_seconds.setdefault(name, Histogram(DURATION_BUCKETS)).observe(seconds)
+            self.document_seconds.observe(metrics.total_seconds)
+            if metrics.tokens_per_second is not None:
+                self.tokens_per_second.observe(metrics.tokens_per_second)
+            for key, value in metrics.llm.items():
+                self.llm_totals[key] = self.llm_totals.get(key, 0) + value
+            self.llm_calls += metrics.llm_calls
+
+    def to_dict(self, include_documents: bool = True) -> Dict[str, Any]:
+        """
+        Get the aggregated measurements.
+
+        Args:
+            include_documents: Whether to include the most recent document records
+
+        Returns:
+            A dictionary ready to be serialized to JSON
+        """
+        with self._lock:
+            elapsed = time.time() - self.started_at
+            finished = sum(self.document_counts.values())
+            result = {
+                "elapsed_seconds": round(elapsed, 3),
+                "documents": dict(self.document_counts),
+                "documents_per_second": round(finished / elapsed, 4) if elapsed > 0 else 0.0,
+                "backends": dict(self.backend_counts),
+                "stages": {name: self.stage_seconds[name].to_dict()
+                           for name in sorted(self.stage_seconds, key=_stage_order)},
+                "document_seconds": self.document_seconds.to_dict(),
+                "llm_calls": self.llm_calls,
+                "llm": dict(self.llm_totals),
+                "tokens_per_second": self.tokens_per_second.to_dict(),
+            }
+            if include_documents:
+                result["recent_documents"] = [metrics.to_dict() for metrics in self.documents]
+            return result
+
+    def to_json(self, include_documents: bool = True) -> str:
+        """Dump the measurements as JSON."""
+        return json.dumps(self.to_dict(include_documents), indent=2, ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """
+        Dump the measurements in the Prometheus text exposition format.
+
+        Returns:
+            The metrics, one sample per line
+        """
+        lines = []
+        with self._lock:
+            lines.append("# HELP bilan_documents_total Documents processed, by status")
+            lines.append("# TYPE bilan_documents_total counter")
+            for status, count in sorted(self.document_counts.items()):
+                lines.append(f'bilan_documents_total{{status="{status}"}} {count}')
+
+            lines.append("# HELP bilan_conversions_total Documents converted, by backend")
+            lines.append("# TYPE bilan_conversions_total counter")
+            for backend, count in sorted(self.backend_counts.items()):
+                lines.append(f'bilan_conversions_total{{backend="{backend}"}} {count}')
+
+            lines.append("# HELP bilan_stage_seconds Duration of the pipeline stages per document")
+            lines.append("# TYPE bilan_stage_seconds histogram")
+            for name in sorted(self.stage_seconds, key=_stage_order):
+                lines.extend(_histogram_lines("bilan_stage_seconds", self.stage_seconds[name], f'stage="{name}"'))
+
+            lines.append("# HELP bilan_document_seconds Total duration of the stages of a document")
+            lines.append("# TYPE bilan_document_seconds histogram")
+            lines.extend(_histogram_lines("bilan_document_seconds", self.document_seconds))
+
+            lines.append("# HELP bilan_llm_tokens_per_second Generation speed reported by Ollama")
+            lines.append("# TYPE bilan_llm_tokens_per_second histogram")
+            lines.extend(_histogram_lines("bilan_llm_tokens_per_second", self.tokens_per_second))
+
+            lines.append("# HELP bilan_llm_requests_total Requests sent to Ollama")
+            lines.append("# TYPE bilan_llm_requests_total counter")
+            lines.append(f"bilan_llm_requests_total {self.llm_calls}")
+            for key in LLM_FIELDS:
+                if key not in self.llm_totals:
+                    continue
+                if key.endswith("_count"):
+                    name = f"bilan_llm_{key}_tokens_total"
+                    value = self.llm_totals[key]
+                else:
+                    name = f"bilan_llm_{key}_seconds_total"
+                    value = self.llm_totals[key] / 1e9
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _stage_order(name: str) -> Tuple[int, str]:
+    """Sort key keeping the stages in pipeline order."""
+    return (STAGES.index(name) if name in STAGES else len(STAGES), name)
+
+
+def _histogram_lines(name: str, histogram: Histogram, labels: str = "") -> List[str]:
+    """Render a histogram in the Prometheus text format."""
+    prefix = f"{labels}," if labels else ""
+    lines = [f'{name}_bucket{{{prefix}le="{bound}"}} {count}' for bound, count in histogram.cumulative()]
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum:g}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+# Collector of the current process
+_collector = MetricsCollector()
+
+
+def get_metrics() -> MetricsCollector:
+    """
+    Get the collector of the current process.
+
+    Returns:
+        The MetricsCollector shared by all documents of this process
+    """
+    return _collector
+
+
+def current_document() -> Optional[DocumentMetrics]:
+    """
+    Get the record of the document being processed in the current context.
+
+    Returns:
+        The record, or None outside of track_document()
+    """
+    return _current.get()
+
+
+@contextmanager
+def track_document(document: str, collect: bool = True) -> Iterator[DocumentMetrics]:
+    """
+    Open the record of a document for the stages run in this context.
+
+    Args:
+        document: The name or path of the document
+        collect: Whether to add the record to the process collector when done
+
+    Yields:
+        The record; its status is set to "failed" if the block raises
+    """
+    metrics = DocumentMetrics(document=document)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    except BaseException:
+        metrics.status = "failed"
+        raise
+    finally:
+        _current.reset(token)
+        if collect:
+            _collector.record(metrics)
+
+
+@contextmanager
+def resume_document(metrics: DocumentMetrics) -> Iterator[DocumentMetrics]:
+    """
+    Make an open record the record of the current context again, e.g. in the
+    next stage of a pipeline. The record is not collected when the block exits.
+
+    Args:
+        metrics: The record (see track_document)
+
+    Yields:
+        The record
+    """
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def record_llm_response(metadata: Dict[str, Any]) -> None:
+    """
+    Add the metadata of an Ollama response to the record of the current document, if any.
+
+    Args:
+        metadata: The token counts and durations of the response (see LLM_FIELDS)
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_llm_response(metadata)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a pipeline stage into the record of the current document, if any.
+
+    Args:
+        name: The name of the stage (see STAGES)
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_stage(name, time.perf_counter() - start)
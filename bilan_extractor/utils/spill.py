@@ -0,0 +1,238 @@
+"""
+Module providing spill files holding the Markdown of long documents.
+
+A MarkdownSpill is written segment by segment (one page at a time) while a
+document is converted, then read back through a read-only memory map: the
+segments and the lines are decoded one at a time, so the Markdown of a
+multi-hundred-page filing never has to be held in memory as a whole. Only the
+parts selected for a prompt are materialised as strings.
+
+The readers of the pipeline accept either a string or a spill (see
+markdown_lines and markdown_segments). A spill is picklable, only its path and
+its segment index being transferred, so that a conversion worker process can
+hand it over to its parent.
+"""
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from typing import BinaryIO, Iterator, List, Optional, TextIO, Tuple, Union
+
+# Set up logger
+logger = logging.getLogger("bilan_extractor")
+
+# Marker starting the Markdown of each page, where stored conversions are split into segments
+PAGE_MARKER = b"## Page "
+
+
+class MarkdownSpill:
+    """
+    Markdown document written incrementally to a temporary file and read through mmap.
+    The file is removed by close(); a spill is also a context manager.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Create an empty spill file.
+
+        Args:
+            directory: Directory of the file (defaults to the system temporary directory)
+        """
+        fd, self.path = tempfile.mkstemp(prefix="bilan-", suffix=".md", dir=directory)
+        self._writer: Optional[BinaryIO] = os.fdopen(fd, "wb")
+        self._segments: List[Tuple[int, int]] = []
+        self._size = 0
+        self._chars = 0
+        self._file: Optional[BinaryIO] = None
+        self._map: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        """Number of characters of the document, as len() of the equivalent string."""
+        return self._chars
+
+    def __enter__(self) -> "MarkdownSpill":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        self.finish()
+        return {"path": self.path, "segments": self._segments, "size": self._size, "chars": self._chars}
+
+    def __setstate__(self, state: dict) -> None:
+        self.path = state["path"]
+        self._segments, self._size, self._chars = state["segments"], state["size"], state["chars"]
+        self._writer = self._file = self._map = None
+
+    @property
+    def size(self) -> int:
+        """Size of the file, in bytes."""
+        return self._size
+
+    def append(self, text: str) -> None:
+        """
+        Append a segment of Markdown, typically the Markdown of a page or a page range.
+
+        Args:
+            text: The Markdown to append
+        """
+        if text:
+            self._write(text.encode("utf-8"), len(text))
+
+    def append_file(self, source: BinaryIO) -> None:
+        """
+        Append the content of a Markdown file, one page at a time.
+
+        Args:
+            source: The file, opened in binary mode
+        """
+        page: List[bytes] = []
+        for line in source:
+            if line.startswith(PAGE_MARKER) and page:
+                self._append_bytes(b"".join(page))
+                page.clear()
+            page.append(line)
+        if page:
+            self._append_bytes(b"".join(page))
+
+    def _append_bytes(self, data: bytes) -> None:
+        """Append a segment of UTF-8 encoded Markdown."""
+        self._write(data, len(data.decode("utf-8")))
+
+    def _write(self, data: bytes, chars: int) -> None:
+        """Write a segment at the end of the file and record its position."""
+        if self._writer is None:
+            raise ValueError(f"Spill file {self.path} is already finished")
+        self._writer.write(data)
+        self._segments.append((self._size, len(data)))
+        self._size += len(data)
+        self._chars += chars
+
+    def clear(self) -> None:
+        """Remove every segment written so far, e.g. before a conversion is retried with another backend."""
+        if self._writer is None:
+            raise ValueError(f"Spill file {self.path} is already finished")
+        self._writer.seek(0)
+        self._writer.truncate()
+        self._segments.clear()
+        self._size = self._chars = 0
+
+    def finish(self) -> None:
+        """Close the file for writing; the spill is read-only afterwards."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _view(self) -> Optional[mmap.mmap]:
+        """Map the file in memory on first read (None for an empty document, which cannot be mapped)."""
+        self.finish()
+        if self._map is None and self._size:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def segments(self) -> Iterator[str]:
+        """
+        Iterate over the segments of the document, in order.
+
+        Returns:
+            An iterator decoding one segment at a time from the memory map
+        """
+        view = self._view()
+        for offset, length in self._segments:
+            yield view[offset:offset + length].decode("utf-8")
+
+    def lines(self) -> Iterator[str]:
+        """
+        Iterate over the lines of the document, as str.splitlines() would split it.
+
+        Returns:
+            An iterator over the lines, without their line endings
+        """
+        pending = ""
+        for segment in self.segments():
+            lines = (pending + segment).splitlines(keepends=True)
+            # A line cut at the end of a segment (or a "\r" that may be followed by "\n") continues in the next one
+            last = lines[-1] if lines else ""
+            pending = lines.pop() if last and (last.endswith("\r") or last.splitlines()[0] == last) else ""
+            for line in lines:
+                yield line.splitlines()[0]
+        if pending:
+            yield pending.splitlines()[0]
+
+    def read(self) -> str:
+        """
+        Read the whole document.
+
+        Returns:
+            The Markdown content as a string
+        """
+        return "".join(self.segments())
+
+    def save(self, output_file: str) -> None:
+        """
+        Copy the document to a file.
+
+        Args:
+            output_file: Path of the copy
+        """
+        self.finish()
+        shutil.copyfile(self.path, output_file)
+
+    def write_to(self, stream: TextIO) -> None:
+        """
+        Write the document to a text stream, one segment at a time.
+
+        Args:
+            stream: The stream, e.g. sys.stdout
+        """
+        for segment in self.segments():
+            stream.write(segment)
+
+    def close(self) -> None:
+        """Release the memory map and remove the file."""
+        self.finish()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove spill file {self.path}: {e}")
+
+
+def markdown_lines(markdown: Union[str, MarkdownSpill]) -> Iterator[str]:
+    """
+    Iterate over the lines of a document held in a string or in a spill file.
+
+    Args:
+        markdown: The document in Markdown format
+
+    Returns:
+        An iterator over the lines, without their line endings
+    """
+    if isinstance(markdown, MarkdownSpill):
+        return markdown.lines()
+    return iter(markdown.splitlines())
+
+
+def markdown_segments(markdown: Union[str, MarkdownSpill]) -> Iterator[str]:
+    """
+    Iterate over the segments (pages or page ranges) of a document held in a string or in a spill file.
+
+    Args:
+        markdown: The document in Markdown format
+
+    Returns:
+        An iterator over the segments, the whole string being a single segment
+    """
+    if isinstance(markdown, MarkdownSpill):
+        return markdown.segments()
+    return iter((markdown,))